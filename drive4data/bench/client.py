@@ -0,0 +1,78 @@
+import re
+
+import numpy as np
+from drive4data.db import StorageBackend
+from drive4data.db.sqlite import ResultSet
+
+__author__ = "Niko Fink"
+
+LAST_RE = re.compile(r"^SELECT last\(\w+\) FROM (\w+)(?: WHERE (.+))?$")
+
+
+# In-process stand-in for the InfluxDBStreamingClient, which serves samples from numpy columns and only counts the
+# points that are written. Queries are only supported as far as the sample cache and the benchmarks need them:
+# a series is selected by the selector returned from list_series, without any further conditions.
+class FakeInfluxDBClient(StorageBackend):
+    def __init__(self, time_epoch='n', keep_points=False):
+        self.time_epoch = time_epoch
+        self.keep_points = keep_points
+        self.series = {}  # measurement -> [(sname, sselector, columns)]
+        self.points = []
+        self.written = 0
+        self.writes = 0
+
+    def add_series(self, measurement, tags, columns):
+        sname = ",".join([measurement] + ["{}={}".format(k, v) for k, v in sorted(tags.items())])
+        sselector = " AND ".join("{}='{}'".format(k, v) for k, v in sorted(tags.items()))
+        self.series.setdefault(measurement, []).append((sname, sselector, columns))
+
+    def list_series(self, measurement):
+        return iter([(sname, sselector) for sname, sselector, columns in self.series.get(measurement, [])])
+
+    def stream_params(self, measurement, fields="*", where="", group_order_by="", **kwargs):
+        columns = next((c for sname, sselector, c in self.series.get(measurement, []) if sselector == where), None)
+        if columns is None:
+            raise ValueError("Unsupported query on {}: {}".format(measurement, where))
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(",")]
+        if "*" in fields:
+            fields = list(columns.keys())
+        return (self.row(columns, fields, i) for i in range(len(columns['time'])))
+
+    def row(self, columns, fields, i):
+        row = {}
+        for field in fields:
+            col = columns.get(field)
+            if isinstance(col, np.ndarray):
+                value = col[i].item()
+                row[field] = None if isinstance(value, float) and value != value else value
+            else:
+                row[field] = col  # tags are stored as single values
+        return row
+
+    def write_points(self, points, tags=None, time_precision=None, **kwargs):
+        self.writes += 1
+        if self.keep_points:
+            points = list(points)
+            self.points.extend(points)
+            self.written += len(points)
+        else:
+            self.written += sum(1 for _ in points)
+        return True
+
+    def query(self, query, **kwargs):
+        # only the last time of a series, as queried by the sample cache, other queries have no effect
+        m = LAST_RE.match(query)
+        if not m:
+            return ResultSet([])
+        measurement, where = m.groups()
+        for sname, sselector, columns in self.series.get(measurement, []):
+            if sselector == (where or "") and len(columns['time']):
+                return ResultSet([((measurement, None), [{'time': columns['time'][-1].item()}])])
+        return ResultSet([])
+
+    def drop_measurement(self, measurement):
+        pass
+
+    def close(self):
+        pass
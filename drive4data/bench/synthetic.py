@@ -0,0 +1,176 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+__author__ = "Niko Fink"
+
+# the fields of the simulated samples with the units that are stripped by SamplesImporter.extract_header
+SAMPLE_FIELDS = [('veh_speed', 'km/h'), ('hvbatt_soc', '%'), ('charger_acvoltage', 'V'), ('ischarging', ''),
+                 ('ac_hvpower', 'kW'), ('veh_odometer', 'km'), ('outside_air_temp', 'C'), ('fuel_rate', 'l/h'),
+                 ('hvbatt_current', 'A'), ('hvbatt_voltage', 'V'), ('engine_rpm', 'rpm'), ('gps_lat_deg', 'deg'),
+                 ('gps_lon_deg', 'deg'), ('gps_speed_kph', 'km/h')]
+FIELDS = [name for name, unit in SAMPLE_FIELDS]
+VEHICLES = [("Chevrolet", "Volt", 2013), ("Toyota", "Prius PHV", 2012), ("Ford", "C-Max Energi", 2014)]
+
+START = datetime(2014, 3, 10, 6, 0, 0)  # UTC, after the start of DST and far enough from its end
+HOME = (43.4723, -80.5449)
+LOCAL = pytz.timezone("Canada/Eastern")
+
+
+# A simple vehicle model that generates one session per file: either a trip sampled every second or a charging
+# session sampled every 10 seconds, separated by parking times without samples. All values only depend on the seed.
+class VehicleSimulation(object):
+    def __init__(self, participant, seed=0, start=START):
+        self.participant = participant
+        self.rng = np.random.RandomState(seed * 100 + participant)
+        self.make, self.model, self.year = VEHICLES[participant % len(VEHICLES)]
+        self.car_id = "SYN{:02d}{:012d}".format(participant, seed)
+        self.time = start
+        self.soc = 90.0
+        self.odometer = 10000.0 * participant
+        self.trips = []
+
+    def sessions(self, rows):
+        # yields (base_time, reltime in ms, columns) until `rows` samples were generated
+        while rows > 0:
+            self.time += timedelta(seconds=int(self.rng.uniform(0.5, 12) * 3600))
+            if self.soc < 40 or self.rng.uniform() < 0.3:
+                session = self.charge()
+            else:
+                session = self.drive()
+            reltime, columns = session
+            count = min(len(reltime), rows)
+            rows -= count
+            yield self.time, reltime[:count], {f: col[:count] for f, col in columns.items()}
+            self.time += timedelta(milliseconds=int(reltime[count - 1]))
+
+    def drive(self):
+        rng = self.rng
+        duration = int(rng.uniform(5, 60) * 60)
+        reltime = np.arange(duration, dtype=np.int64) * 1000
+        # speed is a clipped random walk, which starts and ends standing still
+        speed = np.clip(np.cumsum(rng.normal(0.3, 3, duration)), 0, 120)
+        speed *= np.minimum(1, np.minimum(np.arange(duration), np.arange(duration)[::-1]) / 30)
+        distance = np.cumsum(speed) / 3600
+        soc = np.maximum(self.soc - distance * 0.4, 15)
+        heading = np.cumsum(rng.normal(0, 0.05, duration))
+        lat = HOME[0] + np.cumsum(np.cos(heading) * speed) / 3600 / 111
+        lon = HOME[1] + np.cumsum(np.sin(heading) * speed) / 3600 / 80
+        # without a GPS fix, the logger reports 0/0
+        no_fix = rng.uniform(size=duration) < 0.05
+        engine = soc <= 15
+        columns = {
+            'veh_speed': speed,
+            'hvbatt_soc': soc,
+            'charger_acvoltage': np.zeros(duration),
+            'ischarging': np.zeros(duration),
+            'ac_hvpower': np.zeros(duration),
+            'veh_odometer': self.odometer + distance,
+            'outside_air_temp': np.full(duration, round(rng.uniform(-20, 30), 1)),
+            'fuel_rate': np.where(engine, speed * 0.06, 0),
+            'hvbatt_current': np.where(engine, 0, speed * 0.8) + rng.normal(0, 2, duration),
+            'hvbatt_voltage': 360 - (100 - soc) * 0.5,
+            'engine_rpm': np.where(engine, 800 + speed * 25, 0),
+            'gps_lat_deg': np.where(no_fix, 0, lat),
+            'gps_lon_deg': np.where(no_fix, 0, lon),
+            'gps_speed_kph': np.where(no_fix, 0, speed),
+        }
+        self.trips.append((self.time, duration, float(distance[-1]), self.soc, float(soc[-1]),
+                           (self.soc - float(soc[-1])) * 0.16, float(columns['fuel_rate'].sum() / 3600)))
+        self.soc = float(soc[-1])
+        self.odometer += float(distance[-1])
+        return reltime, columns
+
+    def charge(self):
+        rng = self.rng
+        voltage = 240.0 if rng.uniform() < 0.5 else 120.0
+        power = 3.3 if voltage > 200 else 1.4
+        count = int((100 - self.soc) / power * 6 * rng.uniform(0.5, 1)) + 1
+        reltime = np.arange(count, dtype=np.int64) * 10000
+        soc = np.minimum(self.soc + np.arange(count) * power / 6 / 3.6, 100)
+        columns = {
+            'veh_speed': np.zeros(count),
+            'hvbatt_soc': soc,
+            'charger_acvoltage': np.full(count, voltage),
+            'ischarging': np.ones(count),
+            'ac_hvpower': np.full(count, power),
+            'veh_odometer': np.full(count, self.odometer),
+            'outside_air_temp': np.full(count, round(rng.uniform(-20, 30), 1)),
+            'fuel_rate': np.zeros(count),
+            'hvbatt_current': np.full(count, -power * 1000 / 360),
+            'hvbatt_voltage': 360 - (100 - soc) * 0.5,
+            'engine_rpm': np.zeros(count),
+            'gps_lat_deg': np.full(count, HOME[0]),
+            'gps_lon_deg': np.full(count, HOME[1]),
+            'gps_speed_kph': np.zeros(count),
+        }
+        self.soc = float(soc[-1])
+        return reltime, columns
+
+
+def participant_dir(participant):
+    return "Participant {:02d}".format(participant)
+
+
+def generate_samples(participant, rows, seed=0):
+    # the samples of a participant as they are returned from the DB: time in ns since the epoch and NaN for missing
+    sim = VehicleSimulation(participant, seed)
+    times, columns = [], {f: [] for f in FIELDS}
+    for base_time, reltime, session in sim.sessions(rows):
+        times.append(np.datetime64(base_time, 'ns').astype(np.int64) + reltime * 1000000)
+        for field, col in session.items():
+            columns[field].append(col)
+    res = {'time': np.concatenate(times), 'participant': str(participant)}
+    res.update({f: np.concatenate(c) for f, c in columns.items()})
+    return res
+
+
+def write_dataset(root, participants=2, rows=20000, seed=0):
+    # writes `rows` samples per participant into root/Participants and their trips into root/Trip Summaries,
+    # in the same format as the original archive, returns the number of files and bytes
+    files, size = 0, 0
+    for participant in range(1, participants + 1):
+        sim = VehicleSimulation(participant, seed)
+        sdir = os.path.join(root, "Participants", participant_dir(participant))
+        os.makedirs(sdir, exist_ok=True)
+        for nr, (base_time, reltime, columns) in enumerate(sim.sessions(rows)):
+            path = os.path.join(sdir, "{}-{:05d}.csv".format(sim.car_id, nr))
+            write_samples_file(path, base_time, sim.car_id, reltime, columns)
+            files += 1
+            size += os.stat(path).st_size
+
+        tdir = os.path.join(root, "Trip Summaries", participant_dir(participant))
+        os.makedirs(tdir, exist_ok=True)
+        path = os.path.join(tdir, "trips-{}.csv".format(sim.car_id))
+        write_trips_file(path, sim)
+        files += 1
+        size += os.stat(path).st_size
+    return files, size
+
+
+def write_samples_file(path, base_time, car_id, reltime, columns):
+    with open(path, "wt", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Timestamp"] + ["{}[{}]".format(name.title(), unit) for name, unit in SAMPLE_FIELDS])
+        writer.writerow([base_time.strftime("%m/%d/%Y %I:%M:%S %p"), car_id, ""])
+        values = np.column_stack([columns[f] for f in FIELDS]).round(6).tolist()
+        writer.writerows([t] + v for t, v in zip(reltime.tolist(), values))
+
+
+def write_trips_file(path, sim):
+    with open(path, "wt", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Vehicle', 'Make', 'Model', 'Year', 'Trip Id', 'Date', 'Duration', 'Trip Distance (km)',
+                         'Starting SOC (%)', 'Ending SOC (%)', 'Electrical Energy Consumed (kWh)',
+                         'Gasoline Consumed'])
+        for nr, (start, duration, distance, soc_start, soc_end, energy, gasoline) in enumerate(sim.trips):
+            local = pytz.utc.localize(start).astimezone(LOCAL).replace(tzinfo=None)
+            if local.hour in (1, 2):
+                continue  # SummaryImporter can't localize times that are ambiguous or missing due to DST
+            writer.writerow([sim.car_id, sim.make, sim.model, sim.year, nr,
+                             local.strftime("%B %d, %Y %I:%M:%S %p"),
+                             str(timedelta(seconds=duration)).zfill(8), round(distance, 2), round(soc_start, 1),
+                             round(soc_end, 1), round(energy, 3), round(gasoline, 3)])
@@ -0,0 +1,231 @@
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+from drive4data.bench.client import FakeInfluxDBClient
+from drive4data.bench.synthetic import generate_samples, write_dataset
+from drive4data.data.cache import SeriesCache
+from drive4data.data.charge import BATCH_DETECTORS, CYCLE_DETECTORS, CYCLE_FIELDS, preprocess_cycle
+from drive4data.data.trips import TRIP_FIELDS, preprocess_trip
+from drive4data.initialization import pre_import
+from drive4data.initialization.importer import SamplesImporter, SummaryImporter
+from drive4data.util.progress import TaskProgress
+from iss4e.util import BraceMessage as __
+from iss4e.util.config import load_config
+from tabulate import tabulate
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+NO_PROGRESS = TaskProgress(None, None)
+
+
+class BenchSamplesImporter(SamplesImporter):
+    def new_client(self):
+        return contextlib.closing(FakeInfluxDBClient())
+
+
+class BenchSummaryImporter(SummaryImporter):
+    def new_client(self):
+        return contextlib.closing(FakeInfluxDBClient())
+
+
+def bench_analyze(env):
+    pre_import.analyze(env['samples'], processes=env['processes'], cache_file=None)
+    return env['sample_files'], env['samples_bytes']
+
+
+def bench_import(env, importer_cls, kind, **kwargs):
+    importer = importer_cls({}, "bench", processes=env['processes'], batch_size=env['batch_size'],
+                            checkpoint_file=os.path.join(env['tmp'], "checkpoint{}.journal"),
+                            plan_file=os.path.join(env['tmp'], "plan.json"), **kwargs)
+    # start from scratch instead of resuming the previous run
+    if os.path.isfile(importer.plan_file):
+        os.remove(importer.plan_file)
+    rows = importer.do_import(env[kind])
+    return rows, env[kind + '_bytes']
+
+
+def bench_trips(env, batch):
+    client, cache = env['client'], env['cache']
+    count = 0
+    for nr, (sname, sselector) in enumerate(client.list_series("samples")):
+        preprocess_trip(nr, client, NO_PROGRESS, sname, sselector, cache=cache, batch=batch)
+        count += env['rows']
+    return count, None
+
+
+def bench_cycles(env, detector_index, batch):
+    client, cache = env['client'], env['cache']
+    attr, where, mask, detector_cls = CYCLE_DETECTORS[detector_index]
+    fields = ["time", "participant", "hvbatt_soc", "veh_speed"]
+    if attr not in fields:
+        fields.append(attr)
+    if batch:
+        detector_cls = BATCH_DETECTORS.get(detector_cls, detector_cls)
+    count = 0
+    for nr, (sname, sselector) in enumerate(client.list_series("samples")):
+        detector = detector_cls(time_epoch=client.time_epoch)
+        preprocess_cycle(nr, client, NO_PROGRESS, sname, sselector, (where, mask), fields, detector, cache=cache)
+        count += env['rows']
+    return count, None
+
+
+def benchmarks():
+    # name -> (function, arguments, keyword arguments), the names are stable so that reports can be compared
+    res = {
+        "pre_import.analyze": (bench_analyze, (), {}),
+        "import.samples": (bench_import, (BenchSamplesImporter, "samples"), {}),
+        "import.samples_columnar": (bench_import, (BenchSamplesImporter, "samples"), {'columnar': True}),
+        "import.samples_pipelined": (bench_import, (BenchSamplesImporter, "samples"), {'writers': 2}),
+        "import.summaries": (bench_import, (BenchSummaryImporter, "trips"), {}),
+        "detect.trips": (bench_trips, (False,), {}),
+        "detect.trips_batch": (bench_trips, (True,), {}),
+    }
+    for i, (attr, where, mask, detector_cls) in enumerate(CYCLE_DETECTORS):
+        res["detect.cycles_{}".format(attr)] = (bench_cycles, (i, False), {})
+        res["detect.cycles_{}_batch".format(attr)] = (bench_cycles, (i, True), {})
+    return res
+
+
+def run_repeated(conn, env, func, args, kwargs, repeat):
+    # runs in a fresh process, so that the peak memory only belongs to this benchmark
+    try:
+        if func in (bench_trips, bench_cycles):
+            env['client'] = fake_client(env)
+            env['cache'] = SeriesCache(env['cache_dir'], list(dict.fromkeys(TRIP_FIELDS + CYCLE_FIELDS)))
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items, size = func(env, *args, **kwargs)
+            times.append(time.perf_counter() - start)
+        rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        conn.send({'times': times, 'items': items, 'bytes': size, 'peak_rss_kb': rss})
+    except BaseException as e:
+        conn.send({'error': repr(e)})
+        raise
+    finally:
+        conn.close()
+
+
+def run_benchmark(env, name, func, args, kwargs, repeat):
+    recv, send = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=run_repeated, args=(send, env, func, args, kwargs, repeat), name=name)
+    proc.start()
+    send.close()
+    res = recv.recv() if recv.poll(None) else {'error': "no result"}
+    proc.join()
+    if 'error' in res:
+        logger.error(__("Benchmark {} failed: {}", name, res['error']))
+        return {'error': res['error']}
+
+    seconds = min(res['times'])
+    return {
+        'items': res['items'],
+        'seconds': round(seconds, 4),
+        'seconds_median': round(float(np.median(res['times'])), 4),
+        'items_per_s': round(res['items'] / seconds, 1) if seconds else None,
+        'mb_per_s': round(res['bytes'] / seconds / 2 ** 20, 2) if res['bytes'] and seconds else None,
+        'peak_rss_mb': round(res['peak_rss_kb'] / 1024, 1),
+    }
+
+
+def fake_client(env):
+    client = FakeInfluxDBClient(time_epoch='n')
+    for participant in range(1, env['participants'] + 1):
+        columns = generate_samples(participant, env['rows'], env['seed'])
+        client.add_series("samples", {'participant': columns['participant']}, columns)
+    return client
+
+
+def prepare(root, params):
+    # (re-)generates the synthetic data set and the sample cache if the parameters changed
+    meta_file = os.path.join(root, "dataset.json")
+    meta = None
+    if os.path.isfile(meta_file):
+        with open(meta_file, "rt") as f:
+            meta = json.load(f)
+    if not meta or meta['params'] != params:
+        logger.info(__("Generating synthetic data set in {} with {}", root, params))
+        for sub in ["Participants", "Trip Summaries", "cache"]:
+            if os.path.isdir(os.path.join(root, sub)):
+                shutil.rmtree(os.path.join(root, sub))
+        files, size = write_dataset(root, params['participants'], params['rows'], params['seed'])
+        sizes = {}
+        for sub in ["Participants", "Trip Summaries"]:
+            sizes[sub] = sum(os.stat(os.path.join(d, f)).st_size
+                             for d, dirs, fs in os.walk(os.path.join(root, sub)) for f in fs)
+        meta = {'params': params, 'files': files, 'bytes': size,
+                'sample_files': sum(len(fs) for d, dirs, fs in os.walk(os.path.join(root, "Participants"))),
+                'samples_bytes': sizes["Participants"], 'trips_bytes': sizes["Trip Summaries"]}
+
+        env = dict(params)
+        client = fake_client(env)
+        cache = SeriesCache(os.path.join(root, "cache"), list(dict.fromkeys(TRIP_FIELDS + CYCLE_FIELDS)))
+        for sname, sselector in client.list_series("samples"):
+            cache.update(client, sname, sselector)
+
+        with open(meta_file, "wt") as f:
+            json.dump(meta, f)
+    return meta
+
+
+def main():
+    config = load_config()
+    root = sys.argv[1] if len(sys.argv) > 1 else "tmp/benchmark"
+    params = {
+        'participants': config.get("drive4data.benchmark.participants", 2),
+        'rows': config.get("drive4data.benchmark.rows", 20000),
+        'seed': config.get("drive4data.benchmark.seed", 0),
+    }
+    repeat = config.get("drive4data.benchmark.repeat", 3)
+    only = config.get("drive4data.benchmark.only", None)
+
+    os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+    os.makedirs("out", exist_ok=True)
+    meta = prepare(root, params)
+    env = dict(params, **meta)
+    env.update({
+        'samples': os.path.join(root, "Participants"),
+        'trips': os.path.join(root, "Trip Summaries"),
+        'cache_dir': os.path.join(root, "cache"),
+        'tmp': os.path.join(root, "tmp"),
+        'processes': config.get("drive4data.benchmark.processes", 4),
+        'batch_size': config.get("drive4data.import.batch_size", None),
+    })
+    del env['params']
+
+    results = {}
+    for name, (func, args, kwargs) in sorted(benchmarks().items()):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        logger.info(__("Running {}", name))
+        results[name] = run_benchmark(env, name, func, args, kwargs, repeat)
+
+    report = {
+        'params': dict(params, repeat=repeat, processes=env['processes'], batch_size=env['batch_size']),
+        'dataset': {'files': meta['files'], 'bytes': meta['bytes']},
+        'platform': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                     'cpus': os.cpu_count()},
+        'results': results,
+    }
+    with open("out/benchmark.json", "wt") as f:
+        json.dump(report, f, sort_keys=True, indent=4, separators=(',', ': '))
+    logger.info(__("Benchmark results written to {}:\n{}", os.path.join(os.getcwd(), "out/benchmark.json"), tabulate(
+        [[name, r.get('items'), r.get('seconds'), r.get('items_per_s'), r.get('mb_per_s'), r.get('peak_rss_mb')]
+         for name, r in sorted(results.items())],
+        headers=["benchmark", "items", "s", "items/s", "MB/s", "peak RSS MB"],
+        floatfmt=("", "", ".4f", ".0f", ".2f", ".1f"))))
+
+
+if __name__ == "__main__":
+    main()
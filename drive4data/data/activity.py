@@ -1,8 +1,13 @@
+import abc
+import bisect
 import itertools
 import sys
 from datetime import timedelta
 from typing import List
 
+import numpy as np
+from drive4data.util.stats import RunningStats
+from drive4data.util.timestamps import to_epoch_units
 from iss4e.db.influxdb import TO_SECONDS
 from webike.util.activity import ActivityDetection, Cycle, MergeMixin
 
@@ -14,44 +19,73 @@ class InfluxActivityDetection(MergeMixin, ActivityDetection):
         self.epoch = time_epoch
         self.min_sample_count = min_sample_count
         self.min_cycle_duration_s = min_cycle_duration / timedelta(seconds=1)
-        self.max_merge_gap = max_merge_gap
+        # the thresholds are integer differences of sample times, which can be compared without any conversion
+        self.min_cycle_duration = to_epoch_units(min_cycle_duration, time_epoch)
+        self.max_merge_gap = to_epoch_units(max_merge_gap, time_epoch)
         super().__init__(**kwargs)
 
+    def new_stats(self):
+        return CycleStats()
+
     def accumulate_samples(self, new_sample, accumulator):
-        if 'avg' in accumulator:
-            accumulator['avg'] = (accumulator['avg'] + new_sample[self.attr]) / 2
-        else:
-            accumulator['avg'] = float(new_sample[self.attr])
+        if not accumulator:  # ActivityDetection starts with an empty dict
+            accumulator = self.new_stats()
+
+        accumulator.value.add(new_sample[self.attr])
+        accumulator.cnt += 1
+        return accumulator
+
+    def accumulate_segment(self, columns, lo, hi, accumulator):
+        # same as calling accumulate_samples for samples lo until excluding hi, but on whole columns
+        if not accumulator:
+            accumulator = self.new_stats()
 
-        if 'cnt' not in accumulator:
-            accumulator['cnt'] = 0
-        accumulator['cnt'] += 1
+        accumulator.value.add_many(get_column(columns, self.attr, lo, hi))
+        accumulator.cnt += hi - lo
         return accumulator
 
     def merge_stats(self, stats1, stats2):
-        return {
-            'avg': (stats1['avg'] + stats2['avg']) / 2,
-            'cnt': stats1['cnt'] + stats2['cnt'],
-        }
+        stats = self.new_stats()
+        stats.value = stats1.value.merge(stats2.value)
+        stats.cnt = stats1.cnt + stats2.cnt
+        return stats
 
     def check_reject_reason(self, cycle):
-        if cycle.stats['cnt'] < self.min_sample_count:
+        if cycle.stats.cnt < self.min_sample_count:
             return "acc_cnt<{}".format(self.min_sample_count)
-        elif self.get_duration(cycle.start, cycle.end) < self.min_cycle_duration_s:
+        elif self.time_diff(cycle.start, cycle.end) < self.min_cycle_duration:
             return "duration<{}s".format(self.min_cycle_duration_s)
         else:
             return None
 
+    def time_diff(self, first, second):
+        # in units of the time epoch
+        diff = second['time'] - first['time']
+        assert diff >= 0, "second sample {} happened before first {}".format(second, first)
+        return diff
+
     def get_duration(self, first, second):
-        dur = (second['time'] - first['time']) * TO_SECONDS[self.epoch]
-        assert dur >= 0, "second sample {} happened before first {}".format(second, first)
-        return dur
+        return self.time_diff(first, second) * TO_SECONDS[self.epoch]
 
     def extract_cycle_time(self, cycle: Cycle):
         return cycle.start['time'], cycle.end['time']
 
     def can_merge_times(self, last_start, last_end, new_start, new_end):
-        return timedelta(seconds=(new_start - last_end) * TO_SECONDS[self.epoch]) < self.max_merge_gap
+        return new_start - last_end < self.max_merge_gap
+
+    def watermark(self, cycles, cycles_disc):
+        # where an incremental run can continue: the start of the last cycle, as detection is idle right before it,
+        # and the state needed to detect that cycle again when the detector is restarted with its first sample
+        if not cycles and not cycles_disc:
+            return None
+        last = max(cycles + cycles_disc, key=lambda cycle: cycle.start['time'])
+        return {'time': last.start['time'], 'state': self.resume_state(last)}
+
+    def resume_state(self, cycle):
+        return {}
+
+    def restore_state(self, state):
+        pass
 
     def cycles_to_timeseries(self, cycles: List[Cycle], measurement):
         return itertools.chain.from_iterable(self.cycle_to_events(cycle, measurement) for cycle in cycles)
@@ -69,13 +103,28 @@ class InfluxActivityDetection(MergeMixin, ActivityDetection):
                     'duration': int(cycle.end['time'] - cycle.start['time']),
                     'started': is_start,
                     'discarded_reason': cycle.reject_reason,
-                    'value': float(cycle.stats['avg']),
-                    'sample_count': int(cycle.stats['cnt'])
+                    'value': float(cycle.stats.value.mean),
+                    'sample_count': int(cycle.stats.cnt)
                 }
             }
 
 
+# Statistics accumulated for a single cycle. Uses slots instead of a dict with string keys, as one of these is kept
+# for each cycle and updated with every sample. Detectors that need further values use a subclass with more slots.
+class CycleStats(object):
+    __slots__ = ('value', 'cnt', 'soc', 'memorized_values', 'batch_next')
+
+    def __init__(self):
+        self.value = RunningStats()  # of the detected attribute
+        self.cnt = 0
+        self.soc = None
+        self.memorized_values = None
+        self.batch_next = None
+
+
 class ValueMemory(object):
+    __slots__ = ('name', 'save_first', 'save_last', 'first', 'last')
+
     def __init__(self, name, save_first=None, save_last=None):
         self.name = name
         self.save_first = save_first
@@ -94,6 +143,16 @@ class ValueMemory(object):
             self.last = sample
         return self
 
+    def update_segment(self, columns, lo, hi):
+        if self.name in columns:
+            values = get_column(columns, self.name, lo, hi)
+            valid = np.flatnonzero(~np.isnan(values) & (values < sys.float_info.max))
+            if len(valid):
+                if not self.first:
+                    self.first = RowView(columns, lo + int(valid[0]))
+                self.last = RowView(columns, lo + int(valid[-1]))
+        return self
+
     def merge(self, later):
         assert later.name == self.name
         merged = self.copy()
@@ -126,28 +185,33 @@ class ValueMemoryMixin(object):
     def accumulate_samples(self, new_sample, accumulator):
         accumulator = super().accumulate_samples(new_sample, accumulator)
 
-        if 'memorized_values' not in accumulator:
-            accumulator['memorized_values'] = {}
-            for mem in self.memorized_values:
-                accumulator['memorized_values'][mem.name] = mem.copy()
-        for mem in accumulator['memorized_values'].values():
+        # a list in the same order as self.memorized_values
+        if accumulator.memorized_values is None:
+            accumulator.memorized_values = [mem.copy() for mem in self.memorized_values]
+        for mem in accumulator.memorized_values:
             mem.update(new_sample)
 
         return accumulator
 
-    def merge_stats(self, stats1, stats2):
-        stats = super().merge_stats(stats1, stats2)
+    def accumulate_segment(self, columns, lo, hi, accumulator):
+        accumulator = super().accumulate_segment(columns, lo, hi, accumulator)
+
+        if accumulator.memorized_values is None:
+            accumulator.memorized_values = [mem.copy() for mem in self.memorized_values]
+        for mem in accumulator.memorized_values:
+            mem.update_segment(columns, lo, hi)
 
-        stats['memorized_values'] = {}
-        mem1, mem2 = stats1['memorized_values'], stats2['memorized_values']
-        for key in mem1.keys() & mem2.keys():
-            stats['memorized_values'][key] = mem1[key].merge(mem2[key])
+        return accumulator
 
+    def merge_stats(self, stats1, stats2):
+        stats = super().merge_stats(stats1, stats2)
+        stats.memorized_values = [mem1.merge(mem2) for mem1, mem2 in
+                                  zip(stats1.memorized_values, stats2.memorized_values)]
         return stats
 
     def cycle_to_events(self, cycle: Cycle, measurement=""):
         data = {}
-        for mem in cycle.stats['memorized_values'].values():
+        for mem in cycle.stats.memorized_values:
             if mem.save_first:
                 data[mem.save_first] = mem.first_value()
             if mem.save_last:
@@ -155,3 +219,225 @@ class ValueMemoryMixin(object):
         for event in super().cycle_to_events(cycle, measurement):
             event['fields'].update(data)
             yield event
+
+
+class RowView(object):
+    # a single sample of a set of numpy columns that can be used like the sample dicts returned by the DB
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    def __getitem__(self, key):
+        col = self.columns[key]
+        if not isinstance(col, np.ndarray):
+            return col  # tags have the same value for the whole series
+        value = col[self.index].item()
+        return None if value != value else value  # missing values are NaN in the columns, but None in the DB
+
+    def get(self, key, default=None):
+        return self[key] if key in self.columns else default
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __repr__(self):
+        return "RowView({})".format({key: self[key] for key in self.columns})
+
+
+# A sample with a fixed set of fields that can be used like the sample dicts returned by the DB, but stores its values
+# in slots, which takes considerably less memory than a dict per sample. Use sample_class to get a subclass for a
+# certain set of fields.
+class Sample(object):
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for key, value in zip(self.__slots__, values):
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key, None)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def copy(self):
+        copy = self.__class__.__new__(self.__class__)
+        for key in self.keys():
+            setattr(copy, key, getattr(self, key))
+        return copy
+
+    def __repr__(self):
+        return "Sample({})".format({key: self[key] for key in self.keys()})
+
+
+_sample_classes = {}
+
+
+def sample_class(fields, extra=()):
+    # `extra` are fields that are not set initially, but may be added later on, e.g. by the detectors
+    slots = tuple(fields) + tuple(f for f in extra if f not in fields)
+    if slots not in _sample_classes:
+        _sample_classes[slots] = type("Sample", (Sample,), {'__slots__': slots})
+    return _sample_classes[slots]
+
+
+def get_column(columns, name, lo, hi):
+    # the values of samples lo until excluding hi as floats, NaN if the column is missing
+    if hi is None:
+        hi = len(columns['time'])
+    if name not in columns:
+        return np.full(hi - lo, np.nan)
+    return np.asarray(columns[name][lo:hi], dtype=float)
+
+
+def split_ranges(gaps, max_gap, chunk_size):
+    # ranges lo until excluding hi of at least chunk_size samples (except for the last one), which only start at
+    # samples whose gap to the previous sample is larger than max_gap
+    bounds = [0]
+    for idx in np.flatnonzero(np.asarray(gaps) > max_gap).tolist():
+        if idx - bounds[-1] >= chunk_size:
+            bounds.append(idx)
+    bounds.append(len(gaps))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def sum_chunk_results(results):
+    # adds up the counts of all chunks of the same series, identified by all but the last two values of each result
+    data = {}
+    for res in results:
+        key, counts = tuple(res[:-2]), res[-2:]
+        data[key] = [a + b for a, b in zip(data.get(key, (0, 0)), counts)]
+    return [list(key) + counts for key, counts in data.items()]
+
+
+def next_true(mask):
+    # for each index i, the smallest index j >= i with mask[j] set or len(mask) if there is none
+    idx = np.flatnonzero(mask)
+    return np.append(idx, len(mask))[np.searchsorted(idx, np.arange(len(mask) + 1))].tolist()
+
+
+# Detects cycles on numpy columns instead of a stream of sample dicts. Subclasses compute the results of is_start and
+# is_end for all samples at once in start_mask and end_mask. The underlying ActivityDetection is then only fed with the
+# samples where its state could change and the samples right before them, while the stats of the skipped samples are
+# computed by accumulate_segment.
+class BatchDetectionMixin(metaclass=abc.ABCMeta):
+    def detect_columns(self, columns):
+        columns = self.prepare_columns(dict(columns))
+        return self.detect_prepared(columns, self.start_mask(columns), self.end_mask(columns))
+
+    def detect_prepared(self, columns, starts, ends):
+        self.columns, self.starts, self.ends = columns, starts, ends
+        self.in_cycle = False
+        try:
+            return self(self.relevant_samples(len(columns['time'])))
+        finally:
+            self.columns = self.starts = self.ends = None
+
+    def split_columns(self, columns, chunk_size):
+        # Split the columns into ranges of about chunk_size samples that can be passed to detect_prepared separately,
+        # e.g. on different workers, and together yield the same cycles as detect_columns on the whole columns.
+        # Ranges only start after gaps longer than split_gap, which end any cycle and are too long for cycles to be
+        # merged across them. If the previous range ends within a cycle, the first sample of the next range only ends
+        # that cycle and must not start a new one.
+        columns = self.prepare_columns(dict(columns))
+        starts, ends = self.start_mask(columns), self.end_mask(columns)
+        ranges = split_ranges(self.time_gaps(columns), self.split_gap(), chunk_size)
+        in_cycle = self.cycle_states(starts, ends, [lo - 1 for lo, hi in ranges])
+        for (lo, hi), prev_in_cycle in zip(ranges, in_cycle):
+            chunk_starts = np.array(starts[lo:hi])
+            if prev_in_cycle:
+                assert ends[lo], "range {}-{} doesn't start after a gap that ends all cycles".format(lo, hi)
+                chunk_starts[0] = False
+            chunk = {f: col[lo:hi] if isinstance(col, np.ndarray) else col for f, col in columns.items()}
+            yield chunk, chunk_starts, np.array(ends[lo:hi])
+
+    def split_gap(self):
+        # the minimal gap between two samples in epoch units after which the detector always ends the current cycle
+        # and doesn't merge cycles across
+        return self.max_merge_gap
+
+    def cycle_states(self, starts, ends, indices):
+        # for each index, whether it is part of a cycle that doesn't end at it, i.e. whether detection is within
+        # a cycle after processing it. Only follows the transitions and doesn't accumulate any values.
+        count = len(starts)
+        next_start, next_end = next_true(starts), next_true(ends)
+        cycle_starts, cycle_ends = [], []
+        i = next_start[0]
+        while i < count:
+            # the sample that ends the cycle is excluded from it and can't start a new one
+            end = next_end[i + 1]
+            cycle_starts.append(i)
+            cycle_ends.append(end)
+            if end >= count:
+                break
+            i = next_start[end + 1]
+        states = []
+        for idx in indices:
+            k = bisect.bisect_right(cycle_starts, idx) - 1
+            states.append(k >= 0 and idx < cycle_ends[k])
+        return states
+
+    def prepare_columns(self, columns):
+        return columns
+
+    @abc.abstractmethod
+    def start_mask(self, columns):
+        pass
+
+    @abc.abstractmethod
+    def end_mask(self, columns):
+        pass
+
+    def time_gaps(self, columns):
+        # the time since the previous sample in epoch units, as computed by time_diff(previous, sample)
+        time = np.asarray(columns['time'], dtype=np.int64)
+        gap = np.zeros(len(time), dtype=np.int64)
+        gap[1:] = np.diff(time)
+        assert (gap >= 0).all(), "samples are not ordered by time"
+        return gap
+
+    def relevant_samples(self, count):
+        if not count:
+            return
+        next_start, next_end = next_true(self.starts), next_true(self.ends)
+        i = 0
+        while True:
+            yield RowView(self.columns, i)
+            if i == count - 1:
+                break
+            # skip to the next sample that could change the state, but also yield its predecessor as `previous`
+            nxt = (next_end if self.in_cycle else next_start)[i + 1]
+            if nxt >= count:
+                # the state won't change any more, only the last sample is needed to accumulate the remaining ones
+                nxt = count - 1
+            elif nxt - 1 > i:
+                yield RowView(self.columns, nxt - 1)
+            i = nxt
+
+    def is_start(self, sample, previous):
+        self.in_cycle = bool(self.starts[sample.index])
+        return self.in_cycle
+
+    def is_end(self, sample, previous):
+        self.in_cycle = not self.ends[sample.index]
+        return not self.in_cycle
+
+    def accumulate_samples(self, new_sample, accumulator):
+        # also accumulate all samples that were skipped since the last call
+        lo = accumulator.batch_next if accumulator else new_sample.index
+        accumulator = self.accumulate_segment(self.columns, lo, new_sample.index + 1, accumulator)
+        accumulator.batch_next = new_sample.index + 1
+        return accumulator
@@ -0,0 +1,141 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+from drive4data.data.activity import sample_class
+from iss4e.util import BraceMessage as __
+from iss4e.util import progress
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+TAGS = ['participant']
+
+
+def samples_to_columns(samples, fields, chunk_size=100000):
+    # collects a stream of sample dicts from the DB into numpy columns
+    fields = [f for f in fields if f not in ['time'] + TAGS]
+    samples = iter(samples)
+    times, tags, chunks = [], {}, {f: [] for f in fields}
+    for rows in iter(lambda: list(itertools.islice(samples, chunk_size)), []):
+        times.append(np.array([r['time'] for r in rows], dtype=np.int64))
+        for tag in TAGS:
+            tags.setdefault(tag, rows[0].get(tag))
+        for field, chunk in chunks.items():
+            chunk.append(np.array([r.get(field) for r in rows], dtype=float))  # None becomes NaN
+    columns = {'time': np.concatenate(times) if times else np.empty(0, dtype=np.int64)}
+    for field, chunk in chunks.items():
+        columns[field] = np.concatenate(chunk) if chunk else np.empty(0)
+    columns.update(tags)
+    return columns
+
+
+def columns_to_samples(columns, fields, mask=None, chunk_size=100000, extra=()):
+    # converts numpy columns back to samples, applying `mask` to one chunk at a time
+    fields = list(dict.fromkeys(f for f in fields if f in columns))
+    sample = sample_class(fields, extra)
+    for start in range(0, len(columns['time']), chunk_size):
+        chunk = {f: np.asarray(columns[f][start:start + chunk_size]) for f in fields if f not in TAGS}
+        if mask:
+            selected = mask(chunk)
+            chunk = {f: col[selected] for f, col in chunk.items()}
+        count = len(chunk['time'])
+        values = []
+        for field in fields:
+            if field in TAGS:
+                values.append(itertools.repeat(columns[field], count))
+                continue
+            col = chunk[field]
+            if col.dtype.kind == 'f':
+                # missing values are NaN in the columns, but None in the DB
+                obj = col.astype(object)
+                obj[np.isnan(col)] = None
+                col = obj
+            values.append(col.tolist())
+        for row in zip(*values):
+            yield sample(*row)
+
+
+# Local on-disk copy of the samples of each series, stored as one .npy column per field.
+# The cache of a series is only used as long as the last timestamp of the series in the DB doesn't change.
+class SeriesCache(object):
+    def __init__(self, root, fields, chunk_size=100000):
+        self.root = root
+        self.fields = [f for f in fields if f not in ['time'] + TAGS]
+        self.chunk_size = chunk_size
+
+    def series_dir(self, sname):
+        return os.path.join(self.root, hashlib.sha1(sname.encode()).hexdigest())
+
+    def load_meta(self, sname):
+        meta_file = os.path.join(self.series_dir(sname), "meta.json")
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file, "rt") as f:
+            return json.load(f)
+
+    def last_time(self, client, sselector):
+        # every sample has a source, so this is the time of the last sample of the series
+        res = client.query("SELECT last(source) FROM samples{}".format(" WHERE " + sselector if sselector else ""))
+        last = next(iter(res.get_points()), None)
+        return last['time'] if last else None
+
+    def is_valid(self, client, sname, sselector, fields=None):
+        meta = self.load_meta(sname)
+        return meta is not None and meta['sname'] == sname and meta['epoch'] == client.time_epoch \
+               and set(fields or self.fields) <= set(meta['fields']) \
+               and meta['last_time'] == self.last_time(client, sselector)
+
+    def update(self, client, sname, sselector):
+        if self.is_valid(client, sname, sselector):
+            logger.info(__("Cache of {} is up to date", sname))
+            return False
+
+        logger.info(__("Filling cache of {}", sname))
+        path = self.series_dir(sname)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        stream = client.stream_params("samples", fields=["time"] + TAGS + self.fields, where=sselector,
+                                      group_order_by="ORDER BY time ASC")
+        columns = samples_to_columns(progress(stream, delay=4), self.fields, self.chunk_size)
+        for field in ['time'] + self.fields:
+            np.save(os.path.join(path, field + ".npy"), columns[field])
+
+        # the meta file is written last, so an incomplete cache is never used
+        time = columns['time']
+        meta = {'sname': sname, 'epoch': client.time_epoch, 'fields': self.fields,
+                'tags': {tag: columns[tag] for tag in TAGS if tag in columns},
+                'count': len(time), 'last_time': int(time[-1]) if len(time) else None}
+        with open(os.path.join(path, "meta.json.tmp"), "wt") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        return True
+
+    def load(self, sname, fields):
+        path = self.series_dir(sname)
+        meta = self.load_meta(sname)
+        columns = {'time': np.load(os.path.join(path, "time.npy"), mmap_mode='r')}
+        for field in fields:
+            if field in TAGS:
+                columns[field] = meta['tags'].get(field)
+            elif field != 'time':
+                columns[field] = np.load(os.path.join(path, field + ".npy"), mmap_mode='r')
+        return columns
+
+    def columns(self, sname, fields, mask=None):
+        columns = self.load(sname, fields)
+        if mask:
+            selected = mask(columns)
+            columns = {f: col[selected] if isinstance(col, np.ndarray) else col for f, col in columns.items()}
+        return columns
+
+    def stream(self, sname, fields, mask=None, extra=()):
+        # yields the same samples that client.stream_params would return for the fields and the where clause
+        # that corresponds to `mask`
+        return columns_to_samples(self.load(sname, fields), fields, mask, self.chunk_size, extra)
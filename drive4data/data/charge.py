@@ -1,13 +1,25 @@
+import functools
+import itertools
 import logging
-from concurrent.futures import Executor
+from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import timedelta
-from multiprocessing.managers import SyncManager
+from queue import Queue, Full
 
-from drive4data.data.activity import InfluxActivityDetection
+import numpy as np
+
+from drive4data.data.activity import BatchDetectionMixin, InfluxActivityDetection, get_column, sum_chunk_results
+from drive4data.data.cache import columns_to_samples, samples_to_columns
 from drive4data.data.soc import SoCMixin
-from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient, join_selectors
+from drive4data.data.watermarks import delete_cycles, since_mask, since_where, watermark_time
+from drive4data.db import StorageBackend
+from drive4data.db.writer import BatchWriter
+from drive4data.util.instrument import flushing, instrumentation
+from drive4data.util.math import Differentiator, Smoother
+from drive4data.util.progress import ProgressBoard
+from drive4data.util.timestamps import to_epoch_units
+from iss4e.db.influxdb import join_selectors
 from iss4e.db.influxdb import TO_SECONDS
-from iss4e.util import BraceMessage as __, async_progress, progress
+from iss4e.util import BraceMessage as __
 from iss4e.util.math import differentiate, smooth
 from tabulate import tabulate
 from webike.util.activity import Cycle
@@ -15,14 +27,18 @@ from webike.util.activity import Cycle
 __author__ = "Niko Fink"
 logger = logging.getLogger(__name__)
 
+# fields that the detectors add to the samples
+DERIVED_FIELDS = ['last_movement', 'soc_smooth', 'soc_diff']
+
 
 class ChargeCycleDetection(SoCMixin, InfluxActivityDetection):
     def __init__(self, **kwargs):
         self.last_movement = 0
-        self.max_delay = kwargs.pop('max_delay', timedelta(hours=1) / timedelta(seconds=1))
+        max_delay = kwargs.pop('max_delay', timedelta(hours=1))
         kwargs.setdefault('max_merge_gap', timedelta(minutes=30))
         kwargs.setdefault('min_cycle_duration', timedelta(minutes=10))
         super().__init__(**kwargs)
+        self.max_delay = to_epoch_units(max_delay, self.epoch)
 
     def check_movement(self, sample):
         has_movement = sample.get('veh_speed') and sample['veh_speed'] > 0
@@ -37,7 +53,7 @@ class ChargeCycleDetection(SoCMixin, InfluxActivityDetection):
     def is_end(self, sample, previous):
         # we could also detect the end of charging when the SoC doesn't increase for a long time,
         # but that would be a lot of work and is not required right now
-        return self.check_movement(sample) or self.get_duration(previous, sample) > self.max_delay
+        return self.check_movement(sample) or self.time_diff(previous, sample) > self.max_delay
 
     def check_reject_reason(self, cycle: Cycle):
         assert cycle.start['last_movement'] == cycle.end['last_movement'], "Movement during cycle {}".format(cycle)
@@ -65,20 +81,52 @@ class ChargeCycleDetection(SoCMixin, InfluxActivityDetection):
             event['fields']['last_movement'] = cycle['last_movement']
             yield event
 
+    def resume_state(self, cycle):
+        state = super().resume_state(cycle)
+        # the vehicle doesn't move at the start of a cycle, so this is also the last movement before it
+        state['last_movement'] = cycle.start['last_movement']
+        return state
+
+    def restore_state(self, state):
+        super().restore_state(state)
+        self.last_movement = state['last_movement']
+
 
 class ChargeCycleDerivDetection(ChargeCycleDetection):
     def __init__(self, **kwargs):
         kwargs.setdefault('max_merge_gap', timedelta(hours=2))
         super().__init__(attr='soc_diff', **kwargs)
+        self.start_previous = {}
+        self.resume_previous = None
 
     def __call__(self, cycle_samples):
+        if self.resume_previous:
+            # continue smoothing and differentiating after the sample before the first one, which can't start a cycle
+            time, soc_smooth = self.resume_previous
+            cycle_samples = itertools.chain([{'time': time, 'hvbatt_soc': soc_smooth}], cycle_samples)
         cycle_samples = smooth(cycle_samples, 'hvbatt_soc', 'soc_smooth', alpha=0.95)
         cycle_samples = differentiate(cycle_samples, 'soc_smooth', 'soc_diff', attr_time='time',
                                       delta_time=TO_SECONDS['h'] / TO_SECONDS['n'])
         return super().__call__(cycle_samples)
 
     def is_start(self, sample, previous):
-        return super().is_start(sample, previous) and sample[self.attr] > 5
+        return self.remember_start(super().is_start(sample, previous) and sample[self.attr] > 5, sample, previous)
+
+    def remember_start(self, is_start, sample, previous):
+        # the smoothed value right before each cycle, which is needed to detect it again in an incremental run
+        if is_start:
+            self.start_previous[sample['time']] = None if previous is sample \
+                else [previous['time'], previous['soc_smooth']]
+        return is_start
+
+    def resume_state(self, cycle):
+        state = super().resume_state(cycle)
+        state['previous'] = self.start_previous.get(cycle.start['time'])
+        return state
+
+    def restore_state(self, state):
+        super().restore_state(state)
+        self.resume_previous = state['previous']
 
     def is_end(self, sample, previous):
         return super().is_end(sample, previous) or sample[self.attr] < 5
@@ -117,50 +165,374 @@ class ChargeCycleACHVPowerDetection(ChargeCycleDetection):
         return super().is_end(sample, previous) or sample[self.attr] <= 0
 
 
-def preprocess_cycles(client: InfluxDBClient, executor: Executor, manager: SyncManager, dry_run=False):
+class BatchChargeCycleMixin(BatchDetectionMixin):
+    def prepare_columns(self, columns):
+        self.moving = get_column(columns, 'veh_speed', 0, None) > 0
+        time = np.asarray(columns['time'])
+        columns['last_movement'] = np.maximum.accumulate(np.where(self.moving, time, self.last_movement))
+        if len(time):
+            self.last_movement = int(columns['last_movement'][-1])
+        return columns
+
+    def start_mask(self, columns):
+        return ~self.moving
+
+    def end_mask(self, columns):
+        return self.moving | (self.time_gaps(columns) > self.max_delay)
+
+    def split_gap(self):
+        return max(super().split_gap(), self.max_delay)
+
+
+class BatchChargeCycleACVoltageDetection(BatchChargeCycleMixin, ChargeCycleACVoltageDetection):
+    def start_mask(self, columns):
+        return super().start_mask(columns) & (get_column(columns, self.attr, 0, None) > 4)
+
+    def end_mask(self, columns):
+        return super().end_mask(columns) | (get_column(columns, self.attr, 0, None) < 4)
+
+
+class BatchChargeCycleIsChargingDetection(BatchChargeCycleMixin, ChargeCycleIsChargingDetection):
+    def start_mask(self, columns):
+        return super().start_mask(columns) & (get_column(columns, self.attr, 0, None) > 3)
+
+    def end_mask(self, columns):
+        return super().end_mask(columns) | (get_column(columns, self.attr, 0, None) < 3)
+
+
+class BatchChargeCycleACHVPowerDetection(BatchChargeCycleMixin, ChargeCycleACHVPowerDetection):
+    def start_mask(self, columns):
+        return super().start_mask(columns) & (get_column(columns, self.attr, 0, None) > 0)
+
+    def end_mask(self, columns):
+        return super().end_mask(columns) | (get_column(columns, self.attr, 0, None) <= 0)
+
+
+class BatchChargeCycleDerivDetection(BatchChargeCycleMixin, ChargeCycleDerivDetection):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.smoother = Smoother(alpha=0.95)
+        self.differentiator = Differentiator(delta_time=TO_SECONDS['h'] / TO_SECONDS['n'])
+
+    def __call__(self, cycle_samples):
+        # the samples are RowViews on columns that already contain soc_diff
+        return super(ChargeCycleDerivDetection, self).__call__(cycle_samples)
+
+    def restore_state(self, state):
+        super().restore_state(state)
+        if self.resume_previous:
+            time, soc_smooth = self.resume_previous
+            self.smoother.last = soc_smooth
+            self.differentiator.last_value, self.differentiator.last_time = soc_smooth, time
+
+    def is_start(self, sample, previous):
+        return self.remember_start(super().is_start(sample, previous), sample, previous)
+
+    def prepare_columns(self, columns):
+        columns = super().prepare_columns(columns)
+        columns['soc_smooth'] = self.smoother(columns['hvbatt_soc'])
+        columns['soc_diff'] = self.differentiator(columns['soc_smooth'], columns['time'])
+        return columns
+
+    def start_mask(self, columns):
+        return super().start_mask(columns) & (columns[self.attr] > 5)
+
+    def end_mask(self, columns):
+        return super().end_mask(columns) | (columns[self.attr] < 5)
+
+
+BATCH_DETECTORS = {
+    ChargeCycleACVoltageDetection: BatchChargeCycleACVoltageDetection,
+    ChargeCycleIsChargingDetection: BatchChargeCycleIsChargingDetection,
+    ChargeCycleACHVPowerDetection: BatchChargeCycleACHVPowerDetection,
+    ChargeCycleDerivDetection: BatchChargeCycleDerivDetection,
+}
+
+
+# the where clauses of the detectors, once as query for the DB and once as mask for the columns of the SeriesCache
+def acvoltage_where(columns):
+    return (columns['charger_acvoltage'] > 0) | (columns['veh_speed'] > 0)
+
+
+def ischarging_where(columns):
+    return (columns['ischarging'] > 0) | (columns['veh_speed'] > 0)
+
+
+def achvpower_where(columns):
+    return (columns['ac_hvpower'] > 0) | (columns['veh_speed'] > 0)
+
+
+def soc_where(columns):
+    return columns['hvbatt_soc'] < 200
+
+
+CYCLE_DETECTORS = [
+    ('charger_acvoltage', 'charger_acvoltage>0 OR veh_speed > 0', acvoltage_where, ChargeCycleACVoltageDetection),
+    ('ischarging', 'ischarging>0 OR veh_speed > 0', ischarging_where, ChargeCycleIsChargingDetection),
+    ('ac_hvpower', 'ac_hvpower>0 OR veh_speed > 0', achvpower_where, ChargeCycleACHVPowerDetection),
+    ('hvbatt_soc', 'hvbatt_soc<200', soc_where, ChargeCycleDerivDetection)
+]
+CYCLE_FIELDS = ["time", "participant", "hvbatt_soc", "veh_speed", "charger_acvoltage", "ischarging", "ac_hvpower"]
+
+
+def preprocess_cycles(client: StorageBackend, executor: Executor, board: ProgressBoard, dry_run=False, cache=None,
+                      single_pass=False, batch=False, chunk_size=None, watermarks=None):
+    # with watermarks, only the cycles since the last run are detected again, otherwise the measurement must be empty
     logger.info("Preprocessing charge cycles")
-    queue = manager.Queue()
-    series = client.list_series("samples")
-    futures = []
-    # TODO merge results of different detectors
-    for attr, where, detector in [
-        ('charger_acvoltage', 'charger_acvoltage>0 OR veh_speed > 0',
-         ChargeCycleACVoltageDetection(time_epoch=client.time_epoch)),
-        ('ischarging', 'ischarging>0 OR veh_speed > 0',
-         ChargeCycleIsChargingDetection(time_epoch=client.time_epoch)),
-        ('ac_hvpower', 'ac_hvpower>0 OR veh_speed > 0',
-         ChargeCycleACHVPowerDetection(time_epoch=client.time_epoch)),
-        ('hvbatt_soc', 'hvbatt_soc<200', ChargeCycleDerivDetection(time_epoch=client.time_epoch))
-    ]:
-        fields = ["time", "participant", "hvbatt_soc", "veh_speed"]
-        if attr not in fields:
-            fields.append(attr)
-        futures += [executor.submit(preprocess_cycle,
-                                    nr, client, queue, sname, join_selectors([sselector, where]),
-                                    fields, detector, dry_run)
-                    for nr, (sname, sselector) in enumerate(series)]
+    series = list(client.list_series("samples"))
+    incremental = watermarks is not None
+    attrs = [detector_cls(time_epoch=client.time_epoch).attr for attr, where, mask, detector_cls in CYCLE_DETECTORS]
+
+    def get_watermark(attr, sname):
+        return watermarks.get("charge_cycles", attr, sname) if incremental else None
+
+    submitted = []
+    if chunk_size and batch and cache:
+        for nr, (sname, sselector) in enumerate(series):
+            submitted += submit_cycle_chunks(nr, client, executor, board, sname, sselector, dry_run, cache,
+                                             chunk_size, incremental,
+                                             {attr: get_watermark(attr, sname) for attr in attrs})
+    elif single_pass:
+        for nr, (sname, sselector) in enumerate(series):
+            task = board.add(sname)
+            submitted.append((executor.submit(preprocess_series_cycles, nr, client, task, sname, sselector, dry_run,
+                                              cache, batch, incremental=incremental,
+                                              watermarks={attr: get_watermark(attr, sname) for attr in attrs}),
+                              task))
+    else:
+        # TODO merge results of different detectors
+        for attr, where, mask, detector_cls in CYCLE_DETECTORS:
+            fields = ["time", "participant", "hvbatt_soc", "veh_speed"]
+            if attr not in fields:
+                fields.append(attr)
+            if batch:
+                detector_cls = BATCH_DETECTORS.get(detector_cls, detector_cls)
+            detector = detector_cls(time_epoch=client.time_epoch)
+            for nr, (sname, sselector) in enumerate(series):
+                task = board.add("{} {}".format(attr, sname))
+                submitted.append((executor.submit(preprocess_cycle,
+                                                  nr, client, task, sname, sselector, (where, mask),
+                                                  fields, detector, dry_run, cache, incremental,
+                                                  get_watermark(detector.attr, sname)), task))
 
     logger.debug("Tasks started, waiting for results...")
-    async_progress(futures, queue)
-    data = [f.result() for f in futures]
+    futures = [f for f, t in submitted]
+    board.wait(futures, [t for f, t in submitted])
+    # the single pass tasks return the results of all detectors at once
+    results = list(itertools.chain.from_iterable(
+        res if isinstance(res, list) else [res] for res in (f.result() for f in futures)))
+    data = sum_chunk_results(row for row, watermark in results)
     logger.debug("Tasks done")
+    if incremental and not dry_run:
+        for (attr, nr, cycles, cycles_disc), watermark in results:
+            watermarks.update("charge_cycles", attr, series[nr][0], watermark)
+        watermarks.save()
     data.sort(key=lambda a: a[0:1])
     logger.info(__("Detected charge cycles:\n{}", tabulate(data, headers=["attr", "#", "cycles", "cycles_disc"])))
 
 
-def preprocess_cycle(nr, client, queue, sname, selector, fields, detector, dry_run=False):
-    logger.info(__("Processing #{}: {} {}", nr, detector.attr, sname))
-    stream = client.stream_params("samples", fields=fields, where=selector, group_order_by="ORDER BY time ASC")
-    stream = progress(stream, delay=4, remote=queue.put)
-    cycles, cycles_disc = detector(stream)
+def submit_cycle_chunks(nr, client, executor, board, sname, sselector, dry_run, cache, chunk_size,
+                        incremental=False, watermarks=None):
+    # load the series once and split it into ranges for each detector, which are detected in parallel
+    submitted = []
+    columns = cache.columns(sname, CYCLE_FIELDS)
+    for attr, where, mask, detector_cls in CYCLE_DETECTORS:
+        detector_cls = BATCH_DETECTORS[detector_cls]
+        detector = detector_cls(time_epoch=client.time_epoch)
+        watermark = watermarks.get(detector.attr) if watermarks else None
+        detector_since = watermark_time(watermark)
+        if watermark:
+            detector.restore_state(watermark['state'])
+        if incremental and not dry_run:
+            delete_cycles(client, "charge_cycles", detector.attr, sselector, detector_since)
+        selected = since_mask(mask, detector_since)(columns)
+        masked = {f: col[selected] if isinstance(col, np.ndarray) else col for f, col in columns.items()}
+        chunks = list(detector.split_columns(masked, chunk_size))
+        logger.info(__("Processing #{}: {} {} in {} chunks", nr, attr, sname, len(chunks)))
+        for i, chunk in enumerate(chunks):
+            task = board.add("{} {} #{}".format(attr, sname, i))
+            submitted.append((executor.submit(preprocess_cycle_chunk, nr, client, task, chunk, detector_cls, dry_run),
+                              task))
+    return submitted
+
+
+@flushing
+def preprocess_cycle_chunk(nr, client, task, chunk, detector_cls, dry_run=False):
+    columns, starts, ends = chunk
+    task.update(0, len(columns['time']))
+    detector = detector_cls(time_epoch=client.time_epoch)
+    with instrumentation.timer("preprocess.cycles.detect", rows=len(columns['time'])):
+        cycles, cycles_disc = detector.detect_prepared(columns, starts, ends)
+    task.update(len(columns['time']))
+    if not dry_run:
+        write_cycles(client, detector, cycles, cycles_disc)
+    return (detector.attr, nr, len(cycles), len(cycles_disc)), detector.watermark(cycles, cycles_disc)
+
+
+@flushing
+def preprocess_cycle(nr, client, task, sname, sselector, where, fields, detector, dry_run=False, cache=None,
+                     incremental=False, watermark=None):
+    since = watermark_time(watermark)
+    if watermark:
+        detector.restore_state(watermark['state'])
+    if since is not None:
+        logger.info(__("Processing #{}: {} {} since {}", nr, detector.attr, sname, since))
+    else:
+        logger.info(__("Processing #{}: {} {}", nr, detector.attr, sname))
+    where, mask = where
+    mask = since_mask(mask, since)
+    if cache and isinstance(detector, BatchDetectionMixin):
+        with instrumentation.timer("preprocess.cycles.load") as timer:
+            columns = cache.columns(sname, fields, mask)
+            timer.add(rows=len(columns['time']))
+        task.update(0, len(columns['time']))
+        with instrumentation.timer("preprocess.cycles.detect", rows=len(columns['time'])):
+            cycles, cycles_disc = detector.detect_columns(columns)
+        task.update(len(columns['time']))
+    else:
+        if cache:
+            stream = cache.stream(sname, fields, mask, DERIVED_FIELDS)
+        else:
+            stream = client.stream_params("samples", fields=fields,
+                                          where=since_where(join_selectors([sselector, where]), since,
+                                                            client.time_epoch),
+                                          group_order_by="ORDER BY time ASC")
+        # the time spent fetching the samples is also included in the detection time
+        stream = task.track(instrumentation.timed_iter("preprocess.cycles.stream", stream))
+        with instrumentation.timer("preprocess.cycles.detect"):
+            if isinstance(detector, BatchDetectionMixin):
+                cycles, cycles_disc = detector.detect_columns(samples_to_columns(stream, fields))
+            else:
+                cycles, cycles_disc = detector(stream)
 
     if not dry_run:
-        logger.info(__("Writing {} + {} = {} cycles", len(cycles), len(cycles_disc),
-                       len(cycles) + len(cycles_disc)))
-        client.write_points(
-            detector.cycles_to_timeseries(cycles + cycles_disc, "charge_cycles"),
-            tags={'detector': detector.attr},
-            time_precision=client.time_epoch)
+        if incremental:
+            with instrumentation.timer("preprocess.cycles.delete"):
+                delete_cycles(client, "charge_cycles", detector.attr, sselector, since)
+        write_cycles(client, detector, cycles, cycles_disc)
 
     logger.info(__("Task #{}: {} {} completed", nr, detector.attr, sname))
-    return detector.attr, nr, len(cycles), len(cycles_disc)
+    return (detector.attr, nr, len(cycles), len(cycles_disc)), detector.watermark(cycles, cycles_disc)
+
+
+def write_cycles(client, detector, cycles, cycles_disc):
+    logger.info(__("Writing {} + {} = {} {} cycles", len(cycles), len(cycles_disc),
+                   len(cycles) + len(cycles_disc), detector.attr))
+    BatchWriter(client, "preprocess.cycles.write").write_points(
+        detector.cycles_to_timeseries(cycles + cycles_disc, "charge_cycles"),
+        tags={'detector': detector.attr},
+        time_precision=client.time_epoch)
+
+
+@flushing
+def preprocess_series_cycles(nr, client, task, sname, sselector, dry_run=False, cache=None, batch=False,
+                             chunk_size=10000, incremental=False, watermarks=None):
+    # fetch the samples of a series only once and run all detectors on the same stream, each in its own thread
+    logger.info(__("Processing #{}: all detectors {}", nr, sname))
+    detectors = [(mask, (BATCH_DETECTORS.get(detector_cls, detector_cls) if batch else detector_cls)(
+        time_epoch=client.time_epoch)) for attr, where, mask, detector_cls in CYCLE_DETECTORS]
+    # each detector only gets the samples since its own watermark, so fetch everything from the earliest one on
+    watermarks = watermarks or {}
+    sinces = [watermark_time(watermarks.get(detector.attr)) for mask, detector in detectors]
+    detectors = [(since_mask(mask, since), detector) for (mask, detector), since in zip(detectors, sinces)]
+    for mask, detector in detectors:
+        if watermarks.get(detector.attr):
+            detector.restore_state(watermarks[detector.attr]['state'])
+    first_since = None if None in sinces else min(sinces)
+
+    if batch and cache:
+        # the cached columns are used directly, without streaming the samples
+        stream = None
+    elif cache:
+        stream = cache.stream(sname, CYCLE_FIELDS, since_mask(None, first_since), DERIVED_FIELDS)
+    else:
+        where = " OR ".join("({})".format(where) for attr, where, mask, detector_cls in CYCLE_DETECTORS)
+        stream = client.stream_params("samples", fields=CYCLE_FIELDS,
+                                      where=since_where(join_selectors([sselector, where]), first_since,
+                                                        client.time_epoch),
+                                      group_order_by="ORDER BY time ASC")
+    if stream is not None:
+        stream = task.track(instrumentation.timed_iter("preprocess.cycles.stream", stream))
+
+    if batch:
+        # with the batch detectors, load the columns once and run all detectors sequentially on them
+        columns = cache.columns(sname, CYCLE_FIELDS) if cache else samples_to_columns(stream, CYCLE_FIELDS)
+        task.update(0, len(columns['time']) * len(detectors))
+        results = []
+        for mask, detector in detectors:
+            with instrumentation.timer("preprocess.cycles.detect", rows=len(columns['time'])):
+                results.append(detect_columns_filtered(mask, detector, columns))
+            task.update(len(columns['time']) * len(results))
+    else:
+        chunks = iter(lambda: list(itertools.islice(stream, chunk_size)), [])
+        with instrumentation.timer("preprocess.cycles.detect"):
+            results = fan_out(chunks, [functools.partial(detect_filtered, mask, detector)
+                                       for mask, detector in detectors])
+
+    data = []
+    for (mask, detector), detector_since, (cycles, cycles_disc) in zip(detectors, sinces, results):
+        if not dry_run:
+            if incremental:
+                with instrumentation.timer("preprocess.cycles.delete"):
+                    delete_cycles(client, "charge_cycles", detector.attr, sselector, detector_since)
+            write_cycles(client, detector, cycles, cycles_disc)
+        data.append(((detector.attr, nr, len(cycles), len(cycles_disc)), detector.watermark(cycles, cycles_disc)))
+
+    logger.info(__("Task #{}: all detectors {} completed", nr, sname))
+    return data
+
+
+class ChunkColumns(dict):
+    # lazily converts the values of a chunk of samples to numpy columns, so that the where masks can be applied
+    def __init__(self, chunk):
+        super().__init__()
+        self.chunk = chunk
+
+    def __missing__(self, key):
+        col = np.array([s.get(key) for s in self.chunk], dtype=float)  # None becomes NaN
+        self[key] = col
+        return col
+
+
+def detect_columns_filtered(mask, detector, columns):
+    selected = mask(columns)
+    columns = {f: col[selected] if isinstance(col, np.ndarray) else col for f, col in columns.items()}
+    if isinstance(detector, BatchDetectionMixin):
+        return detector.detect_columns(columns)
+    else:
+        return detector(columns_to_samples(columns, list(columns.keys()), extra=DERIVED_FIELDS))
+
+
+def detect_filtered(mask, detector, chunks):
+    def samples():
+        for chunk in chunks:
+            selected = np.flatnonzero(mask(ChunkColumns(chunk)))
+            # the detectors modify the samples, so each one needs its own copies
+            yield from (chunk[i].copy() for i in selected.tolist())
+
+    return detector(samples())
+
+
+def fan_out(chunks, consumers, maxsize=4):
+    # pass each chunk to all consumers, which each run in their own thread and get an iterable of their chunks
+    queues = [Queue(maxsize) for _ in consumers]
+    with ThreadPoolExecutor(max_workers=len(consumers)) as executor:
+        futures = [executor.submit(consumer, iter(q.get, None)) for consumer, q in zip(consumers, queues)]
+        try:
+            for chunk in chunks:
+                for q, f in zip(queues, futures):
+                    put_unless_done(q, f, chunk)
+        finally:
+            for q, f in zip(queues, futures):
+                put_unless_done(q, f, None)
+        return [f.result() for f in futures]
+
+
+def put_unless_done(queue, future, item):
+    # don't block forever if the consumer failed and won't take any more items
+    while not future.done():
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            pass
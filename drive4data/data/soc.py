@@ -45,19 +45,28 @@ class SoCMixin(object):
     def accumulate_samples(self, new_sample, accumulator):
         accumulator = super().accumulate_samples(new_sample, accumulator)
 
-        if 'soc' not in accumulator:
-            accumulator['soc'] = ValueMemory("hvbatt_soc")
-        accumulator['soc'].update(new_sample)
+        if accumulator.soc is None:
+            accumulator.soc = ValueMemory("hvbatt_soc")
+        accumulator.soc.update(new_sample)
+
+        return accumulator
+
+    def accumulate_segment(self, columns, lo, hi, accumulator):
+        accumulator = super().accumulate_segment(columns, lo, hi, accumulator)
+
+        if accumulator.soc is None:
+            accumulator.soc = ValueMemory("hvbatt_soc")
+        accumulator.soc.update_segment(columns, lo, hi)
 
         return accumulator
 
     def merge_stats(self, stats1, stats2):
         stats = super().merge_stats(stats1, stats2)
-        stats['soc'] = stats1['soc'].merge(stats2['soc'])
+        stats.soc = stats1.soc.merge(stats2.soc)
         return stats
 
     def cycle_to_events(self, cycle: Cycle, measurement=""):
-        soc = cycle.stats["soc"]
+        soc = cycle.stats.soc
         data = {
             'soc_start': self.rescale_soc(soc.first) if soc.first else None,
             'soc_end': self.rescale_soc(soc.last) if soc.last else None
@@ -2,19 +2,31 @@ import logging
 import math
 from concurrent.futures import Executor
 from datetime import timedelta
-from multiprocessing.managers import SyncManager
 
+import numpy as np
 from tabulate import tabulate
 
-from drive4data.data.activity import InfluxActivityDetection, ValueMemory, ValueMemoryMixin
+from drive4data.data.activity import BatchDetectionMixin, CycleStats, InfluxActivityDetection, RowView, \
+    ValueMemory, ValueMemoryMixin, get_column, sum_chunk_results
+from drive4data.data.cache import samples_to_columns
 from drive4data.data.soc import SoCMixin
-from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient, TO_SECONDS, join_selectors
-from iss4e.util import BraceMessage as __, async_progress, progress
+from drive4data.data.watermarks import delete_cycles, since_mask, since_where, watermark_time
+from drive4data.db import StorageBackend
+from drive4data.db.writer import BatchWriter
+from drive4data.util.instrument import flushing, instrumentation
+from drive4data.util.progress import ProgressBoard
+from drive4data.util.stats import RunningStats
+from drive4data.util.timestamps import to_epoch_units
+from iss4e.db.influxdb import TO_SECONDS, join_selectors
+from iss4e.util import BraceMessage as __
 from webike.util.activity import Cycle
 
 __author__ = "Niko Fink"
 logger = logging.getLogger(__name__)
 
+TRIP_FIELDS = ["time", "veh_speed", "participant", "veh_odometer", "hvbatt_soc", "outside_air_temp", "fuel_rate",
+               "hvbatt_current", "hvbatt_voltage", "hvbs_cors_crnt", "hvbs_fn_crnt"]
+
 
 def get_current(sample):
     current = None
@@ -27,8 +39,33 @@ def get_current(sample):
     return current
 
 
+def get_current_column(columns, lo, hi):
+    # vectorized version of get_current for the samples lo until excluding hi
+    current = get_column(columns, 'hvbatt_current', lo, hi)
+    fn_crnt = get_column(columns, 'hvbs_fn_crnt', lo, hi)
+    cors_crnt = get_column(columns, 'hvbs_cors_crnt', lo, hi)
+    use_fn = np.isnan(current) & (fn_crnt > -23) & (fn_crnt < 22)
+    current = np.where(use_fn, fn_crnt, current)
+    return np.where(np.isnan(current) & ~use_fn, cors_crnt, current)
+
+
+class TripStats(CycleStats):
+    __slots__ = ('first', 'prev', 'est_distance', 'avg_current', 'avg_voltage', 'avg_fuel_rate', 'temp_avg',
+                 'cons_gasoline', 'cons_energy')
+
+    def __init__(self):
+        super().__init__()
+        self.first = self.prev = None
+        self.est_distance = 0.0
+        self.avg_current = RunningStats()
+        self.avg_voltage = RunningStats()
+        self.avg_fuel_rate = RunningStats()
+        self.temp_avg = RunningStats()
+        self.cons_gasoline = self.cons_energy = None
+
+
 class TripDetection(ValueMemoryMixin, SoCMixin, InfluxActivityDetection):
-    MIN_DURATION = timedelta(minutes=10) / timedelta(seconds=1)
+    MIN_DURATION = timedelta(minutes=10)
 
     def __init__(self, **kwargs):
         # save these values and store the respective first and last value with each cycle
@@ -39,125 +76,242 @@ class TripDetection(ValueMemoryMixin, SoCMixin, InfluxActivityDetection):
                          min_sample_count=60, min_cycle_duration=timedelta(minutes=1),
                          max_merge_gap=timedelta(minutes=4, seconds=20),
                          memorized_values=memorized_values, **kwargs)
+        # durations in epoch units, see InfluxActivityDetection.time_diff
+        self.max_gap = to_epoch_units(self.MIN_DURATION, self.epoch)
+        self.temp_delay = to_epoch_units(timedelta(minutes=5), self.epoch)
+        self.hours_per_unit = TO_SECONDS[self.epoch] / TO_SECONDS['h']
+
+    def new_stats(self):
+        return TripStats()
 
     def is_start(self, sample, previous):
         return sample[self.attr] > 0.1
 
     def is_end(self, sample, previous):
-        return sample[self.attr] < 0.1 or self.get_duration(previous, sample) > self.MIN_DURATION
+        return sample[self.attr] < 0.1 or self.time_diff(previous, sample) > self.max_gap
 
     def accumulate_samples(self, new_sample, accumulator):
         accumulator = super().accumulate_samples(new_sample, accumulator)
 
-        if '__first' not in accumulator:
-            accumulator['__first'] = new_sample
+        if accumulator.first is None:
+            accumulator.first = new_sample
 
         # accumulated values depending on previous sample
-        if 'est_distance' not in accumulator:
-            accumulator['est_distance'] = 0.0
-        if '__prev' in accumulator:
-            interval = self.get_duration(accumulator['__prev'], new_sample)
+        if accumulator.prev is not None:
+            interval = self.time_diff(accumulator.prev, new_sample)
 
             # distance
-            distance = (interval / TO_SECONDS['h']) * new_sample['veh_speed']
-            accumulator['est_distance'] += distance
+            distance = interval * self.hours_per_unit * new_sample['veh_speed']
+            accumulator.est_distance += distance
 
         # average values
-        self.make_avg(accumulator, 'avg_current', get_current(new_sample))
-        self.make_avg(accumulator, 'avg_voltage', new_sample.get('hvbatt_voltage'))
-        self.make_avg(accumulator, 'avg_fuel_rate', new_sample.get('fuel_rate'))
+        accumulator.avg_current.add(get_current(new_sample))
+        accumulator.avg_voltage.add(new_sample.get('hvbatt_voltage'))
+        accumulator.avg_fuel_rate.add(new_sample.get('fuel_rate'))
 
         # only count temperature 5 mins after trip start
-        if self.get_duration(accumulator['__first'], new_sample) >= 5 * TO_SECONDS['m'] \
+        if self.time_diff(accumulator.first, new_sample) >= self.temp_delay \
                 and new_sample.get('outside_air_temp') is not None \
                 and new_sample.get('outside_air_temp') < 1e305:
-            self.make_avg(accumulator, 'temp_avg', new_sample.get('outside_air_temp'))
+            accumulator.temp_avg.add(new_sample.get('outside_air_temp'))
 
-        accumulator['__prev'] = new_sample
+        accumulator.prev = new_sample
         return accumulator
 
-    def make_avg(self, accumulator, name, value):
-        if value is not None and math.isfinite(value):
-            cnt = accumulator.get(name + '_cnt', 0) + 1
-            accumulator[name] = float(value + (cnt - 1) * accumulator.get(name, 0)) / cnt
-            accumulator[name + '_cnt'] = cnt
+    def accumulate_segment(self, columns, lo, hi, accumulator):
+        accumulator = super().accumulate_segment(columns, lo, hi, accumulator)
+
+        if accumulator.first is None:
+            accumulator.first = RowView(columns, lo)
+
+        # accumulated values depending on previous sample
+        first = lo if accumulator.prev is not None else lo + 1
+        if first < hi:
+            time = np.asarray(columns['time'][first - 1:hi])
+            interval = np.diff(time)
+            assert (interval >= 0).all(), "samples are not ordered by time"
+            speed = get_column(columns, 'veh_speed', first, hi)
+            accumulator.est_distance += float(np.dot(interval * self.hours_per_unit, speed))
+
+        # average values
+        accumulator.avg_current.add_many(get_current_column(columns, lo, hi))
+        accumulator.avg_voltage.add_many(get_column(columns, 'hvbatt_voltage', lo, hi))
+        accumulator.avg_fuel_rate.add_many(get_column(columns, 'fuel_rate', lo, hi))
+
+        # only count temperature 5 mins after trip start
+        temp = get_column(columns, 'outside_air_temp', lo, hi)
+        since_first = np.asarray(columns['time'][lo:hi]) - accumulator.first['time']
+        accumulator.temp_avg.add_many(temp[(since_first >= self.temp_delay) & (temp < 1e305)])
+
+        accumulator.prev = RowView(columns, hi - 1)
+        return accumulator
 
     def store_cycle(self, cycle: Cycle):
-        duration = (cycle.end['time'] - cycle.start['time']) * TO_SECONDS[self.epoch]
-        if 'avg_fuel_rate' in cycle.stats:
-            cycle.stats['cons_gasoline'] = cycle.stats['avg_fuel_rate'] * duration
-        if 'avg_current' in cycle.stats and 'avg_voltage' in cycle.stats:
-            cycle.stats['cons_energy'] = cycle.stats['avg_current'] * cycle.stats['avg_voltage'] \
-                                         * duration / TO_SECONDS['h']  # convert to Wh
+        stats = cycle.stats
+        duration = self.get_duration(cycle.start, cycle.end)
+        if stats.avg_fuel_rate.count:
+            stats.cons_gasoline = stats.avg_fuel_rate.mean * duration
+        if stats.avg_current.count and stats.avg_voltage.count:
+            stats.cons_energy = stats.avg_current.mean * stats.avg_voltage.mean \
+                                * duration / TO_SECONDS['h']  # convert to Wh
         super().store_cycle(cycle)
 
     def merge_stats(self, stats1, stats2):
         stats = super().merge_stats(stats1, stats2)
 
-        stats['est_distance'] = stats1['est_distance'] + stats2['est_distance']
-        self.merge_avg('avg_current', stats, stats1, stats2)
-        self.merge_avg('avg_voltage', stats, stats1, stats2)
-        self.merge_avg('avg_fuel_rate', stats, stats1, stats2)
-        self.merge_avg('temp_avg', stats, stats1, stats2)
-        if 'cons_gasoline' in stats1 or 'cons_gasoline' in stats2:
-            stats['cons_gasoline'] = stats1.get('cons_gasoline', 0) + stats2.get('cons_gasoline', 0)
-        if 'cons_energy' in stats1 or 'cons_energy' in stats2:
-            stats['cons_energy'] = stats1.get('cons_energy', 0) + stats2.get('cons_energy', 0)
+        stats.est_distance = stats1.est_distance + stats2.est_distance
+        for name in 'avg_current', 'avg_voltage', 'avg_fuel_rate', 'temp_avg':
+            setattr(stats, name, getattr(stats1, name).merge(getattr(stats2, name)))
+        if stats1.cons_gasoline is not None or stats2.cons_gasoline is not None:
+            stats.cons_gasoline = (stats1.cons_gasoline or 0) + (stats2.cons_gasoline or 0)
+        if stats1.cons_energy is not None or stats2.cons_energy is not None:
+            stats.cons_energy = (stats1.cons_energy or 0) + (stats2.cons_energy or 0)
 
         return stats
 
-    @staticmethod
-    def merge_avg(name, stats, stats1, stats2):
-        if name in stats1 and name in stats2:
-            cnt1, cnt2 = stats1.get('cnt', 0), stats2.get('cnt', 0)
-            stats[name] = (stats1[name] * cnt1 + stats2[name] * cnt2) / (cnt1 + cnt2)
-        elif name in stats1:
-            stats[name] = stats1[name]
-        elif name in stats2:
-            stats[name] = stats2[name]
-
     def cycle_to_events(self, cycle: Cycle, measurement=""):
+        stats = cycle.stats
+        # the mean of an empty RunningStats is NaN, so it isn't written
+        values = [('est_distance', stats.est_distance), ('avg_current', stats.avg_current.mean),
+                  ('avg_voltage', stats.avg_voltage.mean), ('avg_fuel_rate', stats.avg_fuel_rate.mean),
+                  ('temp_avg', stats.temp_avg.mean), ('cons_gasoline', stats.cons_gasoline),
+                  ('cons_energy', stats.cons_energy)]
         for event in super().cycle_to_events(cycle, measurement):
-            for key in 'est_distance', 'avg_current', 'avg_voltage', 'avg_fuel_rate', 'temp_avg', 'cons_gasoline', \
-                       'cons_energy':
-                if key in cycle.stats and math.isfinite(cycle.stats[key]):
-                    event['fields'][key] = float(cycle.stats[key])
+            for key, value in values:
+                if value is not None and math.isfinite(value):
+                    event['fields'][key] = float(value)
             yield event
 
 
-def preprocess_trips(client: InfluxDBClient, executor: Executor, manager: SyncManager, dry_run=False):
+class BatchTripDetection(BatchDetectionMixin, TripDetection):
+    def start_mask(self, columns):
+        return get_column(columns, self.attr, 0, None) > 0.1
+
+    def end_mask(self, columns):
+        return (get_column(columns, self.attr, 0, None) < 0.1) | (self.time_gaps(columns) > self.max_gap)
+
+    def split_gap(self):
+        return max(super().split_gap(), self.max_gap)
+
+
+def trip_where(columns):
+    return columns['veh_speed'] > 0
+
+
+def preprocess_trips(client: StorageBackend, executor: Executor, board: ProgressBoard, dry_run=False, cache=None,
+                     batch=False, chunk_size=None, watermarks=None):
+    # with watermarks, only the trips since the last run are detected again, otherwise the measurement must be empty
     logger.info("Preprocessing trips")
-    queue = manager.Queue()
-    series = client.list_series("samples")
-    futures = [executor.submit(preprocess_trip, nr, client, queue, sname, sselector, dry_run)
-               for nr, (sname, sselector) in enumerate(series)]
+    series = list(client.list_series("samples"))
+    incremental = watermarks is not None
+    futures, tasks = [], []
+    for nr, (sname, sselector) in enumerate(series):
+        watermark = watermarks.get("trips", "veh_speed", sname) if incremental else None
+        if chunk_size and batch and cache:
+            submitted = submit_trip_chunks(nr, client, executor, board, sname, sselector, dry_run, cache,
+                                           chunk_size, incremental, watermark)
+        else:
+            task = board.add(sname)
+            submitted = [(executor.submit(preprocess_trip, nr, client, task, sname, sselector, dry_run, cache,
+                                          batch, incremental, watermark), task)]
+        futures += [f for f, t in submitted]
+        tasks += [t for f, t in submitted]
     logger.debug("Tasks started, waiting for results...")
-    async_progress(futures, queue)
-    data = [f.result() for f in futures]
+    board.wait(futures, tasks)
+    results = [f.result() for f in futures]
+    data = sum_chunk_results(row for row, watermark in results)
     logger.debug("Tasks done")
+    if incremental and not dry_run:
+        for (nr, cycles, cycles_disc), watermark in results:
+            watermarks.update("trips", "veh_speed", series[nr][0], watermark)
+        watermarks.save()
     data.sort(key=lambda a: a[0])
     logger.info(__("Detected trips:\n{}", tabulate(data, headers=["#", "cycles", "cycles_disc"])))
 
 
-def preprocess_trip(nr, client, queue, sname, sselector, dry_run=False):
-    logger.info(__("Processing #{}: {}", nr, sname))
-    detector = TripDetection(time_epoch=client.time_epoch)
-    stream = client.stream_params(
-        "samples",
-        fields="time, veh_speed, participant, veh_odometer, hvbatt_soc, outside_air_temp, "
-               "fuel_rate, hvbatt_current, hvbatt_voltage, hvbs_cors_crnt, hvbs_fn_crnt",
-        where=join_selectors([sselector, "veh_speed > 0"]), group_order_by="ORDER BY time ASC"
-    )
-    stream = progress(stream, delay=4, remote=queue.put)
-    cycles, cycles_disc = detector(stream)
+def submit_trip_chunks(nr, client, executor, board, sname, sselector, dry_run, cache, chunk_size, incremental=False,
+                       watermark=None):
+    # split the series into ranges that are detected in parallel
+    detector = BatchTripDetection(time_epoch=client.time_epoch)
+    since = watermark_time(watermark)
+    if watermark:
+        detector.restore_state(watermark['state'])
+    if incremental and not dry_run:
+        delete_cycles(client, "trips", detector.attr, sselector, since)
+    columns = cache.columns(sname, TRIP_FIELDS, since_mask(trip_where, since))
+    chunks = list(detector.split_columns(columns, chunk_size))
+    logger.info(__("Processing #{}: {} in {} chunks", nr, sname, len(chunks)))
+    tasks = [board.add("{} #{}".format(sname, i)) for i in range(len(chunks))]
+    return [(executor.submit(preprocess_trip_chunk, nr, client, task, chunk, dry_run), task)
+            for task, chunk in zip(tasks, chunks)]
+
+
+@flushing
+def preprocess_trip_chunk(nr, client, task, chunk, dry_run=False):
+    columns, starts, ends = chunk
+    task.update(0, len(columns['time']))
+    detector = BatchTripDetection(time_epoch=client.time_epoch)
+    with instrumentation.timer("preprocess.trips.detect", rows=len(columns['time'])):
+        cycles, cycles_disc = detector.detect_prepared(columns, starts, ends)
+    task.update(len(columns['time']))
 
     if not dry_run:
+        write_trips(client, detector, cycles, cycles_disc)
+    return (nr, len(cycles), len(cycles_disc)), detector.watermark(cycles, cycles_disc)
+
+
+@flushing
+def preprocess_trip(nr, client, task, sname, sselector, dry_run=False, cache=None, batch=False, incremental=False,
+                    watermark=None):
+    since = watermark_time(watermark)
+    if since is not None:
+        logger.info(__("Processing #{}: {} since {}", nr, sname, since))
+    else:
+        logger.info(__("Processing #{}: {}", nr, sname))
+    if batch:
+        detector = BatchTripDetection(time_epoch=client.time_epoch)
+    else:
+        detector = TripDetection(time_epoch=client.time_epoch)
+    if watermark:
+        detector.restore_state(watermark['state'])
+    if cache and batch:
+        with instrumentation.timer("preprocess.trips.load") as timer:
+            columns = cache.columns(sname, TRIP_FIELDS, since_mask(trip_where, since))
+            timer.add(rows=len(columns['time']))
+        task.update(0, len(columns['time']))
+        with instrumentation.timer("preprocess.trips.detect", rows=len(columns['time'])):
+            cycles, cycles_disc = detector.detect_columns(columns)
+        task.update(len(columns['time']))
+    else:
+        if cache:
+            stream = cache.stream(sname, TRIP_FIELDS, since_mask(trip_where, since))
+        else:
+            stream = client.stream_params("samples", fields=", ".join(TRIP_FIELDS),
+                                          where=since_where(join_selectors([sselector, "veh_speed > 0"]), since,
+                                                            client.time_epoch),
+                                          group_order_by="ORDER BY time ASC")
+        # the time spent fetching the samples is also included in the detection time
+        stream = task.track(instrumentation.timed_iter("preprocess.trips.stream", stream))
+        with instrumentation.timer("preprocess.trips.detect"):
+            if batch:
+                cycles, cycles_disc = detector.detect_columns(samples_to_columns(stream, TRIP_FIELDS))
+            else:
+                cycles, cycles_disc = detector(stream)
+
+    if not dry_run:
+        if incremental:
+            with instrumentation.timer("preprocess.trips.delete"):
+                delete_cycles(client, "trips", detector.attr, sselector, since)
         logger.info(__("Writing {} + {} = {} trips", len(cycles), len(cycles_disc),
                        len(cycles) + len(cycles_disc)))
-        client.write_points(
-            detector.cycles_to_timeseries(cycles + cycles_disc, "trips"),
-            tags={'detector': detector.attr},
-            time_precision=client.time_epoch)
+        write_trips(client, detector, cycles, cycles_disc)
 
     logger.info(__("Task #{}: {} completed", nr, sname))
-    return nr, len(cycles), len(cycles_disc)
+    return (nr, len(cycles), len(cycles_disc)), detector.watermark(cycles, cycles_disc)
+
+
+def write_trips(client, detector, cycles, cycles_disc):
+    BatchWriter(client, "preprocess.trips.write").write_points(
+        detector.cycles_to_timeseries(cycles + cycles_disc, "trips"),
+        tags={'detector': detector.attr},
+        time_precision=client.time_epoch)
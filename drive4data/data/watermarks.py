@@ -0,0 +1,75 @@
+import json
+import os
+
+from iss4e.db.influxdb import join_selectors
+
+__author__ = "Niko Fink"
+
+# unit suffixes of InfluxQL epoch time literals for the client time epochs
+EPOCH_SUFFIXES = {'n': 'ns', 'u': 'u', 'ms': 'ms', 's': 's', 'm': 'm', 'h': 'h'}
+
+
+# For each measurement, detector and series, where the previous run can be continued: the start time of its last
+# cycle and the state the detector needs to detect that cycle again (see InfluxActivityDetection.watermark).
+# Detection is idle right before each cycle starts and cycles never overlap, so all earlier cycles are final and
+# an incremental run only needs to delete the cycles from the watermark on and detect them again from the samples
+# after that point. A cycle that was still open or could be merged with later ones is thereby updated.
+class Watermarks(object):
+    def __init__(self, file):
+        self.file = file
+        self.entries = {}
+
+    def exists(self):
+        return os.path.isfile(self.file)
+
+    def load(self):
+        if self.exists():
+            with open(self.file, "rt") as f:
+                self.entries = json.load(f)
+        return self
+
+    def save(self):
+        # the preprocessing might run on a host where the import didn't create the directory yet
+        os.makedirs(os.path.dirname(self.file) or ".", exist_ok=True)
+        with open(self.file + ".tmp", "wt") as f:
+            json.dump(self.entries, f, sort_keys=True, indent=1)
+        os.replace(self.file + ".tmp", self.file)
+
+    def get(self, measurement, detector, sname):
+        return self.entries.get(measurement, {}).get(detector, {}).get(sname)
+
+    def update(self, measurement, detector, sname, watermark):
+        # keeps the old watermark if no new cycle was found
+        if watermark is not None:
+            entries = self.entries.setdefault(measurement, {}).setdefault(detector, {})
+            if sname not in entries or entries[sname]['time'] < watermark['time']:
+                entries[sname] = watermark
+
+
+def watermark_time(watermark):
+    return watermark['time'] if watermark else None
+
+
+def since_selector(since, epoch):
+    return "time >= {}{}".format(int(since), EPOCH_SUFFIXES[epoch])
+
+
+def since_where(where, since, epoch):
+    return join_selectors([where, since_selector(since, epoch)]) if since is not None else where
+
+
+def since_mask(mask, since):
+    # the column mask equivalent of since_where, `mask` may be None to only select by time
+    if since is None:
+        return mask
+    elif mask is None:
+        return lambda columns: columns['time'] >= since
+    return lambda columns: mask(columns) & (columns['time'] >= since)
+
+
+def delete_cycles(client, measurement, detector, sselector, since=None):
+    # remove the cycles of a series that will be detected again
+    where = [sselector, "detector = '{}'".format(detector)]
+    if since is not None:
+        where.append(since_selector(since, client.time_epoch))
+    client.query("DELETE FROM {} WHERE {}".format(measurement, join_selectors(where)))
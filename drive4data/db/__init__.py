@@ -0,0 +1,63 @@
+import abc
+
+from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient
+
+__author__ = "Niko Fink"
+
+BACKENDS = ['influxdb', 'sqlite']
+
+
+# The operations of the DB client that the import and preprocessing stages use. Queries and where clauses are given
+# in the subset of InfluxQL that is used throughout the code. Clients must be picklable, as they are passed to the
+# worker processes.
+class StorageBackend(metaclass=abc.ABCMeta):
+    time_epoch = 'n'
+
+    @abc.abstractmethod
+    def write_points(self, points, tags=None, time_precision=None):
+        pass
+
+    @abc.abstractmethod
+    def stream_params(self, measurement, fields="*", where="", group_order_by=""):
+        pass
+
+    @abc.abstractmethod
+    def list_series(self, measurement):
+        pass
+
+    @abc.abstractmethod
+    def drop_measurement(self, measurement):
+        pass
+
+    @abc.abstractmethod
+    def query(self, query):
+        pass
+
+    def close(self):
+        pass
+
+
+StorageBackend.register(InfluxDBClient)
+
+
+def storage_cred(config):
+    # the connection parameters of the configured backend, which are passed to connect
+    backend = config.get("drive4data.storage.backend", "influxdb")
+    if backend == "influxdb":
+        return dict(config["drive4data.influx"], backend=backend)
+    elif backend == "sqlite":
+        return {'backend': backend, 'path': config.get("drive4data.storage.path", "tmp/drive4data.sqlite")}
+    else:
+        raise ValueError("Unknown storage backend '{}', expected one of {}".format(backend, BACKENDS))
+
+
+def connect(cred, **kwargs) -> StorageBackend:
+    cred = dict(cred)
+    backend = cred.pop('backend', "influxdb")
+    if backend == "influxdb":
+        return InfluxDBClient(**dict(cred, **kwargs))
+    elif backend == "sqlite":
+        from drive4data.db.sqlite import SQLiteClient
+        return SQLiteClient(cred['path'], **kwargs)
+    else:
+        raise ValueError("Unknown storage backend '{}', expected one of {}".format(backend, BACKENDS))
@@ -0,0 +1,319 @@
+import calendar
+import itertools
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+from drive4data.db import StorageBackend
+from iss4e.util import BraceMessage as __
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+# nanoseconds per unit of the time epochs and of the duration suffixes of InfluxQL
+NS_PER_UNIT = {'n': 1, 'ns': 1, 'u': 1000, 'µ': 1000, 'ms': 10 ** 6, 's': 10 ** 9, 'm': 60 * 10 ** 9,
+               'h': 3600 * 10 ** 9, 'd': 86400 * 10 ** 9, 'w': 7 * 86400 * 10 ** 9}
+# tags are declared with this type, which has TEXT affinity, while fields have no type and keep their values as is
+TAG_TYPE = "TAG TEXT"
+KEYWORDS = {'and', 'or', 'not', 'is', 'null', 'true', 'false', 'in', 'like', 'time'}
+AGGREGATES = {'count': "count", 'min': "min", 'max': "max", 'sum': "sum", 'mean': "avg"}
+SELECTORS = {'first': "min", 'last': "max"}
+
+STRING_RE = re.compile(r"('(?:[^']|'')*')")
+TIME_RE = re.compile(r"\btime\s*(<=|>=|!=|<>|<|>|=)\s*(-?\d+)(ns|u|µ|ms|s|m|h|d|w)?\b")
+IDENT_RE = re.compile(r'"((?:[^"]|"")+)"|\b([A-Za-z_][A-Za-z0-9_]*)\b')
+DELETE_RE = re.compile(r"^\s*DELETE\s+FROM\s+\"?(\w+)\"?(?:\s+WHERE\s+(.+?))?\s*;?\s*$", re.I | re.S)
+DROP_RE = re.compile(r"^\s*DROP\s+MEASUREMENT\s+\"?(\w+)\"?\s*;?\s*$", re.I)
+SELECT_RE = re.compile(r"^\s*SELECT\s+(.+?)\s+FROM\s+\"?(\w+)\"?(?:\s+WHERE\s+(.+?))?"
+                       r"(?:\s+GROUP\s+BY\s+([\w\s,\"]+?))?\s*;?\s*$", re.I | re.S)
+ITEM_RE = re.compile(r"^(\w+)\(\s*(\*|\"?\w+\"?)\s*\)(?:\s+AS\s+\"?(\w+)\"?)?$", re.I)
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def split_statements(query):
+    # split at the semicolons outside of string literals
+    statements = [""]
+    for i, part in enumerate(STRING_RE.split(query)):
+        if i % 2:
+            statements[-1] += part
+        else:
+            first, *rest = part.split(";")
+            statements[-1] += first
+            statements.extend(rest)
+    return [s for s in statements if s.strip()]
+
+
+def to_ns(value, precision=None):
+    if isinstance(value, datetime):
+        # naive datetimes are in UTC, like for the InfluxDB client
+        return calendar.timegm(value.utctimetuple()) * 10 ** 9 + value.microsecond * 1000
+    elif isinstance(value, str):
+        return int(np.datetime64(value.rstrip("Z"), 'ns').astype(np.int64))
+    return int(value) * NS_PER_UNIT[precision or 'n']
+
+
+# Result of a SELECT query, grouped by series like the ResultSet of the InfluxDB client
+class ResultSet(object):
+    def __init__(self, series):
+        self.series = series  # [((measurement, tags), rows)]
+
+    def items(self):
+        # the rows are iterators, like the generators returned by the InfluxDB client
+        return [(key, iter(rows)) for key, rows in self.series]
+
+    def get_points(self):
+        return itertools.chain.from_iterable(rows for key, rows in self.series)
+
+
+# Embedded storage backend that keeps each measurement in a table of an SQLite file, with one column per tag and
+# field. Points with the same tags and time are merged, like in InfluxDB, using a unique index over the tags and time.
+# All processes open their own connection, writes of different processes are serialized by SQLite.
+class SQLiteClient(StorageBackend):
+    def __init__(self, path, time_epoch='n', timeout=600, **kwargs):
+        # other keyword arguments are options of the InfluxDB client that don't apply here
+        self.path = path
+        self.time_epoch = time_epoch
+        self.timeout = timeout
+        self.conn = None
+        self.pid = None
+        self.schema = {}
+
+    def __getstate__(self):
+        return {'path': self.path, 'time_epoch': self.time_epoch, 'timeout': self.timeout, 'conn': None,
+                'pid': None, 'schema': {}}
+
+    def connection(self):
+        if self.conn is None or self.pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # transactions are handled explicitly
+            self.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.pid = os.getpid()
+            self.schema = {}
+        return self.conn
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+
+    def columns(self, measurement, reload=False):
+        # column name -> True for tags and False for fields, empty if the table doesn't exist
+        if reload or measurement not in self.schema:
+            info = self.connection().execute("PRAGMA table_info({})".format(quote(measurement))).fetchall()
+            self.schema[measurement] = {name: decl == TAG_TYPE for cid, name, decl, *rest in info if name != 'time'}
+        return self.schema[measurement]
+
+    def tags(self, measurement):
+        return sorted(name for name, is_tag in self.columns(measurement).items() if is_tag)
+
+    def ensure_columns(self, measurement, tags, fields):
+        # must be called within a write transaction, so that no other process changes the schema at the same time
+        columns = self.columns(measurement, reload=True)
+        if columns and set(tags) <= columns.keys() and set(fields) <= columns.keys():
+            return
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS {} (time INTEGER NOT NULL)".format(quote(measurement)))
+        columns = self.columns(measurement, reload=True)
+        new_tags = [t for t in tags if t not in columns]
+        for tag in new_tags:
+            conn.execute("ALTER TABLE {} ADD COLUMN {} {} NOT NULL DEFAULT ''".format(
+                quote(measurement), quote(tag), TAG_TYPE))
+        for field in fields:
+            if field not in columns and field not in new_tags:
+                conn.execute("ALTER TABLE {} ADD COLUMN {}".format(quote(measurement), quote(field)))
+        self.columns(measurement, reload=True)
+        index = quote(measurement + "_series")
+        if new_tags:
+            conn.execute("DROP INDEX IF EXISTS {}".format(index))
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})".format(
+            index, quote(measurement), ", ".join([quote(t) for t in self.tags(measurement)] + ["time"])))
+
+    def write_points(self, points, tags=None, time_precision=None, **kwargs):
+        # group the points by their columns, so that each group can be inserted at once
+        groups = {}
+        for point in points:
+            point_tags = dict(tags or {}, **point.get('tags', {}))
+            fields = point['fields']
+            key = (point['measurement'], tuple(sorted(point_tags)), tuple(sorted(fields)))
+            groups.setdefault(key, []).append(
+                [to_ns(point['time'], time_precision)] +
+                [str(point_tags[t]) if point_tags[t] is not None else '' for t in key[1]] +
+                [fields[f] for f in key[2]])
+        if not groups:
+            return True
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (measurement, tag_names, field_names), rows in groups.items():
+                self.ensure_columns(measurement, tag_names, field_names)
+                names = ["time"] + list(tag_names) + list(field_names)
+                sql = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO ".format(
+                    quote(measurement), ", ".join(quote(n) for n in names), ", ".join("?" * len(names)),
+                    ", ".join([quote(t) for t in self.tags(measurement)] + ["time"]))
+                if field_names:
+                    # None values are not written, like with the InfluxDB client
+                    sql += "UPDATE SET " + ", ".join("{0} = coalesce(excluded.{0}, {0})".format(quote(f))
+                                                     for f in field_names)
+                else:
+                    sql += "NOTHING"
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def translate_where(self, measurement, where):
+        # converts an InfluxQL condition to SQL, unknown columns are NULL, like missing fields in InfluxDB
+        if not where:
+            return "1"
+        columns = self.columns(measurement)
+        parts = STRING_RE.split(where)
+        for i in range(0, len(parts), 2):  # every second part is a string literal
+            part = TIME_RE.sub(lambda m: "time {} {}".format(
+                m.group(1), int(m.group(2)) * NS_PER_UNIT[m.group(3) or 'ns']), parts[i])
+
+            def ident(m):
+                name = m.group(1).replace('""', '"') if m.group(1) else m.group(2)
+                if name.lower() in KEYWORDS and not m.group(1):
+                    return m.group(0)
+                return quote(name) if name in columns else "NULL"
+
+            parts[i] = IDENT_RE.sub(ident, part)
+        return "".join(parts)
+
+    def to_epoch(self, ns):
+        return ns // NS_PER_UNIT[self.time_epoch] if ns is not None else None
+
+    def select(self, measurement, names):
+        columns = self.columns(measurement)
+        return ", ".join(quote(n) if n in columns else "NULL" for n in names)
+
+    def stream_params(self, measurement, fields="*", where="", group_order_by="", chunk_size=10000, **kwargs):
+        if isinstance(fields, str):
+            fields = [f.strip().strip('"') for f in fields.split(",")]
+        if not self.columns(measurement, reload=True):
+            return iter([])
+        if "*" in fields:
+            fields = ["time"] + sorted(self.columns(measurement))
+        names = [f for f in fields if f != "time"]
+        is_tag = [self.columns(measurement).get(n, False) for n in names]
+        sql = "SELECT time{} FROM {} WHERE {} {}".format(
+            "".join(", " + self.select(measurement, [n]) for n in names), quote(measurement),
+            self.translate_where(measurement, where), group_order_by)
+        return self.stream_rows(sql, fields, names, is_tag, chunk_size)
+
+    def stream_rows(self, sql, fields, names, is_tag, chunk_size):
+        cursor = self.connection().execute(sql)
+        with_time = "time" in fields
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            for row in rows:
+                sample = {'time': self.to_epoch(row[0])} if with_time else {}
+                for name, tag, value in zip(names, is_tag, row[1:]):
+                    sample[name] = (value or None) if tag else value
+                yield sample
+
+    def list_series(self, measurement):
+        if not self.columns(measurement, reload=True):
+            return iter([])
+        tags = self.tags(measurement)
+        if not tags:
+            return iter([(measurement, "")])
+        rows = self.connection().execute("SELECT DISTINCT {0} FROM {1} ORDER BY {0}".format(
+            ", ".join(quote(t) for t in tags), quote(measurement))).fetchall()
+        return iter([(",".join([measurement] + ["{}={}".format(t, v) for t, v in zip(tags, row) if v]),
+                      " AND ".join("{}='{}'".format(t, v.replace("'", "''")) for t, v in zip(tags, row) if v))
+                     for row in rows])
+
+    def drop_measurement(self, measurement):
+        conn = self.connection()
+        conn.execute("DROP TABLE IF EXISTS {}".format(quote(measurement)))
+        self.schema.pop(measurement, None)
+
+    def query(self, query, **kwargs):
+        statements = split_statements(query)
+        if len(statements) > 1:
+            # like InfluxDB, run the statements one after another, but only return the last result
+            res = ResultSet([])
+            for statement in statements:
+                res = self.query(statement, **kwargs)
+            return res
+        m = DROP_RE.match(query)
+        if m:
+            self.drop_measurement(m.group(1))
+            return ResultSet([])
+        m = DELETE_RE.match(query)
+        if m:
+            measurement, where = m.groups()
+            if self.columns(measurement, reload=True):
+                self.connection().execute("DELETE FROM {} WHERE {}".format(
+                    quote(measurement), self.translate_where(measurement, where)))
+            return ResultSet([])
+        m = SELECT_RE.match(query)
+        if m:
+            return self.select_query(*m.groups())
+        raise ValueError("Unsupported query for the SQLite backend: {}".format(query))
+
+    def select_query(self, items, measurement, where, group_by):
+        # supports aggregations (count, min, max, sum, mean) or a single selector (first, last), grouped by tags
+        if not self.columns(measurement, reload=True):
+            return ResultSet([])
+        columns = self.columns(measurement)
+        group = [g.strip().strip('"') for g in group_by.split(",")] if group_by else []
+        exprs, selector = [], None
+        for item in (i.strip() for i in items.split(",")):
+            m = ITEM_RE.match(item)
+            if not m:
+                if item.strip('"') in columns or item.strip('"') in group:
+                    continue  # tags are part of the group key
+                raise ValueError("Unsupported select item for the SQLite backend: {}".format(item))
+            func, arg, alias = m.group(1).lower(), m.group(2).strip('"'), m.group(3)
+            if func in SELECTORS:
+                selector = (SELECTORS[func], arg, alias or func)
+            elif func in AGGREGATES and arg == "*":
+                # applies to all fields, named like in InfluxDB
+                exprs += ["{}({}) AS {}".format(AGGREGATES[func], quote(f), quote(func + "_" + f))
+                          for f in sorted(columns) if not columns[f]]
+            elif func in AGGREGATES:
+                exprs.append("{}({}) AS {}".format(AGGREGATES[func], self.select(measurement, [arg]),
+                                                   quote(alias or func)))
+            else:
+                raise ValueError("Unsupported function for the SQLite backend: {}".format(func))
+        if selector and exprs:
+            raise ValueError("Selectors can't be combined with aggregations")
+
+        condition = self.translate_where(measurement, where)
+        keys = ", ".join(self.select(measurement, [g]) for g in group)
+        if selector:
+            func, arg, alias = selector
+            # SQLite takes the other values from the row with the min or max time
+            sql = "SELECT {}{}(time), {} AS {} FROM {} WHERE ({}) AND {} IS NOT NULL".format(
+                keys + ", " if keys else "", func, self.select(measurement, [arg]), quote(alias),
+                quote(measurement), condition, self.select(measurement, [arg]))
+        else:
+            sql = "SELECT {}0, {} FROM {} WHERE {}".format(keys + ", " if keys else "", ", ".join(exprs),
+                                                          quote(measurement), condition)
+        if group:
+            sql += " GROUP BY " + keys
+        cursor = self.connection().execute(sql)
+        names = [d[0] for d in cursor.description][len(group) + 1:]
+        series = []
+        for row in cursor.fetchall():
+            if selector and row[len(group)] is None:
+                continue  # no matching values
+            tags = {g: v or None for g, v in zip(group, row)} if group else None
+            values = {'time': self.to_epoch(row[len(group)])}
+            values.update(zip(names, row[len(group) + 1:]))
+            series.append(((measurement, tags), [values]))
+        logger.debug(__("Query {} returned {} series", sql, len(series)))
+        return ResultSet(series)
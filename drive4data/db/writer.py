@@ -0,0 +1,252 @@
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+
+from drive4data.util.instrument import instrumentation
+from influxdb.exceptions import InfluxDBServerError
+from iss4e.util import BraceMessage as __
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'batch_size': 5000,  # points per request until the first latency was observed
+    'min_batch_size': 100,
+    'max_batch_size': 100000,
+    'target_seconds': 2.0,  # the batch size is adapted so that each request takes about this long
+    'max_batch_bytes': 8 * 2 ** 20,  # estimated payload per request
+    'max_inflight_bytes': 64 * 2 ** 20,  # estimated payload queued or being written by a PipelinedWriter
+    'retries': 5,
+    'backoff': 1.0,  # seconds before the first retry, doubled for every further one
+    'max_backoff': 60.0,
+}
+# the options of all BatchWriters in this process, which are set by configure or init_worker
+options = dict(DEFAULT_OPTIONS)
+
+# errors of a request after which it is sent again, the requests exceptions for connection errors and timeouts are
+# OSErrors, too
+TRANSIENT_ERRORS = (OSError, InfluxDBServerError)
+
+
+def configure(**kwargs):
+    unknown = set(kwargs) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown write options {}, expected some of {}".format(sorted(unknown),
+                                                                               sorted(DEFAULT_OPTIONS)))
+    options.clear()
+    options.update(DEFAULT_OPTIONS, **kwargs)
+
+
+def settings():
+    # the settings to pass to init_worker of each worker process
+    return dict(options)
+
+
+def init_worker(settings):
+    configure(**settings)
+
+
+def estimate_bytes(points):
+    # the payload of a list of points, estimated from the first one, as they usually all have the same fields
+    return len(repr(points[0])) * len(points) if points else 0
+
+
+# Wraps the write_points of a client to send the points in batches, whose size is adapted to the observed latency and
+# payload. Failed requests are retried with exponential backoff, each time split into two halves. Sending points
+# again is idempotent, as a point with the same measurement, tags and time replaces the previous one. The points,
+# batches, bytes and retries are counted in the instrumentation stage `stage`.
+class BatchWriter(object):
+    def __init__(self, client, stage, **kwargs):
+        self.client = client
+        self.stage = stage
+        self.options = dict(options, **kwargs)
+        self.batch_size = self.options['batch_size']
+        self.point_bytes = None
+
+    def write_points(self, points, **write_args):
+        # same as client.write_points, returns the number of points
+        points = iter(points)
+        count = 0
+        # the batch size is read again for each batch, so that changes apply right away
+        for batch in iter(lambda: list(itertools.islice(points, self.batch_size)), []):
+            self.write_batch(batch, write_args)
+            count += len(batch)
+        return count
+
+    def write_batch(self, batch, write_args):
+        pending = [(batch, 0)]
+        while pending:
+            part, attempt = pending.pop()
+            size = estimate_bytes(part)
+            start = time.perf_counter()
+            try:
+                with instrumentation.timer(self.stage) as timer:
+                    self.client.write_points(part, **write_args)
+                    timer.add(rows=len(part), batches=1, bytes=size)
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.options['retries']:
+                    raise
+                delay = min(self.options['backoff'] * 2 ** attempt, self.options['max_backoff'])
+                delay *= random.uniform(0.5, 1)  # so that the workers don't all retry at the same time
+                logger.warning(__("Writing {} points failed ({}), retry {} of {} in {:.1f}s", len(part), e,
+                                  attempt + 1, self.options['retries'], delay))
+                instrumentation.count(self.stage, retries=1)
+                time.sleep(delay)
+                self.resize(len(part) // 2)
+                if len(part) > self.options['min_batch_size']:
+                    # the first half is popped and written first
+                    half = len(part) // 2
+                    pending.extend([(part[half:], attempt + 1), (part[:half], attempt + 1)])
+                else:
+                    pending.append((part, attempt + 1))
+            else:
+                self.adapt(len(part), size, time.perf_counter() - start)
+
+    def adapt(self, count, size, seconds):
+        self.point_bytes = size / count
+        # aim for target_seconds per request, but at most double the size at once. The last batch of a stream may be
+        # smaller than the others, so only full batches can increase the size.
+        target = count * self.options['target_seconds'] / max(seconds, 1e-3)
+        if count < self.batch_size:
+            target = min(target, self.batch_size)
+        self.resize(min(target, 2 * self.batch_size))
+
+    def resize(self, size):
+        if self.point_bytes:
+            size = min(size, self.options['max_batch_bytes'] / self.point_bytes)
+        self.batch_size = int(min(max(size, self.options['min_batch_size']), self.options['max_batch_size']))
+
+
+# Writes each list of points right away with a single client, so everything passed to write is acknowledged by
+# the DB once write returns.
+class DirectWriter(object):
+    def __init__(self, new_client, stage="import.write", **write_args):
+        self.new_client = new_client
+        self.stage = stage
+        self.write_args = write_args
+        self.context = self.writer = None
+
+    def write(self, points):
+        self.writer.write_points(points, **self.write_args)
+
+    def then(self, callback):
+        callback()
+
+    def flush(self):
+        pass
+
+    def __enter__(self):
+        self.context = self.new_client()
+        self.writer = BatchWriter(self.context.__enter__(), self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.writer = None
+        return self.context.__exit__(exc_type, exc_val, exc_tb)
+
+
+# Writes the lists of points in background threads, so that the caller can already parse the next ones. Each writer
+# thread uses its own client and thereby keeps its own connection to the DB open. At most `maxsize` lists and
+# max_inflight_bytes are queued, after that write blocks until the DB caught up. Callbacks passed to then are only
+# called once all points written before them were acknowledged, in the order in which they were registered and in the
+# thread of the caller, so that they can e.g. commit checkpoints. Errors of the writer threads are raised by the next
+# write, then or flush.
+class PipelinedWriter(object):
+    def __init__(self, new_client, writers=1, maxsize=4, stage="import.write", **write_args):
+        self.new_client = new_client
+        self.writers = writers
+        self.stage = stage
+        self.write_args = write_args
+        self.queue = Queue(maxsize)
+        self.max_inflight_bytes = options['max_inflight_bytes']
+        self.acknowledged = threading.Condition()
+        self.inflight = 0  # estimated bytes that were passed to write, but not acknowledged yet
+        self.submitted = 0  # sequence number of the last list passed to write
+        self.written = 0  # all lists up to this sequence number were acknowledged
+        self.done = set()  # acknowledged sequence numbers after self.written
+        self.callbacks = deque()  # (sequence number of the last list before, callback)
+        self.executor = self.futures = None
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.writers)
+        self.futures = [self.executor.submit(self.drain) for _ in range(self.writers)]
+        return self
+
+    def drain(self):
+        with self.new_client() as client:
+            writer = BatchWriter(client, self.stage)
+            for nr, points, size in iter(self.queue.get, None):
+                writer.write_points(points, **self.write_args)
+                with self.acknowledged:
+                    self.inflight -= size
+                    self.done.add(nr)
+                    while self.written + 1 in self.done:
+                        self.written += 1
+                        self.done.remove(self.written)
+                    self.acknowledged.notify_all()
+
+    def check(self):
+        # raise the error of a failed writer thread in the caller
+        for future in self.futures:
+            if future.done():
+                future.result()
+                raise RuntimeError("Writer thread stopped unexpectedly")
+
+    def write(self, points):
+        self.run_callbacks()
+        size = estimate_bytes(points)
+        with self.acknowledged:
+            # always let at least one list through, no matter how large it is
+            while self.inflight and self.inflight + size > self.max_inflight_bytes:
+                self.check()
+                self.acknowledged.wait(timeout=1)
+            self.inflight += size
+        self.submitted += 1
+        while True:
+            self.check()
+            try:
+                self.queue.put((self.submitted, points, size), timeout=1)
+                return
+            except Full:
+                pass
+
+    def then(self, callback):
+        self.callbacks.append((self.submitted, callback))
+        self.run_callbacks()
+
+    def run_callbacks(self):
+        with self.acknowledged:
+            written = self.written
+        while self.callbacks and self.callbacks[0][0] <= written:
+            self.callbacks.popleft()[1]()
+
+    def flush(self):
+        # wait until everything written so far is acknowledged
+        with self.acknowledged:
+            while self.written < self.submitted:
+                self.check()
+                self.acknowledged.wait(timeout=1)
+        self.run_callbacks()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            # stop all writer threads that are still running, they first write the lists that are still queued
+            for _ in self.futures:
+                while not all(f.done() for f in self.futures):
+                    try:
+                        self.queue.put(None, timeout=1)
+                        break
+                    except Full:
+                        pass
+            self.executor.shutdown(wait=True)
+        if exc_type is None:
+            for future in self.futures:
+                future.result()
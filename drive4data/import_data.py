@@ -2,11 +2,14 @@ import json
 import logging.config
 import os
 import sys
+import time
 import warnings
 
+from drive4data.db import storage_cred, writer
 from drive4data.initialization import post_import
 from drive4data.initialization import pre_import
 from drive4data.initialization.importer import SamplesImporter, SummaryImporter
+from drive4data.util.instrument import instrumentation
 from iss4e.util import BraceMessage as __
 from iss4e.util.config import load_config
 
@@ -16,7 +19,7 @@ logger = logging.getLogger(__name__)
 
 def main():
     config = load_config()
-    cred = config["drive4data.influx"]
+    cred = storage_cred(config)
 
     logger.info(__("Creating output directories in {}", os.getcwd()))
     os.makedirs("tmp", exist_ok=True)
@@ -42,12 +45,30 @@ def main():
     logger.info(__("Analysis results written to {}", os.path.join(os.getcwd(), "out")))
 
     logger.info(__("Importing data from {}", samples))
-    SamplesImporter(cred, "samples").do_import(samples)
+    start = time.time()
+    instrumentation.configure(config.get("drive4data.instrument.enabled", False),
+                              config.get("drive4data.instrument.profile", False), "tmp/instrument-import")
+    writer.configure(**config.get("drive4data.write", {}))
+    batch_size = config.get("drive4data.import.batch_size", None)
+    incremental = config.get("drive4data.import.incremental", False)
+    collect_counts = config.get("drive4data.import.collect_counts", False)
+    writers = config.get("drive4data.import.writers", 0)
+    samples_importer = SamplesImporter(cred, "samples", batch_size=batch_size, incremental=incremental,
+                                       columnar=config.get("drive4data.import.columnar", False),
+                                       geohash_precision=config.get("drive4data.import.geohash_precision", 12),
+                                       collect_counts=collect_counts, writers=writers)
+    samples_importer.do_import(samples)
     logger.info(__("Importing trip summaries from {}", samples))
-    SummaryImporter(cred, "trips_import").do_import(trips)
+    SummaryImporter(cred, "trips_import", batch_size=batch_size, incremental=incremental,
+                    writers=writers).do_import(trips)
     logger.info(__("Importing done, analyzing data in DB", samples))
+    if incremental and os.path.isfile(post_import.SAVE_FILE):
+        # the results of an earlier analysis don't include the files that were imported now
+        os.remove(post_import.SAVE_FILE)
+    instrumentation.report("out/instrument-import.json", time.time() - start)
 
-    counts = post_import.analyze(cred)
+    counts = post_import.analyze(cred, single_pass=config.get("drive4data.post_import.single_pass", False),
+                                 import_counts=samples_importer.counts_file if collect_counts else None)
     with open("out/counts.csv", 'w+') as f:
         post_import.dump(counts, f)
     logger.info(__("Analysis results written to {}", os.path.join(os.getcwd(), "out/counts.csv")))
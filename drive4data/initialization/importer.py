@@ -1,31 +1,62 @@
 import abc
 import contextlib
 import csv
+import heapq
 import itertools
+import json
 import logging
 import math
 import os
 import pickle
 import re
-from datetime import datetime
-from datetime import timedelta
 from multiprocessing.pool import Pool
 from os.path import join
 
 import geohash
-import pytz
+import numpy as np
+from drive4data.db import connect, writer as db_writer
+from drive4data.db.writer import DirectWriter, PipelinedWriter
+from drive4data.initialization.journal import CheckpointJournal
+from drive4data.initialization.manifest import ImportManifest, TimeRange, manifest_entry
+from drive4data.initialization.post_import import SampleCounts
 from drive4data.initialization.pre_import import FW3I_VALUES, FW3I_FOLDER
-from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient
+from drive4data.util.geohash import encode_many
+from drive4data.util import instrument
+from drive4data.util.instrument import instrumentation
+from drive4data.util.timestamps import NS_PER_MS, parse_duration, parse_info_time, parse_summary_time, timezone, \
+    to_epoch_ns
 from iss4e.util import BraceMessage as __
-from iss4e.util import SafeFileWalker
 from iss4e.util import progress
-from more_itertools import peekable
 
 __author__ = "Niko Fink"
 
+DELETE_BATCH_SIZE = 1000  # statements per DELETE query when re-importing a changed file
 
-def chunkify(lst, n):
-    return [lst[i::n] for i in range(n)]
+
+def init_worker(instrument_settings, write_settings):
+    instrument.init_worker(instrument_settings)
+    db_writer.init_worker(write_settings)
+
+
+def list_files(root):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = join(dirpath, name)
+            files.append((path, os.stat(path).st_size))
+    return files
+
+
+def balance(files, n):
+    # greedily assign the largest remaining file to the worker with the fewest bytes so far
+    buckets = [[] for _ in range(n)]
+    loads = [(0, i) for i in range(n)]
+    for path, size in sorted(files, key=lambda f: f[1], reverse=True):
+        load, i = heapq.heappop(loads)
+        buckets[i].append(path)
+        heapq.heappush(loads, (load + size, i))
+    return buckets, [load for load, i in sorted(loads, key=lambda l: l[1])]
 
 
 # noinspection PyMethodMayBeStatic
@@ -34,50 +65,196 @@ class Importer:
 
     def __init__(self, cred, measurement, logger=None, processes=4,
                  checkpoint_file=None,
-                 checkpoint_copy_file=None):
+                 plan_file=None,
+                 batch_size=None,
+                 incremental=False,
+                 manifest_file=None,
+                 collect_counts=False,
+                 counts_file=None,
+                 writers=0):
         if not logger:
             self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
         self.cred = cred
         self.measurement = measurement
         self.processes = processes
         if not checkpoint_file:
-            checkpoint_file = "tmp/{}-checkpoint{{}}.pickle".format(self.__class__.__name__)
+            checkpoint_file = "tmp/{}-checkpoint{{}}.journal".format(self.__class__.__name__)
         self.checkpoint_file = checkpoint_file
-        if not checkpoint_copy_file:
-            checkpoint_copy_file = "tmp/{}-checkpoint{{}}.pickle.tmp".format(self.__class__.__name__)
-        self.checkpoint_copy_file = checkpoint_copy_file
+        if not plan_file:
+            plan_file = "tmp/{}-plan.json".format(self.__class__.__name__)
+        self.plan_file = plan_file
+        # if set, parse and write files in batches of this many rows instead of loading them completely
+        self.batch_size = batch_size
+        # if set, only import files that are new or changed since the last import recorded in the manifest
+        self.incremental = incremental
+        if not manifest_file:
+            manifest_file = "tmp/{}-manifest.json".format(self.__class__.__name__)
+        self.manifest_file = manifest_file
+        # if set, collect the statistics of post_import.analyze while writing the points
+        self.collect_counts = collect_counts
+        if not counts_file:
+            counts_file = "tmp/{}-counts.pickle".format(self.__class__.__name__)
+        self.counts_file = counts_file
+        # if set, write the points in this many background threads per worker while the next batches are parsed
+        self.writers = writers
 
     def new_client(self):
-        return contextlib.closing(InfluxDBClient(**self.cred))
+        return contextlib.closing(connect(self.cred))
+
+    def new_writer(self):
+        if self.writers:
+            return PipelinedWriter(self.new_client, self.writers, maxsize=2 * self.writers, time_precision='n')
+        return DirectWriter(self.new_client, time_precision='n')
 
     def do_import(self, root):
-        if all([os.path.isfile(self.checkpoint_file.format(i)) for i in range(0, self.processes)]):
+        self.check_old_checkpoints()
+        manifest = ImportManifest(self.manifest_file)
+        if os.path.isfile(self.plan_file):
             self.logger.info("Loading checkpoint")
-            iters = []
-            for i in range(0, self.processes):
-                with open(self.checkpoint_file.format(i), "rb") as f:
-                    iters.append(pickle.load(f))
+            with open(self.plan_file, "rt") as f:
+                files = json.load(f)
+
+        elif self.incremental and manifest.exists():
+            self.logger.info("Performing incremental import")
+            manifest.load()
+            new, changed, removed = manifest.diff([path for path, size in list_files(root)])
+            self.logger.info(__("Found {} new, {} changed and {} removed files", len(new), len(changed), len(removed)))
+
+            # delete the points of changed and removed files, as they might not be overwritten by the new data
+            for path in changed + removed:
+                self.delete_source(path, manifest.entries[path])
+            manifest.remove(removed)
+            manifest.save()
+
+            files = self.make_plan([(path, os.stat(path).st_size) for path in new + changed])
 
         else:
             self.logger.info("Performing cold start")
 
             with self.new_client() as client:
                 client.drop_measurement(self.measurement)
-
-            files = chunkify([join(root, sub) for sub in os.listdir(root)], self.processes)
-            iters = list([SafeFileWalker(f) for f in files])
-
-            for nr, it in enumerate(iters):
-                with open(self.checkpoint_file.format(nr), "wb") as f:
-                    pickle.dump(it, f)
-
-        assert len(iters) == self.processes
-
-        self.logger.info("Iterators loaded, starting pool")
-        with Pool(processes=self.processes) as pool:
-            row_count = pool.map(self.walk_files, [(nr, it) for (nr, it) in enumerate(iters)], chunksize=1)
-        imported = sum(row_count)  # consuming the iterator blocks the main thread until everything is done
-        self.logger.info(__("Imported {} = {} rows", row_count, imported))
+            if manifest.exists():
+                os.remove(self.manifest_file)
+
+            files = self.make_plan(list_files(root))
+
+        assert len(files) == self.processes
+
+        self.logger.info("File lists loaded, starting pool")
+        with Pool(processes=self.processes, initializer=init_worker,
+                  initargs=(instrumentation.settings(), db_writer.settings())) as pool:
+            row_count = pool.map(self.walk_files, [(nr, f) for (nr, f) in enumerate(files)], chunksize=1)
+            imported = sum(row_count)  # consuming the iterator blocks the main thread until everything is done
+            self.logger.info(__("Imported {} = {} rows", row_count, imported))
+
+            extras = {}
+            for nr in range(0, self.processes):
+                extras.update(CheckpointJournal(self.checkpoint_file.format(nr)).load().extras())
+            file_counts = {path: extra['counts'] for path, extra in extras.items() if 'counts' in extra}
+
+            if self.incremental:
+                self.logger.info("Updating manifest")
+                if manifest.exists():
+                    manifest.load()
+                manifest.update(pool.imap_unordered(manifest_entry, itertools.chain.from_iterable(files)))
+                for path, extra in extras.items():
+                    entry = manifest.entries[path]
+                    if 'counts' in extra:
+                        entry['counts'] = extra['counts']
+                    if 'range' in extra:
+                        entry['participant'] = self.extract_participant(path)
+                        entry['first'], entry['last'] = extra['range']
+                # the counts of all files, including the ones imported by earlier runs
+                file_counts = {path: entry['counts'] for path, entry in manifest.entries.items() if 'counts' in entry}
+                manifest.save()
+                os.remove(self.plan_file)
+
+        if self.collect_counts:
+            self.save_counts(file_counts)
+        return imported
+
+    def check_old_checkpoints(self):
+        # checkpoints used to be pickled file lists, imports interrupted before the switch to journals can't be resumed
+        if not self.checkpoint_file.endswith(".journal"):
+            return
+        old = [self.checkpoint_file[:-len(".journal")].format(nr) + ".pickle" for nr in range(0, self.processes)]
+        old = [file for file in old if os.path.isfile(file)]
+        if old:
+            self.logger.warning(__("Ignoring the old checkpoints {}, the import won't be resumed from them. "
+                                   "Delete them once this import completed.", old))
+
+    def save_counts(self, file_counts):
+        data = {}
+        for path, dump in file_counts.items():
+            key = "participant={}".format(self.extract_participant(path))
+            counts = SampleCounts.load(dump)
+            data[key] = data[key].merge(counts) if key in data else counts
+        with open(self.counts_file, "wb") as f:
+            pickle.dump({key: counts.to_data() for key, counts in data.items()}, f)
+        self.logger.info(__("Counts of {} participants written to {}", len(data), self.counts_file))
+
+    def make_plan(self, file_sizes):
+        files, loads = balance(file_sizes, self.processes)
+        self.logger.info(__("Distributed {} files with {} bytes to {} workers, bytes per worker {} "
+                            "(max/mean {:.2f})", sum(len(f) for f in files), sum(loads), self.processes, loads,
+                            max(loads) * self.processes / max(sum(loads), 1)))
+
+        for nr in range(0, self.processes):
+            CheckpointJournal(self.checkpoint_file.format(nr)).truncate()
+        with open(self.plan_file + ".tmp", "wt") as f:
+            json.dump(files, f)
+        os.replace(self.plan_file + ".tmp", self.plan_file)
+        return files
+
+    def delete_source(self, path, entry):
+        # `source` is a field and can't be used in a DELETE, so delete the time range covered by the file instead.
+        # Points of other files in that range are kept by only deleting the runs of consecutive points of this file.
+        with contextlib.closing(connect(self.cred, time_epoch='n')) as client:
+            if 'first' in entry:
+                ranges = {entry['participant']: (entry['first'], entry['last'])} if entry['first'] is not None else {}
+            else:
+                self.logger.warning(__("No time range of {} in the manifest, searching its points", path))
+                ranges = self.find_source(client, entry["ino"])
+            for participant, (first, last) in ranges.items():
+                runs = self.source_runs(client, participant, first, last, entry["ino"])
+                self.logger.info(__("Deleting points of {} for participant {} in {} ranges", path, participant,
+                                    len(runs)))
+                # InfluxDB doesn't allow OR on time in a DELETE, so send batches of statements
+                for nr in range(0, len(runs), DELETE_BATCH_SIZE):
+                    client.query(";".join(
+                        "DELETE FROM {} WHERE participant = '{}' AND {}".format(
+                            self.measurement, participant,
+                            "time = {}".format(start) if start == end else
+                            "time >= {} AND time <= {}".format(start, end))
+                        for start, end in runs[nr:nr + DELETE_BATCH_SIZE]))
+
+    def find_source(self, client, ino):
+        # scans the whole measurement, only needed for manifests without the time ranges of the files
+        ranges = {}
+        for func in ["first", "last"]:
+            res = client.query("SELECT {}(source) FROM {} WHERE source = {} GROUP BY participant"
+                               .format(func, self.measurement, ino))
+            for (meas, groups), rows in res.items():
+                ranges.setdefault(groups['participant'], []).extend(row['time'] for row in rows)
+        return {participant: (min(times), max(times)) for participant, times in ranges.items()}
+
+    def source_runs(self, client, participant, first, last, ino):
+        # the first and last time of each run of consecutive points from source `ino` within the time range
+        runs, start, end = [], None, None
+        for row in client.stream_params(self.measurement, fields="time, source",
+                                        where="participant = '{}' AND time >= {} AND time <= {}".format(
+                                            participant, first, last),
+                                        group_order_by="ORDER BY time ASC"):
+            if row['source'] == ino:
+                if start is None:
+                    start = row['time']
+                end = row['time']
+            elif start is not None:
+                runs.append((start, end))
+                start = None
+        if start is not None:
+            runs.append((start, end))
+        return runs
 
     def walk_files(self, args):
         nr, files = args
@@ -85,32 +262,59 @@ class Importer:
         self.logger = self.logger.getChild(str(nr))
         self.logger.info(__("{} starting", nr))
 
-        with self.new_client() as client:
+        # the writer is closed first, so that the checkpoints of the last writes still get into the journal
+        with CheckpointJournal(self.checkpoint_file.format(nr)).load() as journal, self.new_writer() as writer:
             row_count = 0
-            last_save = -1
-            has_tmp_file = False
             for file in progress(files, logger=self.logger):
                 try:
-                    if last_save != row_count:
-                        with open(self.checkpoint_copy_file.format(nr), "wb") as f:
-                            pickle.dump(files, f)
-                        last_save = row_count
-                        has_tmp_file = True
-
-                    row_count += self.parse_file(client, file)
-
-                    if has_tmp_file:
-                        os.replace(self.checkpoint_copy_file.format(nr), self.checkpoint_file.format(nr))
-                        has_tmp_file = False
+                    stat = os.stat(file)
+                    if journal.is_done(file, stat):
+                        continue
+                    offset, extra = journal.offset(file, stat)
+                    extra = extra or {}
+                    if offset:
+                        self.logger.info(__("Resuming file {} after row {}", file, offset))
+                    # the counts and the time range of the rows written so far are stored together with the offset
+                    counts = time_range = None
+                    if self.collect_counts:
+                        counts = SampleCounts.load(extra['counts']) if 'counts' in extra else SampleCounts()
+                    if self.incremental:
+                        time_range = TimeRange(*extra.get('range', []))
+
+                    with instrumentation.timer("import.file", files=1, bytes=stat.st_size) as timer:
+                        rows = self.parse_file(writer, file, skip=offset, counts=counts, time_range=time_range,
+                                               on_batch=lambda cnt: self.checkpoint(
+                                                   writer, journal.mark_offset, file, stat, cnt, counts, time_range))
+                        self.checkpoint(writer, journal.mark_done, file, stat, rows, counts, time_range)
+                        timer.add(rows=rows - offset)
+                    row_count += rows - offset
                 except:
                     self.logger.error(__("In file  {}", file))
                     raise
 
         self.logger.info(__("finished reading {} rows", row_count))
         self.logger = old_logger
+        instrumentation.flush()
         return row_count
 
-    def parse_file(self, client, file):
+    def checkpoint(self, writer, mark, file, stat, rows, counts, time_range):
+        # dump the counts right away, as they might already include later rows once the writes are acknowledged
+        extra = {}
+        if counts:
+            with instrumentation.timer("import.counts"):
+                extra['counts'] = counts.dump()
+        if time_range:
+            extra['range'] = time_range.dump()
+        extra = extra or None
+
+        def commit():
+            with instrumentation.timer("import.checkpoint"):
+                mark(file, stat, rows, extra)
+
+        # only commit the checkpoint once the DB acknowledged all rows up to it, so that none are lost when resuming
+        writer.then(commit)
+
+    def parse_file(self, writer, file, skip=0, on_batch=None, counts=None, time_range=None):
         # extract the participant
         participant = self.extract_participant(file)
         stat = os.stat(file)
@@ -123,16 +327,52 @@ class Importer:
                 return 0
 
             rows = self.parse_rows(file, stat, participant, header, reader)
-            counter = itertools.count()  # zipping with a counter is the most efficient way to count an iterable
-            rows = [r for c, r in zip(counter, rows)]  # so, increase counter with each consumed item
-            rows = peekable(rows)  # many files contain no data, so peek into the iter and skip if it's empty
+            if self.batch_size:
+                return self.write_batched(writer, rows, skip, on_batch, counts, time_range)
 
-            # save the data
-            if rows.peek(None):
-                client.write_points(rows)
+            counter = itertools.count()  # zipping with a counter is the most efficient way to count an iterable
+            with instrumentation.timer("import.parse") as timer:
+                rows = [r for c, r in zip(counter, rows)]  # so, increase counter with each consumed item
+                timer.add(rows=len(rows))
+            rows = rows[skip:]
+            if counts:
+                with instrumentation.timer("import.counts", rows=len(rows)):
+                    counts.update_points(rows)
+            if time_range:
+                time_range.update_points(rows)
+
+            # save the data, many files contain no data
+            if rows:
+                writer.write(rows)
 
             return next(counter) - 1  # number of consumed items was the previous value of the counter
 
+    def write_batched(self, writer, rows, skip=0, on_batch=None, counts=None, time_range=None):
+        rows = iter(rows)
+        # rows that were already written before resuming from a checkpoint are parsed, but not written again
+        with instrumentation.timer("import.parse") as timer:
+            row_count = sum(1 for _ in itertools.islice(rows, skip))
+            timer.add(rows=row_count)
+        # empty files yield an empty first batch and are skipped without writing anything
+        for batch in iter(lambda: self.parse_batch(rows), []):
+            writer.write(batch)
+            row_count += len(batch)
+            if counts:
+                with instrumentation.timer("import.counts", rows=len(batch)):
+                    counts.update_points(batch)
+            if time_range:
+                time_range.update_points(batch)
+            if on_batch:
+                on_batch(row_count)
+        return row_count
+
+    def parse_batch(self, rows):
+        # rows are parsed lazily, so this times parsing the next batch
+        with instrumentation.timer("import.parse") as timer:
+            batch = list(itertools.islice(rows, self.batch_size))
+            timer.add(rows=len(batch))
+        return batch
+
     def extract_participant(self, file):
         m = re.search('Participant ([0-9]{1,2}b?)', file)
         participant = m.group(1)
@@ -168,6 +408,14 @@ class SamplesImporter(Importer):
             'outside_air_temp', 'veh_odometer', 'veh_speed', 'vin_1', 'vin_2', 'vin_3', 'vin_digit', 'vin_frame1',
             'vin_frame2', 'vin_index', 'reltime']
 
+    def __init__(self, *args, columnar=False, geohash_precision=12, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.columnar = columnar
+        # number of characters of gps_geohash
+        self.geohash_precision = geohash_precision
+        # the coordinates of the last sample and their geohash, which stay the same for long stretches while parked
+        self.last_coords = self.last_geohash = None
+
     def extract_header(self, file, reader):
         header = next(reader)
         if "Trip" in header or "Trip Id" in header:
@@ -182,10 +430,12 @@ class SamplesImporter(Importer):
     def parse_rows(self, file, stat, participant, header, reader):
         # extract the info row
         base_time, car_id = self.extract_infos(file, reader)
+        if self.columnar:
+            return self.parse_columns(stat, participant, header, reader, base_time, car_id)
         # transform all the following rows for the InfluxDB client
-        rows = [{
+        return ({
                     'measurement': 'samples',
-                    'time': base_time + timedelta(milliseconds=int(row[0])),
+                    'time': base_time + int(row[0]) * NS_PER_MS,
                     'tags': {
                         'participant': participant
                     },
@@ -193,25 +443,77 @@ class SamplesImporter(Importer):
                         'source': stat.st_ino,
                         'car_id': car_id
                     })
-                } for row in reader]
-        return rows
+                } for row in reader)
 
     def extract_infos(self, file, reader):
         infos = next(reader)
         assert len(infos) == 3, "Illegal info row {}".format(infos)
         assert len(infos[2]) == 0 or (infos[2] in FW3I_VALUES and FW3I_FOLDER in file), \
             "Illegal info row {}".format(infos)
-        # base_time is in UTC
-        base_time = datetime.strptime(infos[0], "%m/%d/%Y %I:%M:%S %p")
+        # base_time is in UTC, as ns since the epoch like the times of all points
+        base_time = to_epoch_ns(parse_info_time(infos[0]))
         car_id = infos[1]
         return base_time, car_id
 
+    def parse_columns(self, stat, participant, header, reader, base_time, car_id):
+        # in streaming mode, only hold batch_size rows in memory at once
+        for rows in iter(lambda: list(itertools.islice(reader, self.batch_size)), []):
+            yield from self.rows_to_points(stat, participant, header, rows, base_time, car_id)
+
+    def rows_to_points(self, stat, participant, header, rows, base_time, car_id):
+        # resolve the wanted columns to their indices once, later duplicates override earlier ones
+        names, indices = [], []
+        for name in dict.fromkeys(h for h in header if h in self.COLS):
+            names.append(name)
+            indices.append([i for i, h in enumerate(header) if h == name])
+        with instrumentation.timer("import.convert", rows=len(rows)):
+            values = np.empty((len(rows), len(names)))
+            for j, idx in enumerate(indices):
+                for i in idx:
+                    col = np.array([r[i] if i < len(r) else "nan" for r in rows], dtype=float)
+                    values[:, j] = col if i == idx[0] else np.where(np.isfinite(col), col, values[:, j])
+            finite = np.isfinite(values)
+
+        times = (base_time + np.array([r[0] for r in rows], dtype=np.int64) * NS_PER_MS).tolist()
+
+        hashes = None
+        if 'gps_lat_deg' in names and 'gps_lon_deg' in names:
+            lat, lon = names.index('gps_lat_deg'), names.index('gps_lon_deg')
+            has_gps = finite[:, lat] & finite[:, lon] & ((values[:, lat] != 0) | (values[:, lon] != 0))
+            with instrumentation.timer("import.geohash", rows=len(rows)):
+                hashes = encode_many(values[:, lat], values[:, lon], has_gps, self.geohash_precision).tolist()
+
+        constants = {'source': stat.st_ino, 'car_id': car_id}
+        all_finite = finite.all(axis=1).tolist()
+        finite = finite.tolist()
+        points = []
+        for i, row in enumerate(values.tolist()):
+            if all_finite[i]:
+                fields = dict(zip(names, row))
+            else:
+                fields = {k: v for k, v, f in zip(names, row, finite[i]) if f}
+            if hashes and hashes[i]:
+                fields['gps_geohash'] = hashes[i]
+            fields.update(constants)
+            points.append({
+                'measurement': 'samples',
+                'time': times[i],
+                'tags': {
+                    'participant': participant
+                },
+                'fields': fields
+            })
+        return points
+
     def extract_row(self, row, header, constants):
         values = dict([(k, float(v)) for k, v in zip(header, row)
                        if k in self.COLS and math.isfinite(float(v))])
         if 'gps_lat_deg' in values and 'gps_lon_deg' in values and \
                 (values['gps_lat_deg'] != 0 or values['gps_lon_deg'] != 0):
-            values['gps_geohash'] = geohash.encode(values['gps_lat_deg'], values['gps_lon_deg'])
+            coords = (values['gps_lat_deg'], values['gps_lon_deg'])
+            if coords != self.last_coords:
+                self.last_coords, self.last_geohash = coords, geohash.encode(*coords, precision=self.geohash_precision)
+            values['gps_geohash'] = self.last_geohash
         values.update(constants)
         return values
 
@@ -238,14 +540,16 @@ class SummaryImporter(Importer):
 
     def parse_rows(self, file, stat, participant, header, reader):
         # transform all the following rows for the InfluxDB client
-        return [{
+        return ({
                     'measurement': 'trips_import',
                     'time': self.get_time(row),
                     'tags': {
                         'participant': participant
                     },
-                    'fields': self.extract_row(row, header)
-                } for row in reader]
+                    'fields': self.extract_row(row, header, {
+                        'source': stat.st_ino
+                    })
+                } for row in reader)
 
     def extract_participant(self, file):
         m = re.search('Participant ([0-9]{1,2}b?)', file)
@@ -256,20 +560,17 @@ class SummaryImporter(Importer):
             participant = int(participant)
         return participant
 
-    def extract_row(self, row, header):
+    def extract_row(self, row, header, constants):
         values = dict([(k, v) for k, v in zip(header, row)])
         del values['date']
-        t = datetime.strptime(values['duration'], "%H:%M:%S")
-        values['duration'] = timedelta(hours=t.hour, minutes=t.minute, seconds=t.second).total_seconds()
+        values['duration'] = parse_duration(values['duration'])
         for h in self.COLS_FLOAT:
             if h in values:
                 values[h] = float(values[h])
+        values.update(constants)
         return values
 
     def get_time(self, row):
-        naive = datetime.strptime(row[5], "%B %d, %Y %I:%M:%S %p")
+        naive = parse_summary_time(row[5])
         # Canada/Eastern without DST is just a guess
-        local = pytz.timezone("Canada/Eastern")
-        local_dt = local.localize(naive, is_dst=None)
-        utc_dt = local_dt.astimezone(pytz.utc)
-        return utc_dt
+        return timezone("Canada/Eastern").localize_ns(to_epoch_ns(naive))
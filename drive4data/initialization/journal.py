@@ -0,0 +1,90 @@
+import json
+import os
+
+__author__ = "Niko Fink"
+
+DONE = "done"
+OFFSET = "offset"
+
+
+def file_key(stat):
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+# Append-only log of the import progress of a single worker. Each line records either a completed file or the
+# number of rows of a file that were already written, keyed by the path and the inode, size and mtime of the file.
+# Appending an entry costs the same no matter how many files are already done.
+class CheckpointJournal(object):
+    def __init__(self, file):
+        self.file = file
+        self.entries = {}
+        self.handle = None
+
+    def load(self):
+        self.entries = {}
+        if os.path.isfile(self.file):
+            with open(self.file, "rb+") as f:
+                complete = 0  # end of the last complete line
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    complete += len(line)
+                    try:
+                        kind, path, ino, size, mtime, rows, *extra = json.loads(line.decode())
+                    except ValueError:
+                        continue
+                    self.entries[path] = (kind, (ino, size, mtime), rows, extra[0] if extra else None)
+                # the last line is incomplete if we crashed while writing it, remove it so that the next entry
+                # isn't appended to it
+                f.truncate(complete)
+        return self
+
+    def truncate(self):
+        self.close()
+        self.entries = {}
+        open(self.file, "wt").close()
+
+    def lookup(self, path, stat):
+        kind, key, rows, extra = self.entries.get(path, (None, None, 0, None))
+        if key != file_key(stat):
+            return None, 0, None
+        return kind, rows, extra
+
+    def is_done(self, path, stat):
+        return self.lookup(path, stat)[0] == DONE
+
+    def offset(self, path, stat):
+        kind, rows, extra = self.lookup(path, stat)
+        return (rows, extra) if kind == OFFSET else (0, None)
+
+    def extras(self):
+        # the extra data of the latest entry of each file, e.g. the statistics of the rows written so far
+        return {path: extra for path, (kind, key, rows, extra) in self.entries.items() if extra is not None}
+
+    def append(self, kind, path, stat, rows, extra=None):
+        if not self.handle:
+            self.handle = open(self.file, "at")
+        key = file_key(stat)
+        entry = [kind, path, key[0], key[1], key[2], rows]
+        if extra is not None:
+            entry.append(extra)
+        self.handle.write(json.dumps(entry) + "\n")
+        self.handle.flush()
+        self.entries[path] = (kind, key, rows, extra)
+
+    def mark_offset(self, path, stat, rows, extra=None):
+        self.append(OFFSET, path, stat, rows, extra)
+
+    def mark_done(self, path, stat, rows, extra=None):
+        self.append(DONE, path, stat, rows, extra)
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+__author__ = "Niko Fink"
+
+
+def hash_file(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def manifest_entry(path):
+    stat = os.stat(path)
+    return path, {"ino": stat.st_ino, "size": stat.st_size, "mtime": stat.st_mtime_ns, "sha1": hash_file(path)}
+
+
+# The first and last time of the points written from a file, which are stored in its manifest entry, so that the
+# points of the file can be found again without scanning the whole measurement.
+class TimeRange(object):
+    __slots__ = ['first', 'last']
+
+    def __init__(self, first=None, last=None):
+        self.first = first
+        self.last = last
+
+    def update_points(self, points):
+        times = [p['time'] for p in points]
+        if not times:
+            return
+        first, last = min(times), max(times)
+        if self.first is None:
+            self.first, self.last = first, last
+        else:
+            self.first, self.last = min(self.first, first), max(self.last, last)
+
+    def dump(self):
+        return [self.first, self.last]
+
+
+# Records which source files were imported, so that later imports only need to process new or changed files.
+class ImportManifest(object):
+    def __init__(self, file):
+        self.file = file
+        self.entries = {}
+
+    def exists(self):
+        return os.path.isfile(self.file)
+
+    def load(self):
+        with open(self.file, "rt") as f:
+            self.entries = json.load(f)
+        return self
+
+    def save(self):
+        with open(self.file + ".tmp", "wt") as f:
+            json.dump(self.entries, f, sort_keys=True, indent=1)
+        os.replace(self.file + ".tmp", self.file)
+
+    def diff(self, files):
+        new, changed = [], []
+        for path in files:
+            entry = self.entries.get(path)
+            if not entry:
+                new.append(path)
+                continue
+            stat = os.stat(path)
+            if stat.st_ino != entry["ino"] or stat.st_size != entry["size"]:
+                changed.append(path)
+            elif stat.st_mtime_ns != entry["mtime"]:
+                # only the mtime changed, so check whether the contents actually differ
+                if hash_file(path) != entry["sha1"]:
+                    changed.append(path)
+                else:
+                    entry["mtime"] = stat.st_mtime_ns
+        removed = list(self.entries.keys() - set(files))
+        return new, changed, removed
+
+    def update(self, entries):
+        self.entries.update(entries)
+
+    def remove(self, paths):
+        for path in paths:
+            self.entries.pop(path, None)
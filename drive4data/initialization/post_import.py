@@ -1,11 +1,17 @@
+import collections
 import contextlib
 import csv
+import itertools
 import logging
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 
-from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient
+import numpy as np
+from drive4data.db import connect
+from drive4data.util.timestamps import EPOCH_NS
 from iss4e.util import BraceMessage as __
+from iss4e.util import progress
 
 __author__ = "Niko Fink"
 logger = logging.getLogger(__name__)
@@ -23,6 +29,83 @@ FIELDNAMES = ['time', 'key', 'first', 'last', 'duration', 'min_soc', 'max_soc',
               'count_vin_digit', 'count_vin_frame1', 'count_vin_frame2', 'count_vin_index', 'count_car_id']
 for i in range(0, 100, 5):
     FIELDNAMES.append("count_soc_{}".format(i))
+SOC_BINS = ["count_soc_{}".format(i) for i in range(0, 100, 5)]
+
+
+class SampleCounts(object):
+    # mergeable accumulator for the values that analyze() otherwise queries from the DB for a single participant
+    def __init__(self):
+        self.first = self.last = None
+        self.counts = {}
+        self.min_soc = self.max_soc = None
+        self.soc_hist = np.zeros(len(SOC_BINS), dtype=np.int64)
+
+    def update_points(self, points):
+        # collect the statistics from a batch of points as they are written by the SamplesImporter
+        if not points:
+            return
+        # the importers write times in ns, while analyze() uses TIME_EPOCH
+        times = [p['time'] for p in points]
+        self.update_times(min(times) // EPOCH_NS[TIME_EPOCH], max(times) // EPOCH_NS[TIME_EPOCH])
+        self.update_counts(collections.Counter(itertools.chain.from_iterable(p['fields'] for p in points)))
+        self.update_soc([p['fields']['hvbatt_soc'] for p in points if 'hvbatt_soc' in p['fields']])
+
+    def update_times(self, first, last):
+        if self.first is None or first < self.first:
+            self.first = first
+        if self.last is None or last > self.last:
+            self.last = last
+
+    def update_counts(self, counts):
+        for key, cnt in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + cnt
+
+    def update_soc(self, soc):
+        soc = np.asarray(soc, dtype=float)
+        valid = soc[soc < 200]
+        if len(valid):
+            self.update_range(float(valid.min()), float(valid.max()))
+        # bins are [0, 5), [5, 10), ..., [95, 101)
+        binned = soc[(soc >= 0) & (soc < 101)]
+        self.soc_hist += np.bincount(np.minimum(binned // 5, len(SOC_BINS) - 1).astype(np.int64),
+                                     minlength=len(SOC_BINS))
+
+    def update_range(self, min_soc, max_soc):
+        if self.min_soc is None or min_soc < self.min_soc:
+            self.min_soc = min_soc
+        if self.max_soc is None or max_soc > self.max_soc:
+            self.max_soc = max_soc
+
+    def merge(self, other):
+        if other.first is not None:
+            self.update_times(other.first, other.last)
+        if other.min_soc is not None:
+            self.update_range(other.min_soc, other.max_soc)
+        self.update_counts(other.counts)
+        self.soc_hist += other.soc_hist
+        return self
+
+    def dump(self):
+        return {'first': self.first, 'last': self.last, 'counts': self.counts, 'min_soc': self.min_soc,
+                'max_soc': self.max_soc, 'soc_hist': self.soc_hist.tolist()}
+
+    @classmethod
+    def load(cls, dump):
+        counts = cls()
+        counts.first, counts.last = dump['first'], dump['last']
+        counts.counts = dict(dump['counts'])
+        counts.min_soc, counts.max_soc = dump['min_soc'], dump['max_soc']
+        counts.soc_hist = np.array(dump['soc_hist'], dtype=np.int64)
+        return counts
+
+    def to_data(self):
+        data = {'counts': dict({'time': 0}, **{"count_" + key: cnt for key, cnt in self.counts.items()})}
+        if self.first is not None:
+            data['first'], data['last'] = self.first, self.last
+        if self.min_soc is not None:
+            data['min_soc'], data['max_soc'] = self.min_soc, self.max_soc
+        data.update(zip(SOC_BINS, self.soc_hist.tolist()))
+        return data
 
 
 def extract_res(res, data, func):
@@ -36,13 +119,22 @@ def extract_res(res, data, func):
         data[d_key][key] = value
 
 
-def analyze(cred):
-    if os.path.isfile(SAVE_FILE):
+def analyze(cred, single_pass=False, processes=4, import_counts=None):
+    if import_counts:
+        # use the counts collected while importing, so no queries are needed. They are always more recent than the
+        # results of an earlier analysis in SAVE_FILE.
+        with open(import_counts, "rb") as f:
+            data = pickle.load(f)
+    elif os.path.isfile(SAVE_FILE):
         with open(SAVE_FILE, "rb") as f:
             data = pickle.load(f)
+    elif single_pass:
+        data = analyze_single_pass(cred, processes)
+        with open(SAVE_FILE, "wb+") as f:
+            pickle.dump(data, f)
     else:
         data = {}
-        with contextlib.closing(InfluxDBClient(time_epoch=TIME_EPOCH, **cred)) as client:
+        with contextlib.closing(connect(cred, time_epoch=TIME_EPOCH)) as client:
             logger.info(__("Querying res_first"))
             res_first = client.query(
                 "SELECT participant, first(source) FROM samples GROUP BY participant")
@@ -81,6 +173,51 @@ def analyze(cred):
     return (data_to_row(k, v) for k, v in data.items())
 
 
+def analyze_single_pass(cred, processes=4):
+    # stream all samples of each participant once instead of running one full-scan query per statistic
+    with contextlib.closing(connect(cred, time_epoch=TIME_EPOCH)) as client:
+        series = client.list_series("samples")
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(count_series, cred, sname, sselector) for sname, sselector in series]
+        results = [f.result() for f in futures]
+
+    data = {}
+    for key, counts in results:
+        if key in data:
+            counts = data[key].merge(counts)
+        data[key] = counts
+    return {key: counts.to_data() for key, counts in data.items()}
+
+
+def count_series(cred, sname, sselector, chunk_size=100000):
+    logger.info(__("Counting samples of {}", sname))
+    counts = SampleCounts()
+    key = None
+    with contextlib.closing(connect(cred, time_epoch=TIME_EPOCH)) as client:
+        stream = progress(client.stream_params("samples", fields="*", where=sselector,
+                                               group_order_by="ORDER BY time ASC"), delay=4)
+        field_counts, soc = {}, []
+        for sample in stream:
+            if key is None:
+                key = "participant={}".format(sample['participant'])
+                counts.update_times(sample['time'], sample['time'])
+            for field, value in sample.items():
+                if value is not None:
+                    field_counts[field] = field_counts.get(field, 0) + 1
+            if sample.get('hvbatt_soc') is not None:
+                soc.append(sample['hvbatt_soc'])
+                if len(soc) >= chunk_size:
+                    counts.update_soc(soc)
+                    soc = []
+        if key is not None:
+            counts.update_times(sample['time'], sample['time'])
+        counts.update_soc(soc)
+        for tag in ('time', 'participant'):
+            field_counts.pop(tag, None)
+        counts.update_counts(field_counts)
+    return key, counts
+
+
 def data_to_row(key, value):
     row = {
         'key': key,
@@ -1,9 +1,12 @@
+import json
 import logging
 import os
 import re
 from collections import Counter
 from datetime import datetime, timedelta
+from multiprocessing.pool import Pool
 
+from drive4data.util.timestamps import parse_info_time
 from iss4e.util import BraceMessage as __
 from iss4e.util import SafeFileWalker
 from iss4e.util import progress
@@ -15,73 +18,123 @@ FW3I_VALUES = ["JTDKN3DP1D3034553", "5NPEB4AC6BH004902", "?????????????????"]
 FW3I_FOLDER = "Participant 04-2013-05-08T14-43-54-2015-01-30T16-51-00"
 
 
-def analyze(root):
+def analyze(root, processes=4, cache_file="tmp/pre_import-cache.json"):
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file, "rt") as f:
+            cache = json.load(f)
+
+    # only analyze files that are new or changed since the cached run
+    results, todo = {}, {}
+    for path in SafeFileWalker(root):
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        if path in cache and cache[path][0] == key:
+            results[path] = cache[path][1]
+        else:
+            todo[path] = key
+    logger.info(__("Using cached results for {} files, analyzing {} files", len(results), len(todo)))
+
+    if todo:
+        with Pool(processes=processes) as pool:
+            for path, res in progress(pool.imap_unordered(analyze_file, todo.keys(), chunksize=16)):
+                results[path] = res
+
+    if cache_file:
+        cache = {path: [todo[path] if path in todo else cache[path][0], res] for path, res in results.items()}
+        with open(cache_file + ".tmp", "wt") as f:
+            json.dump(cache, f)
+        os.replace(cache_file + ".tmp", cache_file)
+
+    return merge_results(results)
+
+
+def analyze_file(path):
+    # only reads the first two and the last line of the file, returns plain values that can be cached as JSON
+    res = {"participant": None, "header": None, "infos": None, "fw3i": False, "last": None, "warnings": []}
+    try:
+        m = re.search('Participant ([0-9]{2}b?)', path)
+        participant = m.group(1)
+        if participant == "10b":
+            participant = 11
+        else:
+            participant = int(participant)
+        if participant not in range(1, 12):
+            res["warnings"].append("Illegal participant {} from file {}".format(participant, path))
+        res["participant"] = participant
+
+        size = os.stat(path).st_size
+        with open(path, 'rb') as f:
+            first = f.readline().decode()
+            second = f.readline().decode()
+            last = None
+            if f.tell() < size:
+                offs = -4096
+                while True:
+                    f.seek(max(offs, -size), 2)
+                    lines = f.readlines()
+                    if len(lines) > 1:
+                        last = lines[-1].decode()
+                        break
+                    if -offs > size:
+                        break
+                    offs *= 2
+
+            if "Trip" in first:
+                res["warnings"].append("Skipping trip file {}".format(path))
+                return path, res
+            header = first.strip().split(",")
+            if header[0] != "Timestamp":
+                res["warnings"].append("Illegal header row in {}:1 '{}'".format(path, first.strip()))
+            res["header"] = header
+
+            infos = second.strip().split(",")
+            if len(infos) != 3 or len(infos[2]) != 0:
+                if infos[2] in FW3I_VALUES and FW3I_FOLDER in path:
+                    res["fw3i"] = True
+                else:
+                    res["warnings"].append("Invalid info in {}:2 '{}'".format(path, second.strip()))
+            res["infos"] = infos
+
+            if last:
+                res["last"] = int(last.split(",")[0])
+    except:
+        logging.error(__("In file {}", path))
+        raise
+    return path, res
+
+
+def merge_results(results):
     headers = Counter()
     ids = {}
     files_with_3_infos = []
 
-    for path in progress(SafeFileWalker(root)):
-        try:
-            m = re.search('Participant ([0-9]{2}b?)', path)
-            participant = m.group(1)
-            if participant == "10b":
-                participant = 11
-            else:
-                participant = int(participant)
-            if participant not in range(1, 12):
-                logger.warning(__("Illegal participant {} from file {}", participant, path))
-
-            size = os.stat(path).st_size
-            with open(path, 'rb') as f:
-                first = f.readline().decode()
-                second = f.readline().decode()
-                last = None
-                if f.tell() < size:
-                    offs = -100
-                    while True:
-                        f.seek(max(offs, -size), 2)
-                        lines = f.readlines()
-                        if len(lines) > 1:
-                            last = lines[-1].decode()
-                            break
-                        if -offs > size:
-                            break
-                        offs *= 2
-
-                if "Trip" in first:
-                    logger.warning(__("Skipping trip file {}", path))
-                    continue
-                header = first.strip().split(",")
-                if header[0] != "Timestamp":
-                    logger.warning(__("Illegal header row in {}:1 '{}'", path, first.strip()))
-                headers.update(header)
-
-                infos = second.strip().split(",")
-                if len(infos) != 3 or len(infos[2]) != 0:
-                    if infos[2] in FW3I_VALUES and FW3I_FOLDER in path:
-                        files_with_3_infos.append(path)
-                    else:
-                        logger.warning(__("Invalid info in {}:2 '{}'", path, second.strip()))
-                if infos[1] not in ids:
-                    ids[infos[1]] = {"min": datetime(year=2100, month=1, day=1),
-                                     "max": datetime(year=1900, month=1, day=1),
-                                     "participants": Counter(), "count": 0}
-                ids[infos[1]]["count"] += 1
-                ids[infos[1]]["participants"].update([participant])
-
-                if last:
-                    values = last.split(",")
-                    min_time = datetime.strptime(infos[0], "%m/%d/%Y %I:%M:%S %p")
-                    max_time = min_time + timedelta(milliseconds=int(values[0]))
-                    if ids[infos[1]]["min"] > min_time:
-                        ids[infos[1]]["min"] = min_time
-                        ids[infos[1]]["min_file"] = path
-                    if ids[infos[1]]["max"] < max_time:
-                        ids[infos[1]]["max"] = max_time
-                        ids[infos[1]]["max_file"] = path
-        except:
-            logging.error(__("In file {}", path))
-            raise
+    for path, res in sorted(results.items()):
+        for warning in res["warnings"]:
+            logger.warning(warning)
+        if not res["header"]:
+            continue
+        headers.update(res["header"])
+
+        infos = res["infos"]
+        if res["fw3i"]:
+            files_with_3_infos.append(path)
+        if infos[1] not in ids:
+            ids[infos[1]] = {"min": datetime(year=2100, month=1, day=1),
+                             "max": datetime(year=1900, month=1, day=1),
+                             "participants": Counter(), "count": 0}
+        ids[infos[1]]["count"] += 1
+        ids[infos[1]]["participants"].update([res["participant"]])
+
+        if res["last"] is not None:
+            min_time = parse_info_time(infos[0])
+            max_time = min_time + timedelta(milliseconds=res["last"])
+            if ids[infos[1]]["min"] > min_time:
+                ids[infos[1]]["min"] = min_time
+                ids[infos[1]]["min_file"] = path
+            if ids[infos[1]]["max"] < max_time:
+                ids[infos[1]]["max"] = max_time
+                ids[infos[1]]["max_file"] = path
 
     for k, v in ids.items():
         v["min"] = str(v["min"])
@@ -1,13 +1,17 @@
 import concurrent.futures
 import logging
 import os
-import signal
+import time
 from contextlib import ExitStack, closing
-from multiprocessing.managers import SyncManager
 
-from drive4data.data.charge import preprocess_cycles
-from drive4data.data.trips import preprocess_trips
-from iss4e.db.influxdb import InfluxDBStreamingClient as InfluxDBClient
+from drive4data.data.cache import SeriesCache
+from drive4data.data.charge import preprocess_cycles, CYCLE_FIELDS
+from drive4data.data.trips import preprocess_trips, TRIP_FIELDS
+from drive4data.data.watermarks import Watermarks
+from drive4data.db import connect, storage_cred, writer
+from drive4data.util import instrument, progress
+from drive4data.util.instrument import instrumentation
+from drive4data.util.progress import ProgressBoard
 from iss4e.util import BraceMessage as __
 from iss4e.util.config import load_config
 
@@ -17,35 +21,68 @@ logger = logging.getLogger(__name__)
 TIME_EPOCH = 'n'
 
 
-def mgr_init():
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    logger.debug(__("Initialized manager in process {}", os.getpid()))
+def init_worker(array, settings, write_settings):
+    progress.init_worker(array)
+    instrument.init_worker(settings)
+    writer.init_worker(write_settings)
+
+
+def fill_cache(client, executor, cache):
+    logger.info(__("Updating sample cache in {}", cache.root))
+    futures = [executor.submit(cache.update, client, sname, sselector)
+               for sname, sselector in client.list_series("samples")]
+    updated = sum(f.result() for f in futures)
+    logger.info(__("Updated the cache of {} out of {} series", updated, len(futures)))
 
 
 def main():
     config = load_config()
-    cred = config["drive4data.influx"]
+    cred = storage_cred(config)
     dry_run = bool(config.get("dry_run", False))
+    cache_dir = config.get("drive4data.preprocess.cache_dir", None)
+    single_pass = config.get("drive4data.preprocess.single_pass_cycles", False)
+    batch = config.get("drive4data.preprocess.batch", False)
+    chunk_size = config.get("drive4data.preprocess.chunk_size", None)
+    incremental = config.get("drive4data.preprocess.incremental", False)
+    if chunk_size and not (batch and cache_dir):
+        logger.warning("Splitting series into chunks requires batch mode and a cache_dir, processing whole series")
 
     os.makedirs("out", exist_ok=True)
     with ExitStack() as stack:
-        executor = concurrent.futures.ProcessPoolExecutor(max_workers=8)
+        # the workers report their progress through shared memory, see ProgressBoard
+        board = ProgressBoard()
+        start = time.time()
+        instrumentation.configure(config.get("drive4data.instrument.enabled", False),
+                                  config.get("drive4data.instrument.profile", False), "tmp/instrument-preprocess")
+        writer.configure(**config.get("drive4data.write", {}))
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=8, initializer=init_worker,
+            initargs=(board.array, instrumentation.settings(), writer.settings()))
         stack.enter_context(executor)
 
-        manager = SyncManager()
-        manager.start(mgr_init)
-        stack.enter_context(manager)
-
-        client = InfluxDBClient(batched=False, async_executor=True, time_epoch=TIME_EPOCH, **cred)
+        client = connect(cred, batched=False, async_executor=True, time_epoch=TIME_EPOCH)
         stack.enter_context(closing(client))
 
         try:
-            if not dry_run:
+            cache = None
+            if cache_dir:
+                cache = SeriesCache(cache_dir, list(dict.fromkeys(TRIP_FIELDS + CYCLE_FIELDS)))
+                fill_cache(client, executor, cache)
+
+            watermarks = None
+            if incremental:
+                watermarks = Watermarks("tmp/preprocess-watermarks.json").load()
+                logger.info(__("Incremental preprocessing with watermarks from {}", watermarks.file))
+
+            if not dry_run and not incremental:
                 client.drop_measurement("trips")
-            preprocess_trips(client, executor, manager, dry_run=dry_run)
-            if not dry_run:
+            preprocess_trips(client, executor, board, dry_run=dry_run, cache=cache, batch=batch,
+                             chunk_size=chunk_size, watermarks=watermarks)
+            if not dry_run and not incremental:
                 client.drop_measurement("charge_cycles")
-            preprocess_cycles(client, executor, manager, dry_run=dry_run)
+            preprocess_cycles(client, executor, board, dry_run=dry_run, cache=cache, single_pass=single_pass,
+                              batch=batch, chunk_size=chunk_size, watermarks=watermarks)
+            instrumentation.report("out/instrument-preprocess.json", time.time() - start)
         except:
             executor.shutdown(wait=False)
             raise
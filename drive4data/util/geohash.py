@@ -0,0 +1,59 @@
+import geohash
+import numpy as np
+
+__author__ = "Niko Fink"
+
+MAX_PRECISION = 12  # 60 bits, so that the interleaved code fits into an uint64
+BASE32 = np.frombuffer(b"0123456789bcdefghjkmnpqrstuvwxyz", dtype=np.uint8)
+
+
+def encode_many(lat, lon, valid, precision=12):
+    # geohash whole coordinate columns, but only encode a (lat, lon) pair once as long as it doesn't change,
+    # e.g. while the car is parked
+    hashes = np.full(len(lat), None, dtype=object)
+    idx = np.flatnonzero(valid)
+    if not len(idx):
+        return hashes
+    lat, lon = np.asarray(lat, dtype=float)[idx], np.asarray(lon, dtype=float)[idx]
+    changed = np.ones(len(idx), dtype=bool)
+    changed[1:] = (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])
+    encoded = encode_columns(lat[changed], lon[changed], precision)
+    hashes[idx] = encoded[np.cumsum(changed) - 1]
+    return hashes
+
+
+def encode_columns(lat, lon, precision=12):
+    # same as geohash.encode for each pair, but vectorized: quantize both coordinates to their number of bits and
+    # interleave them, starting with the longitude
+    if not 1 <= precision <= MAX_PRECISION:
+        raise ValueError("geohash precision must be between 1 and {}, not {}".format(MAX_PRECISION, precision))
+    if not (np.isfinite(lat) & np.isfinite(lon) & (lat >= -90) & (lat < 90)).all():
+        # let geohash.encode raise or warn about invalid coordinates as usual
+        return np.array([geohash.encode(a, o, precision) for a, o in zip(lat.tolist(), lon.tolist())], dtype=object)
+    lon = np.where((lon < -180) | (lon >= 180), (lon + 180) % 360 - 180, lon)
+
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    # with an odd number of bits, the longitude has one more, which is padded on the latitude and shifted out again
+    lat_i = quantize(lat, -90.0, 180.0, lat_bits) << np.uint64(lon_bits - lat_bits)
+    lon_i = quantize(lon, -180.0, 360.0, lon_bits)
+    code = ((spread_bits(lon_i) << np.uint64(1)) | spread_bits(lat_i)) >> np.uint64(2 * lon_bits - bits)
+
+    shifts = np.arange(5 * (precision - 1), -1, -5, dtype=np.uint64)
+    chars = BASE32[((code[:, None] >> shifts) & np.uint64(31)).astype(np.intp)]
+    return chars.view("S{}".format(precision)).ravel().astype(str).astype(object)
+
+
+def quantize(values, lower, span, bits):
+    # the index of the interval of size span / 2 ** bits that contains each value
+    index = np.floor((values - lower) / span * float(2 ** bits)).astype(np.uint64)
+    return np.minimum(index, np.uint64(2 ** bits - 1))
+
+
+def spread_bits(x):
+    # moves the lower 32 bits of each value to the even bit positions
+    x = x & np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
@@ -0,0 +1,246 @@
+import cProfile
+import functools
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from iss4e.util import BraceMessage as __
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+# latencies are counted in logarithmic buckets, 4 per doubling, so that the histograms of all workers can be merged
+BUCKETS_PER_DOUBLING = 4
+
+
+# Timers and counters of one stage, e.g. parsing or writing. Each timed call is counted as one batch and its latency
+# is recorded in the histogram, `counters` holds the number of rows, bytes etc. processed in that stage.
+class StageStats(object):
+    __slots__ = ('calls', 'seconds', 'counters', 'histogram')
+
+    def __init__(self, calls=0, seconds=0.0, counters=None, histogram=None):
+        self.calls = calls
+        self.seconds = seconds
+        self.counters = counters or {}
+        self.histogram = histogram or {}
+
+    def record(self, seconds, **counters):
+        self.calls += 1
+        self.seconds += seconds
+        bucket = math.floor(math.log2(max(seconds, 1e-9)) * BUCKETS_PER_DOUBLING)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        self.count(**counters)
+
+    def count(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def update(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.count(**other.counters)
+        for bucket, cnt in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + cnt
+        return self
+
+    def percentile(self, p):
+        # the upper bound of the bucket containing the p-th percentile
+        rank = p / 100 * sum(self.histogram.values())
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING)
+        return math.nan
+
+    def to_data(self):
+        return {'calls': self.calls, 'seconds': self.seconds, 'counters': dict(self.counters),
+                'histogram': {str(b): c for b, c in self.histogram.items()}}
+
+    @staticmethod
+    def from_data(data):
+        return StageStats(data['calls'], data['seconds'], data['counters'],
+                          {int(b): c for b, c in data['histogram'].items()})
+
+    def summary(self):
+        res = {'calls': self.calls, 'seconds': round(self.seconds, 6)}
+        res.update(self.counters)
+        for key, value in self.counters.items():
+            res[key + "_per_s"] = value / self.seconds if self.seconds else None
+        if self.calls:
+            res['latency_ms'] = {'mean': self.seconds / self.calls * 1000}
+            res['latency_ms'].update({"p{}".format(p): self.percentile(p) * 1000 for p in (50, 90, 99)})
+        return res
+
+
+class _NoTimer(object):
+    def add(self, **counters):
+        pass
+
+
+class _Timer(object):
+    __slots__ = ('counters',)
+
+    def __init__(self):
+        self.counters = {}
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+_NO_TIMER = _NoTimer()
+
+
+# Per-process instrumentation, which is a no-op unless enabled by configure or init_worker.
+# Each process collects the statistics of its stages and periodically saves them to its own file in `directory`,
+# from where report merges the statistics of all processes into a single JSON file. Stages may also be timed from
+# multiple threads, e.g. by the writer threads of the importers.
+class Instrumentation(object):
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.directory = None
+        self.stages = {}
+        self.profiler = None
+        self.lock = threading.Lock()
+
+    def settings(self):
+        # the settings to pass to init_worker of each worker process
+        return {'enabled': self.enabled, 'profile': self.profile, 'directory': self.directory}
+
+    def configure(self, enabled=False, profile=False, directory="tmp/instrument"):
+        self.enabled = bool(enabled)
+        self.profile = bool(enabled and profile)
+        self.directory = directory
+        self.stages = {}
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            for file in glob.glob(os.path.join(directory, "*")):
+                os.remove(file)
+            self.start_profiler()
+
+    def init_worker(self, settings):
+        self.enabled = settings['enabled']
+        self.profile = settings['profile']
+        self.directory = settings['directory']
+        self.stages = {}
+        self.start_profiler()
+
+    def start_profiler(self):
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def timer(self, stage, **counters):
+        # times the enclosed block, counters can be added to the yielded object once they are known
+        if not self.enabled:
+            yield _NO_TIMER
+            return
+        timer = _Timer()
+        timer.add(**counters)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stage(stage).record(seconds, **timer.counters)
+
+    def timed_iter(self, stage, iterable, counter="rows"):
+        # times fetching the items of an iterable, e.g. the decoding of a streamed query result
+        if not self.enabled:
+            return iterable
+        with self.lock:
+            stats = self.stage(stage)
+        return self._timed_iter(stats, iter(iterable), counter)
+
+    def _timed_iter(self, stats, iterator, counter):
+        seconds, count = 0.0, 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                count += 1
+                yield item
+        finally:
+            # the whole iteration is counted as a single call
+            with self.lock:
+                stats.record(seconds, **{counter: count})
+
+    def count(self, stage, **counters):
+        if self.enabled:
+            with self.lock:
+                self.stage(stage).count(**counters)
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return self.stages[name]
+
+    def flush(self):
+        # save the statistics (and profile) collected by this process so far, called at the end of each task
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        file = os.path.join(self.directory, "stats-{}.json".format(pid))
+        with self.lock:
+            data = {name: stats.to_data() for name, stats in self.stages.items()}
+        with open(file + ".tmp", "wt") as f:
+            json.dump(data, f)
+        os.replace(file + ".tmp", file)
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(self.directory, "profile-{}.prof".format(pid)))
+            self.profiler.enable()
+
+    def report(self, file, wall_time=None):
+        # merge the statistics of all processes and write them to `file`, returns the merged statistics
+        if not self.enabled:
+            return None
+        self.flush()
+        stages, processes = {}, 0
+        for path in glob.glob(os.path.join(self.directory, "stats-*.json")):
+            processes += 1
+            with open(path, "rt") as f:
+                for name, data in json.load(f).items():
+                    stats = StageStats.from_data(data)
+                    stages[name] = stages[name].update(stats) if name in stages else stats
+        report = {'processes': processes, 'wall_seconds': wall_time,
+                  'stages': {name: stats.summary() for name, stats in sorted(stages.items())}}
+        if self.profile:
+            report['profiles'] = sorted(glob.glob(os.path.join(self.directory, "profile-*.prof")))
+        with open(file, "wt") as f:
+            json.dump(report, f, sort_keys=True, indent=4, separators=(',', ': '))
+        logger.info(__("Instrumentation report of {} processes written to {}", processes, file))
+        return report
+
+
+instrumentation = Instrumentation()
+
+
+def init_worker(settings):
+    instrumentation.init_worker(settings)
+
+
+def flushing(func):
+    # save the statistics of the worker process after each call of the task `func`
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            instrumentation.flush()
+
+    return wrapper
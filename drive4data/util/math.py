@@ -0,0 +1,69 @@
+import numpy as np
+
+__author__ = "Niko Fink"
+
+
+def forward_fill(values, initial=np.nan):
+    # replace each NaN by the last valid value before it, or by `initial` if there is none
+    idx = np.where(np.isnan(values), -1, np.arange(len(values)))
+    idx = np.maximum.accumulate(idx) if len(idx) else idx
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], initial)
+
+
+class Smoother(object):
+    # array version of iss4e.util.math.smooth: s[n] = alpha * s[n-1] + (1 - alpha) * v[n], where missing (NaN)
+    # values keep the previous smoothed value. The last smoothed value is kept between calls, so that smoothing
+    # consecutive chunks gives the same result as smoothing the whole series at once.
+    def __init__(self, alpha=0.95, block_size=128):
+        self.alpha = alpha
+        self.block_size = block_size
+        self.last = None
+        # within a block, s[j] = alpha^(j+1) * s[-1] + (1 - alpha) * alpha^j * cumsum(alpha^-k * v[k])[j]
+        # the negative powers are bounded by the block size, so they can't overflow
+        k = np.arange(block_size)
+        self.pow = np.power(alpha, k)
+        self.inv_pow = np.power(alpha, -k)
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=float)
+        initial = np.nan if self.last is None else self.last
+        valid = np.flatnonzero(~np.isnan(values))
+        res = np.full(len(values), np.nan)
+        if len(valid):
+            v = values[valid]
+            smoothed = np.empty(len(v))
+            start = 0
+            if self.last is None:
+                smoothed[0] = self.last = v[0]
+                start = 1
+            for lo in range(start, len(v), self.block_size):
+                block = v[lo:lo + self.block_size]
+                n = len(block)
+                acc = np.cumsum(block * self.inv_pow[:n])
+                smoothed[lo:lo + n] = self.pow[:n] * (self.alpha * self.last + (1 - self.alpha) * acc)
+                self.last = float(smoothed[lo + n - 1])
+            res[valid] = smoothed
+        return forward_fill(res, initial)
+
+
+class Differentiator(object):
+    # array version of iss4e.util.math.differentiate: d[n] = (v[n] - v[n-1]) / ((t[n] - t[n-1]) / delta_time),
+    # which is 0 for the very first sample and samples without a time difference.
+    # The last sample is kept between calls, so that consecutive chunks can be processed separately.
+    def __init__(self, delta_time=1):
+        self.delta_time = delta_time
+        self.last_value = self.last_time = None
+
+    def __call__(self, values, times):
+        values = np.asarray(values, dtype=float)
+        times = np.asarray(times)
+        if not len(values):
+            return np.empty(0)
+        if self.last_time is None:
+            self.last_value, self.last_time = values[0], times[0]
+        prev_values = np.concatenate(([self.last_value], values[:-1]))
+        dt = np.diff(np.concatenate(([self.last_time], times))).astype(float) / self.delta_time
+        res = np.zeros(len(values))
+        np.divide(values - prev_values, dt, out=res, where=dt != 0)
+        self.last_value, self.last_time = values[-1], times[-1]
+        return res
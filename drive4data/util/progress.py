@@ -0,0 +1,120 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import resource
+import time
+from datetime import timedelta
+
+import numpy as np
+from iss4e.util import BraceMessage as __
+
+__author__ = "Niko Fink"
+logger = logging.getLogger(__name__)
+
+# the values of each slot, all int64
+FIELDS = ['samples', 'total', 'started', 'updated', 'rss']
+SAMPLES, TOTAL, STARTED, UPDATED, RSS = range(len(FIELDS))
+
+_worker_array = None
+
+
+def init_worker(array):
+    # initializer of the worker processes, shared memory can only be passed on when a process is started
+    global _worker_array
+    _worker_array = array
+
+
+# Progress of the tasks running on a process pool, stored in a shared memory array with one slot per task.
+# Each slot is only written by the task it was assigned to, so no locks or messages are needed and the workers only
+# write a few integers every couple of thousand samples. The executor must be created with
+# initializer=init_worker, initargs=(board.array,), so that the workers can access the array.
+class ProgressBoard(object):
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.array = multiprocessing.RawArray('q', capacity * len(FIELDS))
+        self.names = []
+
+    def __getstate__(self):
+        # the array is passed to the workers by init_worker
+        return {'capacity': self.capacity, 'array': None, 'names': []}
+
+    def values(self):
+        array = self.array if self.array is not None else _worker_array
+        return np.frombuffer(array, dtype=np.int64).reshape(self.capacity, len(FIELDS))
+
+    def add(self, name):
+        # returns a new TaskProgress for a task that is about to be submitted
+        if len(self.names) >= self.capacity:
+            return TaskProgress(self, None)
+        self.names.append(name)
+        return TaskProgress(self, len(self.names) - 1)
+
+    def wait(self, futures, tasks, delay=4):
+        # logs the progress of the tasks until all futures are done, `tasks` are the TaskProgress of the futures
+        start = time.time()
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=delay)
+            self.log(futures, tasks, len(futures) - len(pending), time.time() - start)
+        self.clear()
+
+    def clear(self):
+        # free all slots for the tasks of the next stage
+        self.values()[:] = 0
+        self.names = []
+
+    def log(self, futures, tasks, done_count, elapsed):
+        values = self.values()
+        running, samples, rss = [], 0, 0
+        for future, task in zip(futures, tasks):
+            if task.slot is None:
+                continue
+            row = values[task.slot]
+            samples += int(row[SAMPLES])
+            rss = max(rss, int(row[RSS]))
+            if row[STARTED] and not future.done():
+                task_rate = row[SAMPLES] / max((row[UPDATED] - row[STARTED]) / 1e9, 1e-3)
+                running.append(self.describe(task, row, task_rate))
+        # the ETA of the whole stage is estimated from the rate at which tasks complete
+        remaining = len(futures) - done_count
+        eta = timedelta(seconds=int(elapsed / done_count * remaining)) if done_count else "?"
+        logger.info(__("{}/{} tasks done, {} samples at {:.0f}/s, ETA {}, peak RSS {} MB{}",
+                       done_count, len(futures), samples, samples / max(elapsed, 1e-3), eta, rss // 1024,
+                       "".join("\n  " + r for r in running)))
+
+    def describe(self, task, row, rate):
+        text = "{}: {} samples".format(self.names[task.slot], row[SAMPLES])
+        if row[TOTAL]:
+            eta = timedelta(seconds=int((row[TOTAL] - row[SAMPLES]) / rate)) if rate else "?"
+            text += " of {} ({:.0%}), ETA {}".format(row[TOTAL], row[SAMPLES] / row[TOTAL], eta)
+        return text + " at {:.0f}/s, peak RSS {} MB".format(rate, row[RSS] // 1024)
+
+
+class TaskProgress(object):
+    def __init__(self, board, slot):
+        self.board = board
+        self.slot = slot
+
+    def update(self, samples=None, total=None):
+        if self.slot is None:
+            return
+        row = self.board.values()[self.slot]
+        now = time.time_ns()
+        if not row[STARTED]:
+            row[STARTED] = now
+        if samples is not None:
+            row[SAMPLES] = samples
+        if total is not None:
+            row[TOTAL] = total
+        row[RSS] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # in KB
+        row[UPDATED] = now
+
+    def track(self, iterable, total=None, every=4096):
+        # passes on the items of iterable and only writes their count to the board every `every` items
+        self.update(0, total)
+        count = 0
+        for count, item in enumerate(iterable, 1):
+            if count % every == 0:
+                self.update(count)
+            yield item
+        self.update(count)
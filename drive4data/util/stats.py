@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+
+__author__ = "Niko Fink"
+
+
+# Count, sum, mean, variance, min and max of a series of values, updated in O(1) time and memory per value.
+# Two instances can be merged exactly (using the pairwise update of Chan et al.), so statistics computed separately
+# for consecutive chunks, e.g. on different workers, can be combined into the statistics of the whole series.
+# None and non-finite values are ignored, the mean of no values is NaN.
+class RunningStats(object):
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'sum')
+
+    def __init__(self, count=0, mean=math.nan, m2=0.0, min=math.inf, max=-math.inf, sum=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2  # sum of squared differences from the mean
+        self.min = min
+        self.max = max
+        self.sum = sum
+
+    def add(self, value):
+        if value is None or not math.isfinite(value):
+            return self
+        value = float(value)
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+        else:
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum += value
+        return self
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values):
+            mean = values.mean()
+            self.update(RunningStats(len(values), float(mean), float(np.square(values - mean).sum()),
+                                     float(values.min()), float(values.max()), float(values.sum())))
+        return self
+
+    def update(self, other):
+        # merge the statistics of `other` into this instance
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max, self.sum = other.min, other.max, other.sum
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        return self
+
+    def merge(self, other):
+        return self.copy().update(other)
+
+    def copy(self):
+        return RunningStats(self.count, self.mean, self.m2, self.min, self.max, self.sum)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def __repr__(self):
+        return "RunningStats(count={}, mean={}, std={}, min={}, max={})".format(
+            self.count, self.mean, self.std, self.min, self.max)
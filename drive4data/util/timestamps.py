@@ -0,0 +1,143 @@
+import calendar
+import functools
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+__author__ = "Niko Fink"
+
+# the fixed formats of the Drive4Data files
+INFO_FORMAT = "%m/%d/%Y %I:%M:%S %p"  # info row of the sample files, e.g. 03/10/2014 11:17:44 AM
+SUMMARY_FORMAT = "%B %d, %Y %I:%M:%S %p"  # date of the trip summaries, e.g. March 10, 2014 11:17:44 AM
+DURATION_FORMAT = "%H:%M:%S"  # duration of the trip summaries, e.g. 00:23:05
+
+NS_PER_S = 10 ** 9
+NS_PER_MS = 10 ** 6
+# nanoseconds per unit of the client time epochs
+EPOCH_NS = {'h': 3600 * NS_PER_S, 'm': 60 * NS_PER_S, 's': NS_PER_S, 'ms': NS_PER_MS, 'u': 10 ** 3, 'n': 1}
+EPOCH = datetime(1970, 1, 1)
+MONTHS = {name.lower(): nr for nr, name in enumerate(calendar.month_name) if name}
+
+
+def clock_seconds(clock, ampm):
+    # seconds since midnight of a 12-hour clock time
+    h, m, s = (int(v) for v in clock.split(":"))
+    if not (1 <= h <= 12 and 0 <= m < 60 and 0 <= s < 60):
+        raise ValueError(clock)
+    ampm = ampm.upper()
+    if ampm == "AM":
+        h %= 12
+    elif ampm == "PM":
+        h = h % 12 + 12
+    else:
+        raise ValueError(ampm)
+    return h * 3600 + m * 60 + s
+
+
+def fallback(fmt):
+    # the specialized parsers are only used for input in the expected format, everything else is left to strptime,
+    # so that unusual but valid input is parsed and invalid input raises the same errors as before
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(value):
+            try:
+                return func(value)
+            except (ValueError, KeyError, IndexError):
+                return datetime.strptime(value, fmt)
+
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=65536)
+@fallback(INFO_FORMAT)
+def parse_info_time(value):
+    date, clock, ampm = value.split(" ")
+    month, day, year = date.split("/")
+    return datetime(int(year), int(month), int(day)) + timedelta(seconds=clock_seconds(clock, ampm))
+
+
+@functools.lru_cache(maxsize=65536)
+@fallback(SUMMARY_FORMAT)
+def parse_summary_time(value):
+    month, day, year, clock, ampm = value.split(" ")
+    if not day.endswith(","):
+        raise ValueError(value)
+    return datetime(int(year), MONTHS[month.lower()], int(day[:-1])) + timedelta(seconds=clock_seconds(clock, ampm))
+
+
+def parse_duration(value):
+    # the duration in seconds
+    try:
+        h, m, s = value.split(":")
+        h, m, s = int(h), int(m), int(s)
+        if 0 <= h < 24 and 0 <= m < 60 and 0 <= s < 60:
+            return float(h * 3600 + m * 60 + s)
+    except ValueError:
+        pass
+    t = datetime.strptime(value, DURATION_FORMAT)
+    return float(t.hour * 3600 + t.minute * 60 + t.second)
+
+
+def to_epoch_ns(dt):
+    # naive datetimes are in UTC
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.utc).replace(tzinfo=None)
+    return ((dt - EPOCH) // timedelta(microseconds=1)) * 1000
+
+
+def to_epoch_units(duration, epoch='n'):
+    # a timedelta or a number of seconds as integer number of epoch units, i.e. as difference of two sample times
+    if not isinstance(duration, timedelta):
+        duration = timedelta(seconds=duration)
+    return (duration // timedelta(microseconds=1)) * 1000 // EPOCH_NS[epoch]
+
+
+def from_epoch_ns(ns, tz=None):
+    # a naive UTC datetime, or an aware one in `tz`
+    dt = EPOCH + timedelta(microseconds=int(ns) // 1000)
+    return pytz.utc.localize(dt).astimezone(tz) if tz else dt
+
+
+# A pytz timezone with its UTC offsets precomputed as a table of transitions, so that local times can be converted
+# to UTC with a binary search, also for whole arrays at once. Like pytz's localize(is_dst=None), times that are
+# ambiguous or don't exist due to DST changes raise an AmbiguousTimeError or NonExistentTimeError.
+class LocalTimezone(object):
+    def __init__(self, name):
+        self.name = name
+        self.tz = pytz.timezone(name)
+        if hasattr(self.tz, '_utc_transition_times'):
+            starts = [calendar.timegm(t.timetuple()) for t in self.tz._utc_transition_times]
+            offsets = [int(info[0].total_seconds()) for info in self.tz._transition_info]
+        else:
+            starts, offsets = [-2 ** 62 // NS_PER_S], [int(self.tz.utcoffset(EPOCH).total_seconds())]
+        starts[0] = -2 ** 62 // NS_PER_S  # the first offset is valid since forever
+        self.offsets = np.array(offsets, dtype=np.int64) * NS_PER_S
+        utc_starts = np.array(starts, dtype=np.int64) * NS_PER_S
+        utc_ends = np.append(utc_starts[1:], 2 ** 62)
+        # the range of local times of each offset, the ranges overlap for ambiguous times and have gaps for
+        # non-existent times
+        self.local_starts = utc_starts + self.offsets
+        self.local_ends = utc_ends + self.offsets
+
+    def localize_many(self, local_ns):
+        # converts an array of local times in epoch nanoseconds to UTC
+        local_ns = np.asarray(local_ns, dtype=np.int64)
+        idx = np.searchsorted(self.local_starts, local_ns, side='right') - 1
+        valid = local_ns < self.local_ends[idx]
+        ambiguous = valid & (idx > 0) & (local_ns < self.local_ends[np.maximum(idx - 1, 0)])
+        if not valid.all():
+            raise pytz.NonExistentTimeError(from_epoch_ns(local_ns[~valid][0]))
+        if ambiguous.any():
+            raise pytz.AmbiguousTimeError(from_epoch_ns(local_ns[ambiguous][0]))
+        return local_ns - self.offsets[idx]
+
+    def localize_ns(self, local_ns):
+        return int(self.localize_many([local_ns])[0])
+
+
+@functools.lru_cache(maxsize=None)
+def timezone(name):
+    return LocalTimezone(name)
@@ -25,6 +25,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         'python-geohash>=0.8.5',
+        'numpy',
         'webike',
         'iss4e-toolchain'
     ],
@@ -0,0 +1,46 @@
+import contextlib
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from drive4data.data.cache import SeriesCache
+from drive4data.db import connect
+
+__author__ = "Niko Fink"
+
+
+class SeriesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.client = connect({'backend': "sqlite", 'path': os.path.join(self.dir.name, "db.sqlite")})
+        self.cache = SeriesCache(os.path.join(self.dir.name, "cache"), ["hvbatt_soc"])
+        self.write(range(10))
+
+    def tearDown(self):
+        self.client.close()
+        self.dir.cleanup()
+
+    def write(self, times, participant="1"):
+        self.client.write_points([{'measurement': "samples", 'tags': {'participant': participant}, 'time': t,
+                                   'fields': {'source': 1, 'hvbatt_soc': float(t)}} for t in times])
+
+    def test_fill(self):
+        self.assertTrue(self.cache.update(self.client, "samples,participant=1", "participant='1'"))
+        columns = self.cache.columns("samples,participant=1", ["time", "hvbatt_soc"])
+        np.testing.assert_array_equal(columns['time'], np.arange(10))
+        np.testing.assert_array_equal(columns['hvbatt_soc'], np.arange(10, dtype=float))
+
+    def test_valid_until_new_samples(self):
+        self.cache.update(self.client, "samples,participant=1", "participant='1'")
+        self.assertTrue(self.cache.is_valid(self.client, "samples,participant=1", "participant='1'"))
+        self.assertFalse(self.cache.update(self.client, "samples,participant=1", "participant='1'"))
+
+        self.write([20], participant="2")
+        self.assertTrue(self.cache.is_valid(self.client, "samples,participant=1", "participant='1'"))
+        self.write([20])
+        self.assertFalse(self.cache.is_valid(self.client, "samples,participant=1", "participant='1'"))
+
+
+if __name__ == '__main__':
+    unittest.main()
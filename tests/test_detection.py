@@ -0,0 +1,116 @@
+import math
+import unittest
+
+import numpy as np
+from drive4data.bench.synthetic import generate_samples
+from drive4data.data import charge, trips
+from drive4data.data.activity import BatchDetectionMixin, split_ranges
+from drive4data.data.charge import detect_columns_filtered
+
+__author__ = "Niko Fink"
+
+GAP = 3 * 3600 * 10 ** 9  # longer than max_delay, max_gap and all merge gaps
+
+
+def samples_with_gaps(rows=20000, seed=0):
+    columns = generate_samples(1, rows, seed)
+    # the simulation only sets ischarging to 1, while ChargeCycleIsChargingDetection expects values above 3
+    columns['ischarging'] = columns['ischarging'] * 5
+    # cut some charging sessions and trips by a gap between two of their samples
+    charging = np.flatnonzero((columns['charger_acvoltage'] > 0) & (columns['veh_speed'] <= 0))
+    driving = np.flatnonzero(columns['veh_speed'] > 0)
+    cuts = [idx[len(idx) * i // 4] for idx in [charging, driving] if len(idx) for i in range(1, 4)]
+    shift = np.zeros(len(columns['time']), dtype=np.int64)
+    for idx in cuts:
+        shift[idx:] += GAP
+    columns['time'] = columns['time'] + shift
+    return columns
+
+
+def detectors():
+    # the mask and the serial detector class of each detector that has a batch version
+    res = [(trips.trip_where, trips.TripDetection, trips.BatchTripDetection)]
+    for attr, where, mask, detector_cls in charge.CYCLE_DETECTORS:
+        if detector_cls in charge.BATCH_DETECTORS:
+            res.append((mask, detector_cls, charge.BATCH_DETECTORS[detector_cls]))
+    return res
+
+
+def events(detector, cycles):
+    # the events of all accepted and discarded cycles, ordered by time
+    cycles, cycles_disc = cycles
+    return sorted(detector.cycles_to_timeseries(cycles + cycles_disc, "cycles"), key=lambda e: e['time'])
+
+
+class DetectionTestCase(unittest.TestCase):
+    def assertSameEvents(self, events, expected):
+        self.assertEqual([(e['time'], e['tags']) for e in events], [(e['time'], e['tags']) for e in expected])
+        for event, exp in zip(events, expected):
+            self.assertEqual(event['fields'].keys(), exp['fields'].keys())
+            for key, value in exp['fields'].items():
+                if isinstance(value, float):
+                    self.assertTrue(math.isclose(event['fields'][key], value, rel_tol=1e-9, abs_tol=1e-9),
+                                    "{} of {}: {} != {}".format(key, event['time'], event['fields'][key], value))
+                else:
+                    self.assertEqual(event['fields'][key], value)
+
+
+class BatchDetectionTest(DetectionTestCase):
+    def test_same_cycles(self):
+        columns = samples_with_gaps()
+        for mask, detector_cls, batch_cls in detectors():
+            with self.subTest(detector=detector_cls.__name__):
+                serial, batch = detector_cls(time_epoch='n'), batch_cls(time_epoch='n')
+                expected = detect_columns_filtered(mask, serial, columns)
+                cycles = detect_columns_filtered(mask, batch, columns)
+                self.assertTrue(expected[0] + expected[1], "no cycles detected")
+                self.assertSameEvents(events(batch, cycles), events(serial, expected))
+
+    def test_empty(self):
+        columns = {f: col[:0] if isinstance(col, np.ndarray) else col for f, col in generate_samples(1, 10).items()}
+        for mask, detector_cls, batch_cls in detectors():
+            self.assertEqual(batch_cls(time_epoch='n').detect_columns(columns), ([], []))
+
+    def test_missing_mask(self):
+        class Detection(BatchDetectionMixin, trips.TripDetection):
+            def start_mask(self, columns):
+                return columns['veh_speed'] > 0
+
+        with self.assertRaises(TypeError):
+            Detection(time_epoch='n')
+
+
+class SplitColumnsTest(DetectionTestCase):
+    def test_same_cycles(self):
+        columns = samples_with_gaps()
+        for mask, detector_cls, batch_cls in detectors():
+            with self.subTest(detector=detector_cls.__name__):
+                selected = mask(columns)
+                masked = {f: col[selected] if isinstance(col, np.ndarray) else col for f, col in columns.items()}
+                detector = batch_cls(time_epoch='n')
+                expected = events(detector, detector.detect_columns(masked))
+
+                detector = batch_cls(time_epoch='n')
+                chunks = list(detector.split_columns(masked, 500))
+                self.assertGreater(len(chunks), 2)
+                # the gaps cut some cycles, so a cycle is still running at the end of some chunks
+                bounds = np.cumsum([len(chunk['time']) for chunk, starts, ends in chunks])[:-1] - 1
+                prep = batch_cls(time_epoch='n')
+                prepared = prep.prepare_columns(dict(masked))
+                self.assertTrue(any(prep.cycle_states(prep.start_mask(prepared), prep.end_mask(prepared),
+                                                      bounds.tolist())))
+                chunk_events = []
+                for chunk in chunks:
+                    detector = batch_cls(time_epoch='n')
+                    chunk_events += events(detector, detector.detect_prepared(*chunk))
+                self.assertSameEvents(sorted(chunk_events, key=lambda e: e['time']), expected)
+
+    def test_split_ranges(self):
+        gaps = np.array([0, 1, 5, 1, 1, 5, 5, 1, 1, 1, 5, 1])
+        self.assertEqual(split_ranges(gaps, 2, 3), [(0, 5), (5, 10), (10, 12)])
+        self.assertEqual(split_ranges(gaps, 2, 1), [(0, 2), (2, 5), (5, 6), (6, 10), (10, 12)])
+        self.assertEqual(split_ranges(gaps, 10, 1), [(0, 12)])
+
+
+if __name__ == '__main__':
+    unittest.main()
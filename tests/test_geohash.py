@@ -0,0 +1,44 @@
+import unittest
+
+import geohash
+import numpy as np
+from drive4data.util.geohash import encode_columns, encode_many
+
+__author__ = "Niko Fink"
+
+
+class GeohashTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.lat = np.concatenate([rng.uniform(-90, 90, 2000), [-90, 0, 89.999999999, 43.4723, 43.4723]])
+        self.lon = np.concatenate([rng.uniform(-180, 180, 2000), [-180, 0, 179.999999999, -80.5449, -80.5449]])
+
+    def test_encode_columns(self):
+        for precision in range(1, 13):
+            with self.subTest(precision=precision):
+                expected = [geohash.encode(a, o, precision) for a, o in zip(self.lat.tolist(), self.lon.tolist())]
+                self.assertEqual(encode_columns(self.lat, self.lon, precision).tolist(), expected)
+
+    def test_wrapped_longitude(self):
+        lat, lon = np.array([10.0, 10.0, 10.0]), np.array([180.0, 190.5, -200.25])
+        expected = [geohash.encode(a, o, 12) for a, o in zip(lat.tolist(), lon.tolist())]
+        self.assertEqual(encode_columns(lat, lon).tolist(), expected)
+
+    def test_encode_many(self):
+        # parked for a while, with gaps in the GPS fix
+        lat = np.repeat(self.lat[:100], 5)
+        lon = np.repeat(self.lon[:100], 5)
+        valid = np.ones(len(lat), dtype=bool)
+        valid[::7] = False
+        hashes = encode_many(lat, lon, valid, 9).tolist()
+        expected = [geohash.encode(a, o, 9) if v else None for a, o, v in zip(lat.tolist(), lon.tolist(), valid)]
+        self.assertEqual(hashes, expected)
+        self.assertEqual(encode_many(lat, lon, np.zeros(len(lat), dtype=bool)).tolist(), [None] * len(lat))
+
+    def test_invalid_precision(self):
+        with self.assertRaises(ValueError):
+            encode_columns(self.lat, self.lon, 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
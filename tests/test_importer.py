@@ -0,0 +1,186 @@
+import contextlib
+import csv
+import glob
+import json
+import os
+import tempfile
+import unittest
+
+from drive4data.bench.synthetic import write_dataset
+from drive4data.db import connect
+from drive4data.initialization.importer import SamplesImporter
+from drive4data.util.timestamps import NS_PER_S
+
+__author__ = "Niko Fink"
+
+
+def points(ino, times, participant="1"):
+    return [{'measurement': "samples", 'tags': {'participant': participant}, 'time': int(t * NS_PER_S),
+             'fields': {'source': ino, 'hvbatt_soc': 50.0}} for t in times]
+
+
+def range_entry(ino, times, participant="1"):
+    return {'ino': ino, 'participant': participant, 'first': min(times) * NS_PER_S, 'last': max(times) * NS_PER_S}
+
+
+class DeleteSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cred = {'backend': "sqlite", 'path': os.path.join(self.dir.name, "db.sqlite")}
+        self.importer = SamplesImporter(self.cred, "samples")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, points):
+        with contextlib.closing(connect(self.cred)) as client:
+            client.write_points(points, time_precision='n')
+
+    def sources(self):
+        with contextlib.closing(connect(self.cred)) as client:
+            return sorted((row['source'], row['time'] // NS_PER_S)
+                          for row in client.stream_params("samples", fields="time, source"))
+
+    def test_overlapping_files(self):
+        # file B was recorded while A was still open, so their time ranges overlap
+        self.write(points(1, range(0, 101, 10)))
+        self.write(points(2, range(41, 57, 5)))
+        self.importer.delete_source("A.csv", range_entry(1, range(0, 101, 10)))
+        self.assertEqual(self.sources(), [(2, 41), (2, 46), (2, 51), (2, 56)])
+
+    def test_interleaved_files(self):
+        self.write(points(1, range(0, 100, 2)))
+        self.write(points(2, range(1, 100, 2)))
+        self.importer.delete_source("A.csv", range_entry(1, range(0, 100, 2)))
+        self.assertEqual(self.sources(), [(2, t) for t in range(1, 100, 2)])
+
+    def test_other_participants(self):
+        self.write(points(1, range(0, 101, 10)))
+        self.write(points(3, range(0, 101, 10), participant="2"))
+        self.importer.delete_source("A.csv", range_entry(1, range(0, 101, 10)))
+        self.assertEqual(self.sources(), [(3, t) for t in range(0, 101, 10)])
+
+    def test_empty_file(self):
+        self.write(points(2, range(0, 10)))
+        self.importer.delete_source("A.csv", {'ino': 1, 'participant': "1", 'first': None, 'last': None})
+        self.assertEqual(self.sources(), [(2, t) for t in range(0, 10)])
+
+    def test_runs(self):
+        self.write(points(1, range(0, 2500)))
+        self.write(points(2, [1000.5, 2000.5]))
+        with contextlib.closing(connect(self.cred, time_epoch='n')) as client:
+            runs = self.importer.source_runs(client, "1", 0, 2499 * NS_PER_S, 1)
+        self.assertEqual(runs, [(0, 1000 * NS_PER_S), (1001 * NS_PER_S, 2000 * NS_PER_S),
+                                (2001 * NS_PER_S, 2499 * NS_PER_S)])
+
+    def test_manifest_without_ranges(self):
+        self.write(points(1, range(0, 101, 10)))
+        self.write(points(2, range(41, 57, 5)))
+        self.importer.delete_source("A.csv", {'ino': 1})
+        self.assertEqual(self.sources(), [(2, 41), (2, 46), (2, 51), (2, 56)])
+
+
+class IncrementalImportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        write_dataset(self.dir.name, participants=1, rows=3000)
+        self.root = os.path.join(self.dir.name, "Participants")
+        self.files = sorted(glob.glob(os.path.join(self.root, "*", "*.csv")))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def do_import(self, name, incremental):
+        tmp = os.path.join(self.dir.name, name)
+        os.makedirs(tmp, exist_ok=True)
+        cred = {'backend': "sqlite", 'path': os.path.join(tmp, "db.sqlite")}
+        SamplesImporter(cred, "samples", processes=1, batch_size=500, incremental=incremental,
+                        checkpoint_file=os.path.join(tmp, "checkpoint{}.journal"),
+                        plan_file=os.path.join(tmp, "plan.json"),
+                        manifest_file=os.path.join(tmp, "manifest.json")).do_import(self.root)
+        with contextlib.closing(connect(cred, time_epoch='n')) as client:
+            return sorted((row['time'], row['source'])
+                          for row in client.stream_params("samples", fields="time, source"))
+
+    def test_changed_overlapping_file(self):
+        self.do_import("incremental", True)
+        with open(os.path.join(self.dir.name, "incremental", "manifest.json"), "rt") as f:
+            entry = json.load(f)[self.files[0]]
+        self.assertEqual(entry['participant'], 1)
+        self.assertLess(entry['first'], entry['last'])
+
+        # a file whose samples lie in between the samples of the first file
+        with open(self.files[0], "rt", newline='') as f:
+            rows = list(csv.reader(f))
+        with open(self.files[0][:-4] + "-overlap.csv", "wt", newline='') as f:
+            csv.writer(f).writerows(rows[:2] + [[int(r[0]) + 1] + r[1:] for r in rows[10:20]])
+        self.do_import("incremental", True)
+
+        # the first file shrinks, so its old points at the end must be deleted
+        os.remove(self.files[0])
+        with open(self.files[0], "wt", newline='') as f:
+            csv.writer(f).writerows(rows[:len(rows) // 2])
+        self.assertEqual(self.do_import("incremental", True), self.do_import("cold", False))
+
+    def test_old_checkpoints(self):
+        tmp = os.path.join(self.dir.name, "old")
+        os.makedirs(tmp)
+        open(os.path.join(tmp, "checkpoint0.pickle"), "wb").close()
+        with self.assertLogs("drive4data.initialization.importer", "WARNING") as logs:
+            self.assertEqual(self.do_import("old", False), self.do_import("cold", False))
+        self.assertIn("checkpoint0.pickle", logs.output[0])
+
+
+class ListWriter(object):
+    def __init__(self):
+        self.points = []
+
+    def write(self, points):
+        self.points.extend(points)
+
+    def then(self, callback):
+        callback()
+
+
+class ColumnarParseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "Participant 01")
+        os.makedirs(path)
+        self.file = os.path.join(path, "samples.csv")
+        with open(self.file, "wt", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Timestamp", "Veh_Speed[km/h]", "Hvbatt_Soc[%]", "Gps_Lat_Deg[deg]", "Gps_Lon_Deg[deg]",
+                             "Unknown[]", "Fuel_Rate[l/h]"])
+            writer.writerow(["03/10/2014 11:17:44 AM", "SYN01000000000000", ""])
+            writer.writerows([
+                [0, 0.0, 90.0, 43.4723, -80.5449, 1, 0.5],
+                [1000, 12.5, 89.9, 43.4723, -80.5449, 1, "nan"],  # same position
+                [2000, 13.5, "nan", 43.4731, -80.5449, 1, "inf"],
+                [3000, 14.5, 89.7, 0, 0, 1, 0.5],  # no GPS fix
+                [4000, 15.5, 89.6, "nan", -80.5449, 1, 0.5],
+                [5000, 16.5, 89.5, -90, 180],  # shorter row
+            ])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def parse(self, **kwargs):
+        writer = ListWriter()
+        importer = SamplesImporter({'backend': "sqlite", 'path': ""}, "samples", **kwargs)
+        rows = importer.parse_file(writer, self.file)
+        self.assertEqual(rows, 6)
+        return writer.points
+
+    def test_same_points(self):
+        expected = self.parse()
+        self.assertEqual(expected[1]['fields']['gps_geohash'], expected[0]['fields']['gps_geohash'])
+        self.assertNotIn('gps_geohash', expected[3]['fields'])
+        self.assertNotIn('fuel_rate', expected[2]['fields'])
+        for batch_size in [None, 1, 4]:
+            with self.subTest(batch_size=batch_size):
+                self.assertEqual(self.parse(columnar=True, batch_size=batch_size), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
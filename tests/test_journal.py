@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from drive4data.initialization.journal import CheckpointJournal
+
+__author__ = "Niko Fink"
+
+
+class CheckpointJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "checkpoint0.journal")
+        self.files = {}
+        for name in ["a.csv", "b.csv", "c.csv", "d.csv"]:
+            path = os.path.join(self.dir.name, name)
+            with open(path, "wt") as f:
+                f.write(name)
+            self.files[name] = (path, os.stat(path))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reload(self):
+        with CheckpointJournal(self.file).load() as journal:
+            journal.mark_offset(*self.files["a.csv"], 10, {'counts': 1})
+            journal.mark_done(*self.files["a.csv"], 20, {'counts': 2})
+            journal.mark_offset(*self.files["b.csv"], 5)
+
+        journal = CheckpointJournal(self.file).load()
+        self.assertTrue(journal.is_done(*self.files["a.csv"]))
+        self.assertEqual(journal.offset(*self.files["b.csv"]), (5, None))
+        self.assertEqual(journal.offset(*self.files["c.csv"]), (0, None))
+        self.assertEqual(journal.extras(), {self.files["a.csv"][0]: {'counts': 2}})
+
+    def test_changed_file(self):
+        with CheckpointJournal(self.file).load() as journal:
+            journal.mark_offset(*self.files["a.csv"], 10)
+        path, stat = self.files["a.csv"]
+        with open(path, "at") as f:
+            f.write("more rows")
+        journal = CheckpointJournal(self.file).load()
+        self.assertEqual(journal.offset(path, os.stat(path)), (0, None))
+
+    def test_torn_last_line(self):
+        with CheckpointJournal(self.file).load() as journal:
+            journal.mark_done(*self.files["a.csv"], 20, {'counts': 1})
+            journal.mark_offset(*self.files["b.csv"], 5)
+        # crash while writing the entry of the next file
+        with open(self.file, "rb+") as f:
+            f.seek(-10, os.SEEK_END)
+            f.truncate()
+        with open(self.file, "rb") as f:
+            complete = f.read().rsplit(b"\n", 1)[0] + b"\n"
+
+        with CheckpointJournal(self.file).load() as journal:
+            with open(self.file, "rb") as f:
+                self.assertEqual(f.read(), complete)
+            self.assertTrue(journal.is_done(*self.files["a.csv"]))
+            self.assertEqual(journal.offset(*self.files["b.csv"]), (0, None))
+            journal.mark_done(*self.files["c.csv"], 30, {'counts': 3})
+            journal.mark_offset(*self.files["d.csv"], 7, {'counts': 4})
+
+        journal = CheckpointJournal(self.file).load()
+        self.assertEqual(sorted(os.path.basename(path) for path in journal.entries), ["a.csv", "c.csv", "d.csv"])
+        self.assertTrue(journal.is_done(*self.files["a.csv"]))
+        self.assertTrue(journal.is_done(*self.files["c.csv"]))
+        self.assertEqual(journal.offset(*self.files["d.csv"]), (7, {'counts': 4}))
+        self.assertEqual(journal.extras(), {self.files["a.csv"][0]: {'counts': 1},
+                                            self.files["c.csv"][0]: {'counts': 3},
+                                            self.files["d.csv"][0]: {'counts': 4}})
+
+    def test_truncate(self):
+        with CheckpointJournal(self.file).load() as journal:
+            journal.mark_done(*self.files["a.csv"], 20)
+            journal.truncate()
+        self.assertEqual(os.path.getsize(self.file), 0)
+        self.assertEqual(CheckpointJournal(self.file).load().entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
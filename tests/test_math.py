@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+from drive4data.util.math import Differentiator, Smoother, forward_fill
+from iss4e.util.math import differentiate, smooth
+
+__author__ = "Niko Fink"
+
+
+def soc_series(count=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    times = np.cumsum(rng.choice([0, 10 ** 9, 10 * 10 ** 9, 3600 * 10 ** 9], count, p=[0.05, 0.8, 0.1, 0.05]))
+    soc = np.clip(50 + np.cumsum(rng.normal(0, 0.5, count)), 0, 100)
+    return times.astype(np.int64), soc
+
+
+def reference(times, values, alpha=0.95, delta_time=1):
+    samples = [{'time': t, 'soc': None if np.isnan(v) else v} for t, v in zip(times.tolist(), values.tolist())]
+    samples = list(smooth(samples, 'soc', 'soc_smooth', alpha=alpha))
+    smoothed = np.array([np.nan if s['soc_smooth'] is None else s['soc_smooth'] for s in samples])
+    if np.isnan(smoothed).any():
+        return smoothed, None
+    samples = differentiate(samples, 'soc_smooth', 'soc_diff', attr_time='time', delta_time=delta_time)
+    return smoothed, np.array([s['soc_diff'] for s in samples])
+
+
+class MathTest(unittest.TestCase):
+    def test_smoother(self):
+        times, soc = soc_series()
+        soc[[0, 1, 10, 11, 12, 500]] = np.nan
+        expected, _ = reference(times, soc)
+        np.testing.assert_allclose(Smoother(alpha=0.95)(soc), expected, rtol=1e-9)
+
+    def test_smoother_chunks(self):
+        times, soc = soc_series()
+        soc[[100, 200, 201]] = np.nan
+        expected, _ = reference(times, soc)
+        smoother = Smoother(alpha=0.95, block_size=16)
+        res = np.concatenate([smoother(soc[lo:lo + 77]) for lo in range(0, len(soc), 77)])
+        np.testing.assert_allclose(res, expected, rtol=1e-9)
+
+    def test_differentiator(self):
+        times, soc = soc_series()
+        expected_smooth, expected = reference(times, soc, delta_time=3600 * 10 ** 9)
+        differentiator = Differentiator(delta_time=3600 * 10 ** 9)
+        res = np.concatenate([differentiator(expected_smooth[lo:lo + 77], times[lo:lo + 77])
+                              for lo in range(0, len(soc), 77)])
+        np.testing.assert_allclose(res, expected, rtol=1e-9, atol=1e-12)
+
+    def test_forward_fill(self):
+        values = np.array([np.nan, 1, np.nan, np.nan, 2, np.nan])
+        np.testing.assert_array_equal(forward_fill(values, 0), [0, 1, 1, 1, 2, 2])
+        np.testing.assert_array_equal(forward_fill(np.empty(0)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
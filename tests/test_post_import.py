@@ -0,0 +1,58 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from drive4data.initialization import post_import
+from drive4data.initialization.post_import import SampleCounts
+
+__author__ = "Niko Fink"
+
+
+def points(times, soc):
+    return [{'measurement': "samples", 'tags': {'participant': "1"}, 'time': t * 10 ** 9,
+             'fields': {'source': 1, 'hvbatt_soc': s}} for t, s in zip(times, soc)]
+
+
+class AnalyzeTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        os.makedirs("tmp")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def counts(self, times):
+        counts = SampleCounts()
+        counts.update_points(points(times, [50.0] * len(times)))
+        return {'participant=1': counts.to_data()}
+
+    def test_import_counts_before_saved_analysis(self):
+        with open(post_import.SAVE_FILE, "wb") as f:
+            pickle.dump(self.counts(range(10)), f)
+        with open("tmp/import-counts.pickle", "wb") as f:
+            pickle.dump(self.counts(range(20)), f)
+        rows = list(post_import.analyze(None, import_counts="tmp/import-counts.pickle"))
+        self.assertEqual([row['count_hvbatt_soc'] for row in rows], [20])
+
+        rows = list(post_import.analyze(None))
+        self.assertEqual([row['count_hvbatt_soc'] for row in rows], [10])
+
+
+class SampleCountsTest(unittest.TestCase):
+    def test_merge(self):
+        times, soc = list(range(100)), [float(s) for s in range(0, 200, 2)]
+        single = SampleCounts()
+        single.update_points(points(times, soc))
+        first, second = SampleCounts(), SampleCounts()
+        first.update_points(points(times[:30], soc[:30]))
+        second.update_points(points(times[30:], soc[30:]))
+        merged = SampleCounts.load(first.dump()).merge(second)
+        self.assertEqual(merged.to_data(), single.to_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
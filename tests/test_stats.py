@@ -0,0 +1,53 @@
+import math
+import unittest
+
+import numpy as np
+from drive4data.util.stats import RunningStats
+
+__author__ = "Niko Fink"
+
+
+class RunningStatsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.values = rng.normal(1000, 5, 1000).tolist()
+        self.values[10:13] = [None, math.nan, math.inf]
+
+    def assertSameStats(self, stats, expected):
+        self.assertEqual(stats.count, expected.count)
+        self.assertEqual((stats.min, stats.max), (expected.min, expected.max))
+        for attr in ['mean', 'variance', 'sum']:
+            self.assertTrue(math.isclose(getattr(stats, attr), getattr(expected, attr), rel_tol=1e-9), attr)
+
+    def test_single_pass(self):
+        stats = RunningStats()
+        for value in self.values:
+            stats.add(value)
+        valid = np.array([v for v in self.values if v is not None and math.isfinite(v)])
+        self.assertEqual(stats.count, len(valid))
+        self.assertTrue(math.isclose(stats.mean, valid.mean(), rel_tol=1e-12))
+        self.assertTrue(math.isclose(stats.variance, valid.var(), rel_tol=1e-9))
+        self.assertEqual((stats.min, stats.max), (valid.min(), valid.max()))
+
+    def test_merge(self):
+        expected = RunningStats()
+        for value in self.values:
+            expected.add(value)
+        for split in [0, 1, 11, 500, 999, 1000]:
+            first, second = RunningStats(), RunningStats()
+            for value in self.values[:split]:
+                first.add(value)
+            second.add_many([math.nan if v is None else v for v in self.values[split:]])
+            merged = first.merge(second)
+            self.assertSameStats(merged, expected)
+            self.assertEqual(first.count, len([v for v in self.values[:split] if v is not None and math.isfinite(v)]))
+
+    def test_empty(self):
+        stats = RunningStats().merge(RunningStats())
+        self.assertEqual(stats.count, 0)
+        self.assertTrue(math.isnan(stats.mean))
+        self.assertTrue(math.isnan(stats.variance))
+
+
+if __name__ == '__main__':
+    unittest.main()
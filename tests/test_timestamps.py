@@ -0,0 +1,74 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+from drive4data.util.timestamps import DURATION_FORMAT, INFO_FORMAT, SUMMARY_FORMAT, parse_duration, \
+    parse_info_time, parse_summary_time, timezone, to_epoch_ns
+
+__author__ = "Niko Fink"
+
+
+def random_times(count, seed=0):
+    rng = random.Random(seed)
+    return [datetime(2010, 1, 1) + timedelta(seconds=rng.randrange(0, 10 * 365 * 86400)) for _ in range(count)]
+
+
+class ParseTest(unittest.TestCase):
+    def test_strptime(self):
+        times = random_times(5000) + [datetime(2014, 3, 10, 0, 0, 0), datetime(2014, 3, 10, 12, 30, 0),
+                                      datetime(2014, 12, 31, 23, 59, 59)]
+        for time in times:
+            value = time.strftime(INFO_FORMAT)
+            self.assertEqual(parse_info_time(value), datetime.strptime(value, INFO_FORMAT), value)
+            value = time.strftime(SUMMARY_FORMAT)
+            self.assertEqual(parse_summary_time(value), datetime.strptime(value, SUMMARY_FORMAT), value)
+
+    def test_unusual_input(self):
+        for value in ["3/1/2014 1:05:03 PM", "03/10/2014 12:00:00 am"]:
+            self.assertEqual(parse_info_time(value), datetime.strptime(value, INFO_FORMAT), value)
+        for value in ["march 1, 2014 01:05:03 PM", "March 10, 2014 11:17:44 AM"]:
+            self.assertEqual(parse_summary_time(value), datetime.strptime(value, SUMMARY_FORMAT), value)
+        for value in ["13/10/2014 11:00:00 AM", "03/10/2014 13:00:00 PM", "garbage"]:
+            with self.assertRaises(ValueError):
+                parse_info_time(value)
+
+    def test_duration(self):
+        for value in ["00:00:00", "00:23:05", "9:5:7", "23:59:59"]:
+            t = datetime.strptime(value, DURATION_FORMAT)
+            self.assertEqual(parse_duration(value), t.hour * 3600 + t.minute * 60 + t.second, value)
+        with self.assertRaises(ValueError):
+            parse_duration("24:00:00")
+
+
+class TimezoneTest(unittest.TestCase):
+    def assertSameAsPytz(self, name, times):
+        tz = pytz.timezone(name)
+        for time in times:
+            try:
+                expected = to_epoch_ns(tz.localize(time, is_dst=None))
+            except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError) as e:
+                with self.assertRaises(type(e), msg=str(time)):
+                    timezone(name).localize_ns(to_epoch_ns(time))
+            else:
+                self.assertEqual(timezone(name).localize_ns(to_epoch_ns(time)), expected, time)
+
+    def test_random_times(self):
+        self.assertSameAsPytz("Canada/Eastern", random_times(5000))
+
+    def test_dst_transitions(self):
+        # every minute around the start and end of DST, including the missing and the repeated hour
+        transitions = [datetime(2014, 3, 9, 2), datetime(2014, 11, 2, 1), datetime(2013, 11, 3, 1),
+                       datetime(2015, 3, 8, 2)]
+        times = [t + timedelta(minutes=m) for t in transitions for m in range(-120, 180)]
+        times += [datetime(2014, 3, 9, 1, 59, 59), datetime(2014, 3, 9, 3), datetime(2014, 11, 2, 0, 59, 59),
+                  datetime(2014, 11, 2, 2)]
+        self.assertSameAsPytz("Canada/Eastern", times)
+
+    def test_fixed_offset(self):
+        self.assertSameAsPytz("UTC", random_times(100))
+        self.assertSameAsPytz("Etc/GMT+5", random_times(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from drive4data.data.watermarks import Watermarks
+
+__author__ = "Niko Fink"
+
+
+class WatermarksTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "tmp", "watermarks.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_save_creates_directory(self):
+        watermarks = Watermarks(self.file)
+        watermarks.update("trips", "trips", "samples,participant=1", {'time': 10})
+        watermarks.save()
+        self.assertEqual(Watermarks(self.file).load().get("trips", "trips", "samples,participant=1"), {'time': 10})
+
+    def test_update_keeps_latest(self):
+        watermarks = Watermarks(self.file)
+        watermarks.update("trips", "trips", "samples,participant=1", {'time': 10})
+        watermarks.update("trips", "trips", "samples,participant=1", {'time': 5})
+        watermarks.update("trips", "trips", "samples,participant=1", None)
+        self.assertEqual(watermarks.get("trips", "trips", "samples,participant=1"), {'time': 10})
+
+
+if __name__ == '__main__':
+    unittest.main()